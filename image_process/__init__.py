@@ -1,3 +1,5 @@
 """
 Image Process CLI 包
 """
+
+__version__ = "0.1.5"
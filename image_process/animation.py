@@ -0,0 +1,235 @@
+"""
+动图合并模块
+
+该模块把 GIF/WebP 动图按线性或网格布局逐帧合并为动图。各输入按时间轴同步推进，
+每次只解码当前需要的一帧；背景和分隔线只绘制一次，作为每一帧的底图重复使用。
+
+不同输入帧数或时长不一致时的处理策略：
+- loop: 总时长取最长的输入，较短的输入循环播放
+- hold: 总时长取最长的输入，较短的输入播放结束后停留在最后一帧
+- lcm: 总时长取各输入时长的最小公倍数，使所有输入都完整循环后同时回到起点
+"""
+
+import os
+from typing import BinaryIO, Iterator, List, Optional, Tuple, Union
+
+from PIL import Image
+
+from . import metrics
+from .layout import LayoutPlan
+from .progress import ProgressReporter
+from .sources import Source, close_source, is_path, open_source
+
+ANIMATION_POLICIES = ("loop", "hold", "lcm")
+ANIMATED_OUTPUT_FORMATS = (".gif", ".webp")
+
+# 帧时长缺失或为 0 时使用的默认值（毫秒），与常见浏览器的处理方式一致
+DEFAULT_FRAME_DURATION = 100
+
+# lcm 策略下输出动图的最大时长（毫秒），超过时在该时间截断
+MAX_ANIMATION_DURATION = 60_000
+
+
+def is_animated_output(
+    output: Union[str, BinaryIO], output_format: Optional[str] = None
+) -> bool:
+    """
+    判断输出是否为支持动画的格式，指定了输出格式时以输出格式为准
+    """
+    if output_format:
+        return f".{output_format.lower()}" in ANIMATED_OUTPUT_FORMATS
+    if not is_path(output):
+        return False
+    return os.path.splitext(output)[1].lower() in ANIMATED_OUTPUT_FORMATS
+
+
+def has_animated_input(files: List[Source]) -> bool:
+    """
+    判断输入中是否包含多帧图片
+    """
+    for source in files:
+        im = open_source(source)
+        animated = getattr(im, "is_animated", False)
+        close_source(source, im)
+        if animated:
+            return True
+    return False
+
+
+class _FrameStream:
+    """
+    单个输入的逐帧读取器，只保留当前帧（已缩放到放置区域大小）
+    """
+
+    def __init__(self, source: Source, size: Tuple[int, int]):
+        self._source = source
+        self._im = open_source(source)
+        self.size = size
+        self.n_frames = getattr(self._im, "n_frames", 1)
+        self.animated = self.n_frames > 1
+        self.completed = not self.animated
+        self.index = 0
+        self.frame: Optional[Image.Image] = None
+        # 当前帧的显示时长，None 表示一直显示（静态图片或 hold 策略下的最后一帧）
+        self.duration: Optional[int] = None
+        self._load()
+
+    def _load(self) -> None:
+        self._im.seek(self.index)
+        frame = self._im.convert("RGBA")
+        if frame.size != self.size:
+            frame = frame.resize(self.size, Image.Resampling.LANCZOS)
+        self.frame = frame
+        if self.animated:
+            self.duration = self._im.info.get("duration") or DEFAULT_FRAME_DURATION
+
+    def advance(self, policy: str) -> bool:
+        """
+        切换到下一帧，返回是否刚好播放完一轮
+        """
+        if self.index + 1 < self.n_frames:
+            self.index += 1
+            self._load()
+            return False
+
+        self.completed = True
+        if policy == "hold":
+            self.duration = None
+        else:
+            self.index = 0
+            self._load()
+        return True
+
+    def close(self) -> None:
+        self.frame = None
+        close_source(self._source, self._im)
+
+
+def _iter_frames(
+    streams: List[_FrameStream],
+    background: Image.Image,
+    plan: LayoutPlan,
+    policy: str,
+    reporter: ProgressReporter,
+) -> Iterator[Image.Image]:
+    """
+    按时间轴生成输出帧，每帧的显示时长记录在 info["duration"] 中
+    """
+    t = 0
+    ends = [s.duration if s.duration is not None else None for s in streams]
+    while True:
+        # 编码器逐帧读取，每帧之前检查是否已取消
+        reporter.check()
+        frame = background.copy()
+        for s, (x, y, _, _) in zip(streams, plan.placements):
+            frame.paste(s.frame, (x, y), s.frame)
+        frame = frame.convert("RGB")
+
+        pending = [e for e in ends if e is not None]
+        if not pending:
+            frame.info["duration"] = DEFAULT_FRAME_DURATION
+            yield frame
+            return
+
+        next_t = min(pending)
+        truncated = next_t >= MAX_ANIMATION_DURATION
+        if truncated:
+            next_t = MAX_ANIMATION_DURATION
+        frame.info["duration"] = next_t - t
+        yield frame
+        if truncated:
+            return
+
+        all_wrapped = True
+        for i, s in enumerate(streams):
+            wrapped = False
+            if ends[i] == next_t:
+                wrapped = s.advance(policy)
+                ends[i] = next_t + s.duration if s.duration is not None else None
+            if s.animated and not wrapped:
+                all_wrapped = False
+        t = next_t
+
+        if policy == "lcm":
+            if all_wrapped:
+                return
+        elif all(s.completed for s in streams):
+            return
+
+
+def merge_animated(
+    files: List[Source],
+    output: Union[str, BinaryIO],
+    plan: LayoutPlan,
+    bg_color: Tuple[int, int, int],
+    divider_color: Tuple[int, int, int],
+    policy: str = "loop",
+    output_format: Optional[str] = None,
+    reporter: Optional[ProgressReporter] = None,
+) -> Union[str, BinaryIO]:
+    """
+    按布局规划把多张（部分可为静态的）图片合并为 GIF/WebP 动图
+    """
+    assert policy in ANIMATION_POLICIES
+    from .merge_images import _atomic_output, _compose
+
+    reporter = reporter or ProgressReporter()
+    # 背景和分隔线只绘制一次
+    background = _compose([], plan, bg_color, divider_color)
+
+    streams = []
+    try:
+        for i, (source, (_, _, w, h)) in enumerate(zip(files, plan.placements)):
+            streams.append(_FrameStream(source, (w, h)))
+            reporter.emit("decoded", i + 1, len(files))
+
+        frames = _iter_frames(streams, background, plan, policy, reporter)
+        first = next(frames)
+
+        if is_path(output):
+            extension = os.path.splitext(output)[1].lower()
+        else:
+            extension = ""
+        if output_format:
+            extension = f".{output_format.lower()}"
+
+        def save(target):
+            if extension == ".webp":
+                # WebP 编码器需要预先给出完整的时长列表
+                rest = list(frames)
+                durations = [f.info["duration"] for f in [first] + rest]
+                reporter.emit("encoding")
+                first.save(
+                    target,
+                    save_all=True,
+                    append_images=rest,
+                    duration=durations,
+                    loop=0,
+                    format=output_format,
+                )
+            else:
+                # GIF 编码器会逐帧读取 info["duration"]，可以直接传入生成器
+                reporter.emit("encoding")
+                first.save(
+                    target,
+                    save_all=True,
+                    append_images=frames,
+                    loop=0,
+                    format=output_format,
+                )
+
+        if is_path(output):
+            with _atomic_output(output) as tmp_path:
+                save(tmp_path)
+            nbytes = os.path.getsize(output)
+            metrics.record_output(first.size, nbytes)
+            reporter.emit("done", nbytes=nbytes)
+        else:
+            save(output)
+            metrics.record_output(first.size, None)
+            reporter.emit("done")
+    finally:
+        for s in streams:
+            s.close()
+
+    return output
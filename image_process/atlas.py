@@ -0,0 +1,257 @@
+"""
+精灵图集模块
+
+网格布局把每张图片缩放到统一的单元格，对尺寸各异的 UI 图标既浪费像素又会使图标变形。
+图集布局按原始尺寸用 MaxRects 算法把图片装入尽量小的画布（可以限制为 2 的幂或
+最大边长），并在输出旁写出记录每张图片位置的 JSON 坐标表（TexturePacker 的
+JSON Hash 格式，PixiJS、Phaser 等引擎可以直接读取）。
+"""
+
+import json
+import math
+import os
+from typing import Dict, List, Optional, Tuple
+
+from .layout import Box, LayoutPlan, Size
+from .sources import ARCHIVE_SEPARATOR, Source, source_name
+
+# 非 2 的幂模式下尝试的画布宽度数量
+WIDTH_CANDIDATES = 16
+
+# 未限制最大边长时 2 的幂画布的上限
+MAX_POWER_OF_TWO = 1 << 15
+
+_Rect = Tuple[int, int, int, int]
+
+
+def _prune(kept: List[_Rect], pieces: List[_Rect]) -> List[_Rect]:
+    """
+    把拆分得到的空闲矩形加入 kept，跳过被其他空闲矩形完全包含的部分
+
+    kept 中的矩形互不包含，拆分得到的部分又都小于原来的矩形，所以只需检查新的部分。
+    """
+    added: List[_Rect] = []
+    # 先加入大的部分，只需检查是否被已加入的矩形包含
+    for x, y, w, h in sorted(set(pieces), key=lambda r: r[2] * r[3], reverse=True):
+        right, bottom = x + w, y + h
+        if not any(
+            x >= rx and y >= ry and right <= rx + rw and bottom <= ry + rh
+            for rx, ry, rw, rh in kept
+        ) and not any(
+            x >= rx and y >= ry and right <= rx + rw and bottom <= ry + rh
+            for rx, ry, rw, rh in added
+        ):
+            added.append((x, y, w, h))
+    return kept + added
+
+
+def pack(
+    sizes: List[Size], bin_size: Size, bottom_left: bool = False
+) -> Optional[List[Tuple[int, int]]]:
+    """
+    用 MaxRects 算法把矩形装入 bin_size 大小的区域，返回与 sizes 顺序一致的左上角坐标
+
+    默认按最短边剩余最小（Best Short Side Fit）选择位置，适合固定大小的画布；
+    bottom_left 为 True 时优先选择底边最低的位置，适合高度不限、需要压低高度的情况。
+    装不下时返回 None。
+    """
+    bin_w, bin_h = bin_size
+    free: List[_Rect] = [(0, 0, bin_w, bin_h)]
+    positions: List[Optional[Tuple[int, int]]] = [None] * len(sizes)
+    # 先放大的矩形
+    order = sorted(
+        range(len(sizes)),
+        key=lambda i: (max(sizes[i]), sizes[i][0] * sizes[i][1]),
+        reverse=True,
+    )
+    for i in order:
+        w, h = sizes[i]
+        best = None
+        best_key = None
+        for fx, fy, fw, fh in free:
+            if w > fw or h > fh:
+                continue
+            if bottom_left:
+                key = (fy + h, fx)
+            else:
+                leftover = (fw - w, fh - h)
+                key = (min(leftover), max(leftover), fy, fx)
+            if best_key is None or key < best_key:
+                best_key = key
+                best = (fx, fy)
+        if best is None:
+            return None
+        x, y = best
+        positions[i] = best
+
+        # 与新矩形相交的空闲矩形拆分为最多四个与之不相交的最大矩形
+        kept: List[_Rect] = []
+        pieces: List[_Rect] = []
+        for f in free:
+            fx, fy, fw, fh = f
+            if x >= fx + fw or x + w <= fx or y >= fy + fh or y + h <= fy:
+                kept.append(f)
+                continue
+            if x > fx:
+                pieces.append((fx, fy, x - fx, fh))
+            if x + w < fx + fw:
+                pieces.append((x + w, fy, fx + fw - x - w, fh))
+            if y > fy:
+                pieces.append((fx, fy, fw, y - fy))
+            if y + h < fy + fh:
+                pieces.append((fx, y + h, fw, fy + fh - y - h))
+        free = _prune(kept, pieces)
+    return positions
+
+
+def _to_plan(
+    sizes: List[Size],
+    positions: List[Tuple[int, int]],
+    canvas_size: Size,
+    margin: int,
+) -> LayoutPlan:
+    placements: List[Box] = [
+        (margin + x, margin + y, w, h) for (x, y), (w, h) in zip(positions, sizes)
+    ]
+    return LayoutPlan(canvas_size, placements, [])
+
+
+def _powers_of_two(lower: int, upper: int) -> List[int]:
+    value = 1
+    while value < lower:
+        value *= 2
+    values = []
+    while value <= upper:
+        values.append(value)
+        value *= 2
+    return values
+
+
+def plan_atlas(
+    sizes: List[Size],
+    gap: int = 0,
+    margin: int = 0,
+    max_size: Optional[int] = None,
+    power_of_two: bool = False,
+) -> LayoutPlan:
+    """
+    规划图集布局：图片保持原始尺寸，互不重叠地装入尽量小的画布
+
+    gap 为相邻图片之间的最小间距，margin 为画布边距。power_of_two 为 True 时画布的宽和高
+    都是 2 的幂；max_size 限制画布的最大边长。图片无法装入时抛出 ValueError。
+    """
+    if not sizes:
+        return LayoutPlan((2 * margin, 2 * margin), [], [])
+
+    # 每个矩形向右下扩展 gap，区域同样扩展 gap，相邻图片之间就留出 gap 的间距
+    padded = [(w + gap, h + gap) for w, h in sizes]
+    area = sum(w * h for w, h in padded)
+    max_w = max(w for w, _ in padded)
+    max_h = max(h for _, h in padded)
+
+    if power_of_two:
+        upper = max_size if max_size is not None else MAX_POWER_OF_TWO
+        widths = _powers_of_two(max_w - gap + 2 * margin, upper)
+        heights = _powers_of_two(max_h - gap + 2 * margin, upper)
+        # 按面积从小到大尝试，面积相同时优先接近正方形
+        candidates = sorted(
+            ((w, h) for w in widths for h in heights if w * h >= area),
+            key=lambda s: (s[0] * s[1], abs(math.log(s[0] / s[1]))),
+        )
+        for canvas_w, canvas_h in candidates:
+            bin_size = (canvas_w - 2 * margin + gap, canvas_h - 2 * margin + gap)
+            positions = pack(padded, bin_size) or pack(padded, bin_size, True)
+            if positions is not None:
+                return _to_plan(sizes, positions, (canvas_w, canvas_h), margin)
+        raise ValueError(f"无法把 {len(sizes)} 张图片装入边长不超过 {upper} 的图集")
+
+    # 不限制为 2 的幂时尝试一组宽度，在高度不限的区域中压低高度，选择面积最小的画布
+    lower = max(max_w, math.ceil(math.sqrt(area)))
+    upper = max(lower, min(sum(w for w, _ in padded), 4 * lower))
+    if max_size is not None:
+        upper = min(upper, max_size - 2 * margin + gap)
+    if lower > upper:
+        raise ValueError(f"无法把 {len(sizes)} 张图片装入边长不超过 {max_size} 的图集")
+    widths = sorted(
+        {
+            round(lower * (upper / lower) ** (i / (WIDTH_CANDIDATES - 1)))
+            for i in range(WIDTH_CANDIDATES)
+        }
+    )
+    bin_h = sum(h for _, h in padded)
+    if max_size is not None:
+        bin_h = min(bin_h, max_size - 2 * margin + gap)
+
+    best = None
+    best_key = None
+    for width in widths:
+        positions = pack(padded, (width, bin_h), bottom_left=True)
+        if positions is None:
+            continue
+        used_w = max(x + w for (x, _), (w, _) in zip(positions, padded)) - gap
+        used_h = max(y + h for (_, y), (_, h) in zip(positions, padded)) - gap
+        canvas = (used_w + 2 * margin, used_h + 2 * margin)
+        key = (canvas[0] * canvas[1], abs(math.log(canvas[0] / canvas[1])))
+        if best_key is None or key < best_key:
+            best_key = key
+            best = (positions, canvas)
+    if best is None:
+        raise ValueError(f"无法把 {len(sizes)} 张图片装入边长不超过 {max_size} 的图集")
+    return _to_plan(sizes, best[0], best[1], margin)
+
+
+def atlas_map_path(output: str) -> str:
+    """
+    图集坐标表的路径：与输出同名，扩展名为 .json
+    """
+    return os.path.splitext(output)[0] + ".json"
+
+
+def _frame_names(sources: List[Source]) -> List[str]:
+    """
+    坐标表中的名称默认为文件名，文件名重复时使用完整路径
+
+    压缩包成员使用成员路径，无法得知名称的输入按在输入中的序号命名。
+    """
+    names = [source_name(source) or f"image_{i}" for i, source in enumerate(sources)]
+    # 压缩包成员取成员路径中的文件名，重复时使用 archive::member
+    base = [
+        os.path.basename(name.split(ARCHIVE_SEPARATOR)[-1].rstrip("/")) or name
+        for name in names
+    ]
+    counts: Dict[str, int] = {}
+    for name in base:
+        counts[name] = counts.get(name, 0) + 1
+    return [b if counts[b] == 1 else full for b, full in zip(base, names)]
+
+
+def write_atlas_map(
+    path: str, image_name: str, sources: List[Source], plan: LayoutPlan
+) -> str:
+    """
+    写出 JSON Hash 格式的坐标表，先写临时文件再替换，返回 path
+    """
+    frames = {}
+    for name, (x, y, w, h) in zip(_frame_names(sources), plan.placements):
+        frames[name] = {
+            "frame": {"x": x, "y": y, "w": w, "h": h},
+            "rotated": False,
+            "trimmed": False,
+            "spriteSourceSize": {"x": 0, "y": 0, "w": w, "h": h},
+            "sourceSize": {"w": w, "h": h},
+        }
+    canvas_w, canvas_h = plan.canvas_size
+    data = {
+        "frames": frames,
+        "meta": {
+            "app": "image-process-cli",
+            "image": image_name,
+            "size": {"w": canvas_w, "h": canvas_h},
+            "scale": "1",
+        },
+    }
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return path
@@ -7,7 +7,7 @@
 import typer
 import os
 import json
-from typing import Optional
+from typing import List, Optional, Tuple
 from image_process.main import run_cli, run_tui
 
 # Configuration directory and file
@@ -58,6 +58,191 @@ def tui():
     run_tui()
 
 
+@app.command("plan-tiles", help="规划分块渲染，把工作清单写入共享目录")
+def plan_tiles_command(
+    files: List[str] = typer.Option(..., "--files", "-f", help="要合并的图片文件列表"),
+    work_dir: str = typer.Option(..., "--work-dir", "-w", help="共享工作目录"),
+    tile_size: int = typer.Option(
+        2048, "--tile-size", help="分块边长 (像素，16 的倍数)"
+    ),
+    orientation: str = typer.Option(
+        "horizontal", "--orientation", help="图片排列方向 (horizontal/vertical)"
+    ),
+    gap: int = typer.Option(40, "--gap", help="图片间距 (像素)"),
+    divider: bool = typer.Option(True, "--divider/--no-divider", help="是否添加分隔线"),
+    divider_thickness: int = typer.Option(
+        4, "--divider-thickness", help="分隔线粗细 (像素)"
+    ),
+    divider_color: Tuple[int, int, int] = typer.Option(
+        (200, 200, 200), "--divider-color", help="分隔线颜色 (R G B)"
+    ),
+    bg_color: Tuple[int, int, int] = typer.Option(
+        (255, 255, 255), "--bg-color", help="背景颜色 (R G B)"
+    ),
+    align: str = typer.Option("center", "--align", help="对齐方式 (start/center/end)"),
+    margin: int = typer.Option(0, "--margin", help="边距 (像素)"),
+    cols: Optional[int] = typer.Option(None, "--cols", help="指定列数 (启用网格布局)"),
+    rows: Optional[int] = typer.Option(None, "--rows", help="指定行数 (启用网格布局)"),
+):
+    """规划分块渲染"""
+    from image_process.merge_images import MERGE_ERRORS
+    from image_process.tiles import plan_tiles
+
+    try:
+        manifest = plan_tiles(
+            files,
+            work_dir,
+            tile_size=tile_size,
+            orientation=orientation,
+            gap=gap,
+            divider=divider,
+            divider_thickness=divider_thickness,
+            divider_color=divider_color,
+            bg_color=bg_color,
+            align=align,
+            margin=margin,
+            cols=cols,
+            rows=rows,
+        )
+    except MERGE_ERRORS as e:
+        typer.echo(f"规划分块时出错: {str(e)}", err=True)
+        raise typer.Exit(code=1)
+    cols_n, rows_n = manifest.grid
+    typer.echo(
+        f"画布 {manifest.canvas_size[0]}x{manifest.canvas_size[1]}, "
+        f"{cols_n} x {rows_n} 共 {len(manifest.tiles)} 个分块: {work_dir}"
+    )
+
+
+@app.command("render-tile", help="认领并渲染分块，可在多个进程或机器上同时运行")
+def render_tile_command(
+    work_dir: str = typer.Option(..., "--work-dir", "-w", help="共享工作目录"),
+    stale_after: float = typer.Option(
+        120.0, "--stale-after", help="锁文件超过该秒数未更新即视为持有者已崩溃"
+    ),
+    wait: bool = typer.Option(
+        True,
+        "--wait/--no-wait",
+        help=(
+            "等待其他进程持有的分块完成 (期间接管失效的锁)，"
+            "或没有可认领的分块时立即退出"
+        ),
+    ),
+):
+    """渲染分块"""
+    from image_process.merge_images import MERGE_ERRORS
+    from image_process.tiles import run_worker
+
+    def on_tile(index: int, total: int):
+        typer.echo(f"分块 {index + 1}/{total} 渲染完成")
+
+    try:
+        rendered = run_worker(
+            work_dir, stale_after=stale_after, wait=wait, on_tile=on_tile
+        )
+    except MERGE_ERRORS as e:
+        typer.echo(f"渲染分块时出错: {str(e)}", err=True)
+        raise typer.Exit(code=1)
+    typer.echo(f"本进程渲染了 {rendered} 个分块")
+
+
+@app.command("stitch-tiles", help="把渲染完成的分块拼接为分块 TIFF、DZI 或普通图片")
+def stitch_tiles_command(
+    work_dir: str = typer.Option(..., "--work-dir", "-w", help="共享工作目录"),
+    output: str = typer.Option(
+        ..., "--output", "-o", help="输出文件 (.tif 为分块 TIFF，.dzi 为 Deep Zoom)"
+    ),
+    output_format: Optional[str] = typer.Option(
+        None, "--format", help="输出格式，DZI 时为分块格式 (默认 JPEG)"
+    ),
+):
+    """拼接分块"""
+    from image_process.merge_images import MERGE_ERRORS
+    from image_process.tiles import stitch_tiles
+
+    try:
+        result = stitch_tiles(work_dir, output, output_format)
+    except MERGE_ERRORS as e:
+        typer.echo(f"拼接分块时出错: {str(e)}", err=True)
+        raise typer.Exit(code=1)
+    typer.echo(f"拼接完成: {result}")
+
+
+@app.command("batch", help="按解码、合成、编码三个阶段流水线执行一批合并任务")
+def batch_command(
+    jobs_file: str = typer.Option(
+        ...,
+        "--jobs",
+        "-j",
+        help=(
+            "任务列表 (JSON Lines，每行包含 files、output 和 merge 的其他参数; "
+            "- 表示标准输入)"
+        ),
+    ),
+    decode_workers: int = typer.Option(1, "--decode-workers", help="解码线程数"),
+    compose_workers: int = typer.Option(1, "--compose-workers", help="合成线程数"),
+    encode_workers: int = typer.Option(1, "--encode-workers", help="编码线程数"),
+    queue_size: int = typer.Option(
+        2, "--queue-size", help="阶段之间最多积压的任务数 (限制内存占用)"
+    ),
+    force: bool = typer.Option(False, "--force", help="忽略结果指纹，强制重新合并"),
+    png_threads: Optional[int] = typer.Option(
+        None, "--png-threads", help="PNG 输出的压缩线程数，0 表示使用 CPU 核数"
+    ),
+):
+    """流水线批量合并"""
+    import sys
+    from image_process.merge_images import MERGE_ERRORS
+    from image_process.pipeline import MergePipeline
+
+    try:
+        if jobs_file == "-":
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(jobs_file, "r", encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        jobs = [json.loads(line) for line in lines if line.strip()]
+    except (OSError, json.JSONDecodeError) as e:
+        typer.echo(f"读取任务列表时出错: {str(e)}", err=True)
+        raise typer.Exit(code=1)
+
+    failed = 0
+    try:
+        pipeline = MergePipeline(
+            decode_workers=decode_workers,
+            compose_workers=compose_workers,
+            encode_workers=encode_workers,
+            queue_size=queue_size,
+            force=force,
+            png_threads=png_threads,
+        )
+    except ValueError as e:
+        typer.echo(f"错误: {str(e)}", err=True)
+        raise typer.Exit(code=1)
+    with pipeline:
+        futures = []
+        for i, job in enumerate(jobs):
+            options = {k: v for k, v in job.items() if k != "files"}
+            for key in ("divider_color", "bg_color"):
+                if key in options:
+                    options[key] = tuple(options[key])
+            try:
+                futures.append(pipeline.submit(job.get("files", []), **options))
+            except (TypeError, ValueError) as e:
+                typer.echo(f"任务 {i + 1} 无效: {str(e)}", err=True)
+                failed += 1
+        # 任务参数的类型错误要到合并时才会发现
+        for future in futures:
+            try:
+                typer.echo(f"图片合并完成: {future.result()}")
+            except (TypeError, *MERGE_ERRORS) as e:
+                typer.echo(f"合并图片时出错: {str(e)}", err=True)
+                failed += 1
+    typer.echo(f"共 {len(jobs)} 个任务，失败 {failed} 个")
+    if failed:
+        raise typer.Exit(code=1)
+
+
 @app.callback(invoke_without_command=True)
 def main(
     ctx: typer.Context,
@@ -96,6 +281,10 @@ def main(
         print("子命令:")
         print("  cli  运行命令行界面")
         print("  tui  运行文本用户界面")
+        print("  plan-tiles    规划分块渲染，把工作清单写入共享目录")
+        print("  render-tile   认领并渲染分块 (可在多个进程或机器上同时运行)")
+        print("  stitch-tiles  把分块拼接为分块 TIFF、DZI 或普通图片")
+        print("  batch         流水线批量执行 JSON Lines 任务列表中的合并任务")
         print("")
         return
 
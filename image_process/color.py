@@ -0,0 +1,175 @@
+"""
+色彩管理模块
+
+输入可能带有不同的 ICC 配置（sRGB、Display P3、CMYK 等），直接 convert("RGB") 会忽略配置
+导致颜色偏移。该模块把输入从嵌入的配置转换到指定的目标配置，输出时嵌入目标配置。
+
+构建 ImageCms 转换的开销远大于应用转换，转换按 (源配置哈希, 目标配置哈希, 渲染意图,
+输入模式, 输出模式) 缓存在进程内，所有输入共用同一配置时整批只构建一次，同一进程中的
+多次合并也共用缓存。
+"""
+
+import functools
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from PIL import Image, ImageCms
+
+from . import metrics
+
+# 内置的目标配置名称，其他值视为 ICC 文件路径
+BUILTIN_PROFILES = ("srgb",)
+
+RENDERING_INTENTS = {
+    "perceptual": ImageCms.Intent.PERCEPTUAL,
+    "relative": ImageCms.Intent.RELATIVE_COLORIMETRIC,
+    "saturation": ImageCms.Intent.SATURATION,
+    "absolute": ImageCms.Intent.ABSOLUTE_COLORIMETRIC,
+}
+
+# 构建转换时使用的输入模式，其他模式先转换为 RGB/RGBA
+_CMS_MODES = ("RGB", "RGBA", "CMYK", "L")
+
+# 进程内最多缓存的转换数量，超出时淘汰最久未使用的转换
+MAX_CACHED_TRANSFORMS = 64
+
+_TransformKey = Tuple[str, str, str, str, str]
+
+_TRANSFORMS: "OrderedDict[_TransformKey, ImageCms.ImageCmsTransform]" = OrderedDict()
+_TRANSFORMS_LOCK = threading.Lock()
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _srgb_bytes() -> bytes:
+    """
+    内置 sRGB 配置的字节数据，只构建一次
+
+    配置头中记录了创建时间，每次构建得到的字节和哈希都不同，会使转换缓存失效。
+    """
+    return ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+
+
+def load_profile(spec: str) -> bytes:
+    """
+    读取目标配置：内置名称 (srgb) 或 ICC 文件路径，返回配置的字节数据
+    """
+    if spec.lower() in BUILTIN_PROFILES:
+        return _srgb_bytes()
+    with open(spec, "rb") as f:
+        data = f.read()
+    try:
+        ImageCms.ImageCmsProfile(io.BytesIO(data))
+    except (OSError, ImageCms.PyCMSError) as e:
+        raise ValueError(f"无效的 ICC 配置 '{spec}': {e}") from e
+    return data
+
+
+def clear_cache() -> None:
+    """
+    清空转换缓存
+    """
+    with _TRANSFORMS_LOCK:
+        _TRANSFORMS.clear()
+
+
+def _get_transform(
+    source: bytes,
+    source_digest: str,
+    target: bytes,
+    target_digest: str,
+    intent: str,
+    in_mode: str,
+    out_mode: str,
+) -> ImageCms.ImageCmsTransform:
+    key = (source_digest, target_digest, intent, in_mode, out_mode)
+    with _TRANSFORMS_LOCK:
+        transform = _TRANSFORMS.get(key)
+        if transform is not None:
+            _TRANSFORMS.move_to_end(key)
+    if transform is not None:
+        metrics.CACHE_REQUESTS.inc(cache="icc", result="hit")
+        return transform
+    metrics.CACHE_REQUESTS.inc(cache="icc", result="miss")
+    transform = ImageCms.buildTransform(
+        ImageCms.ImageCmsProfile(io.BytesIO(source)),
+        ImageCms.ImageCmsProfile(io.BytesIO(target)),
+        in_mode,
+        out_mode,
+        RENDERING_INTENTS[intent],
+    )
+    # 多个线程同时构建时保留先放入的一个
+    with _TRANSFORMS_LOCK:
+        transform = _TRANSFORMS.setdefault(key, transform)
+        while len(_TRANSFORMS) > MAX_CACHED_TRANSFORMS:
+            _TRANSFORMS.popitem(last=False)
+        return transform
+
+
+class ColorManager:
+    """
+    把图片从嵌入的 ICC 配置转换到目标配置
+
+    没有嵌入配置的图片视为 sRGB；没有配置的 CMYK 图片无法确定颜色，
+    按 Pillow 的方式转换。
+    """
+
+    def __init__(self, profile: str = "srgb", intent: str = "perceptual"):
+        if intent not in RENDERING_INTENTS:
+            raise ValueError(f"未知的渲染意图 '{intent}'")
+        self.profile = load_profile(profile)
+        self.intent = intent
+        self._digest = _digest(self.profile)
+        self._srgb = _srgb_bytes()
+
+    def convert(
+        self, im: Image.Image, icc_profile: Optional[bytes] = None
+    ) -> Image.Image:
+        """
+        返回转换到目标配置的图片，结果为 RGB（带透明通道时为 RGBA），无需转换时返回原图
+
+        icc_profile 为 None 时使用 im.info 中嵌入的配置。16 位等无法管理的模式原样返回。
+        """
+        source = icc_profile or im.info.get("icc_profile")
+        if im.mode in ("P", "PA", "LA"):
+            has_alpha = im.mode != "P" or "transparency" in im.info
+            if im.mode == "LA" and source:
+                # 灰度配置只能转换 L，透明通道单独保留
+                alpha = im.getchannel("A")
+                out = self.convert(im.convert("L"), source)
+                out.putalpha(alpha)
+                return out
+            im = im.convert("RGBA" if has_alpha else "RGB")
+        if im.mode not in _CMS_MODES:
+            return im
+        if not source:
+            if im.mode == "CMYK":
+                return im.convert("RGB")
+            if im.mode == "L":
+                return im
+            source = self._srgb
+        source_digest = _digest(source)
+        if source_digest == self._digest:
+            return im if im.mode != "CMYK" else im.convert("RGB")
+
+        out_mode = "RGBA" if im.mode == "RGBA" else "RGB"
+        try:
+            transform = _get_transform(
+                source,
+                source_digest,
+                self.profile,
+                self._digest,
+                self.intent,
+                im.mode,
+                out_mode,
+            )
+        except (OSError, ImageCms.PyCMSError):
+            # 嵌入的配置损坏或与图片模式不符时忽略配置
+            return im.convert(out_mode)
+        return transform.apply(im)
@@ -34,6 +34,9 @@ class ConfigManager:
         self.margin: int = 0
         self.cols: Optional[int] = None
         self.rows: Optional[int] = None
+        # 文件选择器是否递归扫描子目录，以及文件名过滤通配符（空字符串表示不过滤）
+        self.scan_recursive: bool = False
+        self.scan_pattern: str = ""
 
         if load_saved_config:
             self.load_config()
@@ -68,6 +71,10 @@ class ConfigManager:
                     self.margin = config.get("margin", self.margin)
                     self.cols = config.get("cols", self.cols)
                     self.rows = config.get("rows", self.rows)
+                    self.scan_recursive = config.get(
+                        "scan_recursive", self.scan_recursive
+                    )
+                    self.scan_pattern = config.get("scan_pattern", self.scan_pattern)
         except (FileNotFoundError, json.JSONDecodeError):
             pass  # 如果文件不存在或解析失败，则使用默认配置
 
@@ -102,6 +109,8 @@ class ConfigManager:
                 "margin": self.margin,
                 "cols": self.cols,
                 "rows": self.rows,
+                "scan_recursive": self.scan_recursive,
+                "scan_pattern": self.scan_pattern,
             }
         )
 
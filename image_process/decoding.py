@@ -0,0 +1,342 @@
+"""
+图片解码模块
+
+该模块负责按目标尺寸打开图片。对 JPEG 等支持降采样解码的格式使用 draft 模式，
+只解码到不小于目标尺寸的最低分辨率，避免为小尺寸输出解码完整分辨率的图片。
+
+相机拍摄的 JPEG 通常在 EXIF 中嵌入约 160 像素的缩略图。允许一定的画质损失时，
+目标尺寸足够小就直接解码嵌入的缩略图，完全跳过原图的解码。
+
+未压缩的 BMP、PPM/PGM 和 TIFF 的像素数据在文件中按行连续存放，可以内存映射后按条带
+读取，不必先把整张图片解码到内存中。
+"""
+
+import io
+import math
+import mmap
+import os
+import struct
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from PIL import Image, ImageStat
+
+from .sources import Source, is_path, open_source
+
+# 缩略图与原图宽高比的相对差异在该范围内时视为同一画面
+ASPECT_TOLERANCE = 0.02
+
+# 缩略图与原图宽高比不同时，被裁掉的边缘标准差不超过该值才视为填充的黑边
+LETTERBOX_MAX_STDDEV = 8.0
+
+# EXIF IFD1 中记录缩略图位置和长度的标签
+_JPEG_INTERCHANGE_FORMAT = 0x0201
+_JPEG_INTERCHANGE_FORMAT_LENGTH = 0x0202
+
+
+def open_reduced(
+    source: Source,
+    target_size: Optional[Tuple[int, int]],
+    thumbnail_tolerance: Optional[float] = None,
+) -> Image.Image:
+    """
+    打开图片，并在格式支持时按目标尺寸配置降采样解码
+
+    返回的图片尚未加载像素，调用方读取像素时才会真正解码。
+    传入已打开的图片对象时直接在其上配置，已加载像素的图片不受影响。
+
+    thumbnail_tolerance 不为 None 时，如果嵌入的 EXIF 缩略图不小于目标尺寸的
+    (1 - thumbnail_tolerance) 倍，则改为返回缩略图。0 表示缩略图必须不小于目标尺寸。
+    """
+    im = open_source(source)
+    if thumbnail_tolerance is not None and target_size is not None:
+        thumb = thumbnail_for_target(im, target_size, thumbnail_tolerance)
+        if thumb is not None:
+            # 缩略图与原图使用同一色彩配置
+            if "icc_profile" in im.info:
+                thumb.info["icc_profile"] = im.info["icc_profile"]
+            if im is not source:
+                im.close()
+            return thumb
+    draft_for_target(im, target_size)
+    return im
+
+
+def draft_for_target(im: Image.Image, target_size: Optional[Tuple[int, int]]) -> None:
+    """
+    为尚未加载的图片配置降采样解码，解码结果不小于目标尺寸
+
+    draft 只对 JPEG/PCD 生效，其他格式保持原样。配置后 im.size 会变为降采样后的尺寸。
+    """
+    if target_size is None:
+        return
+    w, h = target_size
+    if 0 < w < im.width and 0 < h < im.height:
+        im.draft(None, (w, h))
+
+
+def exif_thumbnail_data(im: Image.Image) -> Optional[bytes]:
+    """
+    从 JPEG 的 EXIF 数据中取出嵌入的 JPEG 缩略图（IFD1），没有时返回 None
+    """
+    exif = im.info.get("exif") if im.format == "JPEG" else None
+    if not exif:
+        return None
+    if exif.startswith(b"Exif\0\0"):
+        exif = exif[6:]
+    try:
+        order = {b"II": "<", b"MM": ">"}[exif[:2]]
+        ifd0 = struct.unpack_from(f"{order}I", exif, 4)[0]
+        (count,) = struct.unpack_from(f"{order}H", exif, ifd0)
+        (ifd1,) = struct.unpack_from(f"{order}I", exif, ifd0 + 2 + 12 * count)
+        if ifd1 == 0:
+            return None
+        (count,) = struct.unpack_from(f"{order}H", exif, ifd1)
+        tags = {}
+        for i in range(count):
+            tag, kind, _ = struct.unpack_from(f"{order}HHI", exif, ifd1 + 2 + 12 * i)
+            # 偏移量和长度为 SHORT 或 LONG
+            value_format = "H" if kind == 3 else "I"
+            (tags[tag],) = struct.unpack_from(
+                f"{order}{value_format}", exif, ifd1 + 2 + 12 * i + 8
+            )
+    except (KeyError, struct.error):
+        return None
+
+    offset = tags.get(_JPEG_INTERCHANGE_FORMAT)
+    length = tags.get(_JPEG_INTERCHANGE_FORMAT_LENGTH)
+    if not offset or not length:
+        return None
+    data = exif[offset : offset + length]
+    if len(data) != length or not data.startswith(b"\xff\xd8"):
+        return None
+    return data
+
+
+def _match_aspect(thumb: Image.Image, size: Tuple[int, int]) -> Optional[Image.Image]:
+    """
+    使缩略图与原图的画面一致，无法确认时返回 None
+
+    缩略图与原图朝向相同（EXIF 方向标签同时作用于两者）。宽高比相同时直接使用；
+    相机为 3:2 的原图生成 4:3 缩略图时会填充黑边，此时裁掉黑边；缩略图相对原图转置
+    （原图被软件旋转而缩略图未更新）或宽高比不同且不是黑边时放弃使用。
+    """
+    width, height = size
+    ratio = (thumb.width / thumb.height) / (width / height)
+    if abs(math.log(ratio)) <= ASPECT_TOLERANCE:
+        return thumb
+    transposed = (thumb.width / thumb.height) / (height / width)
+    if abs(math.log(transposed)) <= ASPECT_TOLERANCE or abs(math.log(ratio)) > 0.35:
+        # 转置的缩略图，或差异过大（超过 16:9 与 4:3 之间的差异）不可能是黑边
+        return None
+
+    # 裁掉居中画面之外的部分，边界向内取整以免残留黑边
+    if ratio > 1:
+        content = thumb.height * width / height
+        box = (
+            math.ceil((thumb.width - content) / 2),
+            0,
+            math.floor((thumb.width + content) / 2),
+            thumb.height,
+        )
+        bars = [(0, 0, box[0], thumb.height), (box[2], 0, thumb.width, thumb.height)]
+    else:
+        content = thumb.width * height / width
+        box = (
+            0,
+            math.ceil((thumb.height - content) / 2),
+            thumb.width,
+            math.floor((thumb.height + content) / 2),
+        )
+        bars = [(0, 0, thumb.width, box[1]), (0, box[3], thumb.width, thumb.height)]
+
+    for bar in bars:
+        if bar[2] <= bar[0] or bar[3] <= bar[1]:
+            continue
+        if max(ImageStat.Stat(thumb.crop(bar)).stddev) > LETTERBOX_MAX_STDDEV:
+            return None
+    return thumb.crop(box)
+
+
+def thumbnail_for_target(
+    im: Image.Image, target_size: Tuple[int, int], tolerance: float
+) -> Optional[Image.Image]:
+    """
+    返回足以满足目标尺寸的 EXIF 缩略图（已解码），不满足条件时返回 None
+    """
+    w, h = target_size
+    if w >= im.width or h >= im.height:
+        return None
+    data = exif_thumbnail_data(im)
+    if data is None:
+        return None
+    scale = 1.0 - tolerance
+    # 先根据文件头判断尺寸，太小时无需解码
+    try:
+        thumb = Image.open(io.BytesIO(data))
+        if thumb.width < w * scale or thumb.height < h * scale:
+            return None
+        thumb.load()
+    except (OSError, SyntaxError):
+        return None
+    if thumb.mode != im.mode:
+        thumb = thumb.convert(im.mode)
+    thumb = _match_aspect(thumb, im.size)
+    if thumb is None or thumb.width < w * scale or thumb.height < h * scale:
+        return None
+    return thumb
+
+
+# 内存映射的图片每次读取的条带大小（字节）
+MAPPED_BAND_BYTES = 4 << 20
+
+# 可以内存映射的原始数据格式及每个像素的字节数，只支持按整字节存储的格式
+_RAW_PIXEL_BYTES = {
+    "L": 1,
+    "RGB": 3,
+    "BGR": 3,
+    "RGBA": 4,
+    "BGRA": 4,
+    "RGBX": 4,
+    "BGRX": 4,
+    "I;16": 2,
+    "I;16L": 2,
+    "I;16B": 2,
+}
+
+# 调色板图片需要额外的调色板信息，不做内存映射
+MAPPED_MODES = ("L", "RGB", "RGBA", "I", "I;16", "I;16L", "I;16B")
+
+# 可能以未压缩的原始数据存放像素的格式，其他格式不检查能否映射
+MAPPED_FORMATS = ("BMP", "PPM", "TIFF")
+
+
+class _Strip(NamedTuple):
+    """
+    文件中连续存放的一段像素行
+    """
+
+    top: int
+    bottom: int
+    offset: int
+    rawmode: str
+    stride: int
+    # 1 表示自上而下存放，-1 表示自下而上（BMP）
+    orientation: int
+
+
+class MappedImage:
+    """
+    内存映射的未压缩图片文件，按条带读取像素
+
+    条带图片直接引用映射的内存：L/RGBA/I;16 等 Pillow 能直接映射的格式不复制像素，
+    RGB 等格式只复制当前条带。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        mode: str,
+        size: Tuple[int, int],
+        strips: List[_Strip],
+        icc_profile: Optional[bytes] = None,
+    ):
+        self.mode = mode
+        self.size = size
+        self.icc_profile = icc_profile
+        self._strips = strips
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def width(self) -> int:
+        return self.size[0]
+
+    @property
+    def height(self) -> int:
+        return self.size[1]
+
+    def bands(
+        self, max_bytes: int = MAPPED_BAND_BYTES
+    ) -> Iterator[Tuple[int, Image.Image]]:
+        """
+        依次返回 (起始行, 条带图片)，条带覆盖整张图片
+        """
+        view = memoryview(self._map)
+        for strip in self._strips:
+            rows = max(1, max_bytes // strip.stride)
+            for top in range(strip.top, strip.bottom, rows):
+                bottom = min(top + rows, strip.bottom)
+                # 自下而上存放时，条带在文件中的位置从文件中该段的末尾算起
+                if strip.orientation > 0:
+                    start = strip.offset + (top - strip.top) * strip.stride
+                else:
+                    start = strip.offset + (strip.bottom - bottom) * strip.stride
+                data = view[start : start + (bottom - top) * strip.stride]
+                yield (
+                    top,
+                    Image.frombuffer(
+                        self.mode,
+                        (self.width, bottom - top),
+                        data,
+                        "raw",
+                        strip.rawmode,
+                        strip.stride,
+                        strip.orientation,
+                    ),
+                )
+
+    def close(self) -> None:
+        try:
+            self._map.close()
+        except BufferError:
+            # 仍有条带图片引用映射的内存，随条带一起由垃圾回收释放
+            pass
+
+    def __enter__(self) -> "MappedImage":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def map_uncompressed(source: Source) -> Optional[MappedImage]:
+    """
+    输入为像素按行连续存放的未压缩文件时返回内存映射，否则返回 None
+    """
+    if not is_path(source) or not os.path.isfile(source):
+        return None
+    try:
+        with Image.open(source) as im:
+            mode, size, tiles = im.mode, im.size, im.tile
+            icc_profile = im.info.get("icc_profile")
+        file_size = os.path.getsize(source)
+    except (OSError, SyntaxError):
+        return None
+    if mode not in MAPPED_MODES or not tiles:
+        return None
+
+    width, height = size
+    strips = []
+    next_row = 0
+    for tile in tiles:
+        args = (tile.args,) if isinstance(tile.args, str) else tuple(tile.args)
+        rawmode, stride, orientation = (args + (0, 1))[:3]
+        x0, y0, x1, y1 = tile.extents
+        pixel_bytes = _RAW_PIXEL_BYTES.get(rawmode)
+        # 只接受整行、按顺序覆盖整张图片的原始数据
+        if (
+            tile.codec_name != "raw"
+            or pixel_bytes is None
+            or (x0, x1) != (0, width)
+            or y0 != next_row
+            or orientation not in (1, -1)
+        ):
+            return None
+        stride = stride or width * pixel_bytes
+        if stride < width * pixel_bytes or tile.offset + stride * (y1 - y0) > file_size:
+            return None
+        strips.append(_Strip(y0, y1, tile.offset, rawmode, stride, orientation))
+        next_row = y1
+    if next_row != height:
+        return None
+    return MappedImage(source, mode, size, strips, icc_profile)
@@ -0,0 +1,455 @@
+"""
+合并结果一致性校验模块
+
+任何更快的合并实现（低内存模式、降采样解码、窄模式合成等）都必须与参考实现
+_merge_images_linear/_merge_images_grid 输出完全相同的像素，或者保证差异在声明的
+PSNR 容差之内。该模块生成一组参数组合，用参考实现和每个已注册的实现分别合并，
+逐一比较结果并统计加速比。
+
+内存映射、JPEG 降采样解码和 EXIF 缩略图只对文件输入生效，所以除内存中的合成图片外，
+还会把测试图片写成 JPEG（带/不带 EXIF 缩略图）、BMP（自下而上/自上而下）、PGM 和
+未压缩的 TIFF 文件作为输入。
+
+用法: python -m image_process.equivalence [--engine low_memory] [--files a.png ...]
+"""
+
+import io
+import itertools
+import math
+import os
+import struct
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from PIL import Image, ImageChops, ImageStat
+
+from .merge_images import (
+    _merge_images_grid,
+    _merge_images_linear,
+    merge_images,
+    merge_layouts,
+)
+from .sources import Source, open_source
+
+# 合并实现: engine(files, output, output_format, **options)，结果写入 output
+Engine = Callable[..., Any]
+
+# 默认使用无损且编码开销很小的格式，使计时主要反映合成本身
+DEFAULT_FORMAT = "BMP"
+
+# 降采样解码允许的最低 PSNR（dB）
+MIN_PSNR_REDUCED = 40.0
+
+# 使用 EXIF 缩略图时允许的最低 PSNR（dB），缩略图经过一次额外的有损压缩
+MIN_PSNR_THUMBNAIL = 35.0
+
+# 写成文件的测试图片尺寸，足够大时 uniform_* 缩小后才会触发降采样解码
+FILE_SIZES = [(480, 320), (256, 384), (640, 200), (360, 360), (198, 462)]
+
+# 嵌入的 EXIF 缩略图的最大边长，与相机生成的缩略图相近
+EXIF_THUMBNAIL_SIZE = 160
+
+
+class EngineSpec(NamedTuple):
+    """
+    已注册的合并实现
+
+    min_psnr 为 None 时要求与参考实现逐像素一致，否则要求 PSNR 不低于该值（dB）。
+    """
+
+    name: str
+    render: Engine
+    min_psnr: Optional[float]
+
+
+class CaseResult(NamedTuple):
+    """
+    单个参数组合的校验结果
+    """
+
+    engine: str
+    inputs: str
+    options: Dict[str, Any]
+    exact: bool
+    # 尺寸不同时为 None，完全一致时为 inf
+    psnr: Optional[float]
+    passed: bool
+    reference_seconds: float
+    engine_seconds: float
+
+
+ENGINES: Dict[str, EngineSpec] = {}
+
+
+def register_engine(
+    name: str, render: Engine, min_psnr: Optional[float] = None
+) -> None:
+    """
+    注册一个需要与参考实现对比的合并实现
+    """
+    ENGINES[name] = EngineSpec(name, render, min_psnr)
+
+
+def render_reference(
+    files: List[Source], output: io.BytesIO, output_format: str, **options
+) -> None:
+    """
+    参考实现：全部解码为 RGBA 后调用原有的线性或网格合并函数
+    """
+    images = [open_source(f).convert("RGBA") for f in files]
+    if options.get("cols") is not None or options.get("rows") is not None:
+        _merge_images_grid(
+            images=images,
+            output=output,
+            gap=options["gap"],
+            divider=options["divider"],
+            divider_thickness=options["divider_thickness"],
+            divider_color=options["divider_color"],
+            bg_color=options["bg_color"],
+            align=options["align"],
+            margin=options["margin"],
+            cols=options["cols"],
+            rows=options["rows"],
+            output_format=output_format,
+        )
+    else:
+        _merge_images_linear(
+            images=images,
+            output=output,
+            orientation=options["orientation"],
+            gap=options["gap"],
+            divider=options["divider"],
+            divider_thickness=options["divider_thickness"],
+            divider_color=options["divider_color"],
+            bg_color=options["bg_color"],
+            align=options["align"],
+            uniform_height=options["uniform_height"],
+            uniform_width=options["uniform_width"],
+            margin=options["margin"],
+            output_format=output_format,
+        )
+
+
+def _render_low_memory(
+    files: List[Source], output: io.BytesIO, output_format: str, **options
+) -> None:
+    merge_images(files, output, low_memory=True, output_format=output_format, **options)
+
+
+# JPEG 等格式在低内存模式下按目标尺寸降采样解码，结果与完整解码后缩放略有差异
+register_engine("low_memory", _render_low_memory, min_psnr=MIN_PSNR_REDUCED)
+
+
+def _render_default(
+    files: List[Source], output: io.BytesIO, output_format: str, **options
+) -> None:
+    merge_images(files, output, output_format=output_format, **options)
+
+
+# 输入模式一致时 merge_images 默认在窄模式（L/LA/RGB）下合成
+register_engine("mode_preserving", _render_default)
+
+
+def _render_fan_out(
+    files: List[Source], output: io.BytesIO, output_format: str, **options
+) -> None:
+    merge_layouts(files, [dict(options, output=output, output_format=output_format)])
+
+
+register_engine("fan_out", _render_fan_out)
+
+
+def _render_exif_thumbnail(
+    files: List[Source], output: io.BytesIO, output_format: str, **options
+) -> None:
+    merge_images(
+        files, output, thumbnail_tolerance=0.0, output_format=output_format, **options
+    )
+
+
+# 放置区域不大于 EXIF 缩略图时直接解码缩略图，其余 JPEG 按目标尺寸降采样解码
+register_engine("exif_thumbnail", _render_exif_thumbnail, min_psnr=MIN_PSNR_THUMBNAIL)
+
+
+def option_grid() -> Iterator[Dict[str, Any]]:
+    """
+    生成需要校验的参数组合
+    """
+    for orientation, align, divider, (gap, margin), uniform, shape in itertools.product(
+        ("horizontal", "vertical"),
+        ("start", "center", "end"),
+        (True, False),
+        ((0, 0), (12, 0), (0, 8), (12, 8)),
+        (None, 60),
+        ((None, None), (2, None), (None, 2), (3, 3)),
+    ):
+        yield {
+            "orientation": orientation,
+            "gap": gap,
+            "divider": divider,
+            "divider_thickness": 4,
+            "divider_color": (200, 200, 200),
+            "bg_color": (255, 255, 255),
+            "align": align,
+            "uniform_height": uniform if orientation == "horizontal" else None,
+            "uniform_width": uniform if orientation == "vertical" else None,
+            "margin": margin,
+            "cols": shape[0],
+            "rows": shape[1],
+        }
+
+
+def synthetic_inputs() -> Dict[str, List[Image.Image]]:
+    """
+    生成尺寸各不相同的测试图片：不透明/半透明的彩色图和灰度图
+    """
+    return _test_images([(120, 80), (64, 96), (200, 50), (90, 90), (33, 77)])
+
+
+def _test_images(sizes: List[Tuple[int, int]]) -> Dict[str, List[Image.Image]]:
+    inputs: Dict[str, List[Image.Image]] = {
+        "opaque": [],
+        "alpha": [],
+        "gray": [],
+        "gray_alpha": [],
+    }
+    for i, size in enumerate(sizes):
+        horizontal = Image.linear_gradient("L").rotate(90 * i).resize(size)
+        vertical = Image.linear_gradient("L").resize(size)
+        radial = Image.radial_gradient("L").resize(size)
+        alpha = ImageChops.invert(radial)
+        rgb = Image.merge("RGB", (horizontal, vertical, radial))
+        inputs["opaque"].append(rgb)
+        inputs["alpha"].append(Image.merge("RGBA", (*rgb.split(), alpha)))
+        inputs["gray"].append(horizontal)
+        inputs["gray_alpha"].append(Image.merge("LA", (horizontal, alpha)))
+    return inputs
+
+
+def _exif_with_thumbnail(thumbnail: bytes) -> bytes:
+    """
+    构造只包含 IFD1 缩略图的 EXIF 数据（小端），IFD0 没有条目
+    """
+    # TIFF 头 8 字节 + IFD0 6 字节 + IFD1（2 个条目）30 字节之后是缩略图
+    ifd1 = struct.pack("<H", 2)
+    ifd1 += struct.pack("<HHII", 0x0201, 4, 1, 44)
+    ifd1 += struct.pack("<HHII", 0x0202, 4, 1, len(thumbnail))
+    ifd1 += struct.pack("<I", 0)
+    tiff = b"II*\0" + struct.pack("<I", 8) + struct.pack("<HI", 0, 14) + ifd1
+    return b"Exif\0\0" + tiff + thumbnail
+
+
+def _save_jpeg_with_thumbnail(im: Image.Image, path: str) -> None:
+    thumb = im.copy()
+    thumb.thumbnail((EXIF_THUMBNAIL_SIZE, EXIF_THUMBNAIL_SIZE))
+    buffer = io.BytesIO()
+    thumb.save(buffer, "JPEG", quality=90)
+    im.save(path, "JPEG", quality=90, exif=_exif_with_thumbnail(buffer.getvalue()))
+
+
+def _save_top_down_bmp(im: Image.Image, path: str) -> None:
+    """
+    保存为自上而下存放（高度为负）的 BMP，Pillow 只写自下而上的 BMP
+    """
+    buffer = io.BytesIO()
+    im.save(buffer, "BMP")
+    data = bytearray(buffer.getvalue())
+    (offset,) = struct.unpack_from("<I", data, 10)
+    (height,) = struct.unpack_from("<i", data, 22)
+    stride = (len(data) - offset) // height
+    rows = [
+        data[offset + i * stride : offset + (i + 1) * stride] for i in range(height)
+    ]
+    data[offset:] = b"".join(reversed(rows))
+    struct.pack_into("<i", data, 22, -height)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def file_inputs(directory: str) -> Dict[str, List[str]]:
+    """
+    把测试图片写入 directory，返回各组输入的文件路径
+
+    - jpeg: 偶数张带 EXIF 缩略图，奇数张不带
+    - bmp: 偶数张自下而上存放，奇数张自上而下存放
+    - pgm: 8 位灰度 PGM
+    - tiff: 未压缩的 RGBA TIFF
+    """
+    images = _test_images(FILE_SIZES)
+    inputs: Dict[str, List[str]] = {"jpeg": [], "bmp": [], "pgm": [], "tiff": []}
+    for i in range(len(FILE_SIZES)):
+        rgb, rgba, gray = images["opaque"][i], images["alpha"][i], images["gray"][i]
+        path = os.path.join(directory, f"{i}.jpg")
+        if i % 2 == 0:
+            _save_jpeg_with_thumbnail(rgb, path)
+        else:
+            rgb.save(path, "JPEG", quality=90)
+        inputs["jpeg"].append(path)
+
+        path = os.path.join(directory, f"{i}.bmp")
+        if i % 2 == 0:
+            rgb.save(path, "BMP")
+        else:
+            _save_top_down_bmp(rgb, path)
+        inputs["bmp"].append(path)
+
+        path = os.path.join(directory, f"{i}.pgm")
+        gray.save(path, "PPM")
+        inputs["pgm"].append(path)
+
+        path = os.path.join(directory, f"{i}.tif")
+        rgba.save(path, "TIFF")
+        inputs["tiff"].append(path)
+    return inputs
+
+
+def compare(
+    reference: Image.Image, candidate: Image.Image
+) -> Tuple[bool, Optional[float]]:
+    """
+    比较两张图片，返回 (是否逐像素一致, PSNR)
+    """
+    if reference.size != candidate.size:
+        return False, None
+    reference = reference.convert("RGB")
+    candidate = candidate.convert("RGB")
+    diff = ImageChops.difference(reference, candidate)
+    if diff.getbbox() is None:
+        return True, math.inf
+    pixels = reference.width * reference.height * 3
+    mse = sum(ImageStat.Stat(diff).sum2) / pixels
+    return False, 10 * math.log10(255**2 / mse)
+
+
+def _timed_render(
+    render: Engine,
+    files: List[Source],
+    options: Dict[str, Any],
+    output_format: str,
+    repeat: int,
+) -> Tuple[Image.Image, float]:
+    """
+    合并 repeat 次，返回结果和最短耗时
+    """
+    best = math.inf
+    for _ in range(repeat):
+        output = io.BytesIO()
+        start = time.perf_counter()
+        render(files, output, output_format, **options)
+        best = min(best, time.perf_counter() - start)
+    output.seek(0)
+    return Image.open(output), best
+
+
+def run_equivalence(
+    engines: Optional[List[str]] = None,
+    inputs: Optional[Dict[str, List[Source]]] = None,
+    grid: Optional[List[Dict[str, Any]]] = None,
+    output_format: str = DEFAULT_FORMAT,
+    repeat: int = 1,
+) -> List[CaseResult]:
+    """
+    对每组输入和每个参数组合，分别用参考实现和各个已注册实现合并并比较结果
+    """
+    specs = [ENGINES[name] for name in (engines or list(ENGINES))]
+    inputs = inputs if inputs is not None else synthetic_inputs()
+    grid = grid if grid is not None else list(option_grid())
+
+    results = []
+    for input_name, files in inputs.items():
+        for options in grid:
+            reference, reference_seconds = _timed_render(
+                render_reference, files, options, output_format, repeat
+            )
+            for spec in specs:
+                candidate, engine_seconds = _timed_render(
+                    spec.render, files, options, output_format, repeat
+                )
+                exact, psnr = compare(reference, candidate)
+                if spec.min_psnr is None:
+                    passed = exact
+                else:
+                    passed = psnr is not None and psnr >= spec.min_psnr
+                results.append(
+                    CaseResult(
+                        engine=spec.name,
+                        inputs=input_name,
+                        options=options,
+                        exact=exact,
+                        psnr=psnr,
+                        passed=passed,
+                        reference_seconds=reference_seconds,
+                        engine_seconds=engine_seconds,
+                    )
+                )
+    return results
+
+
+def format_report(results: List[CaseResult]) -> str:
+    """
+    生成校验报告：每个实现的汇总，以及所有未通过的参数组合
+    """
+    lines = []
+    for name in dict.fromkeys(r.engine for r in results):
+        cases = [r for r in results if r.engine == name]
+        exact = sum(r.exact for r in cases)
+        failed = [r for r in cases if not r.passed]
+        psnrs = [r.psnr for r in cases if not r.exact and r.psnr is not None]
+        speedup = sum(r.reference_seconds for r in cases) / max(
+            sum(r.engine_seconds for r in cases), 1e-9
+        )
+        line = (
+            f"{name}: {len(cases)} 个组合, 完全一致 {exact}, "
+            f"容差内 {len(cases) - exact - len(failed)}, 不通过 {len(failed)}, "
+            f"加速比 {speedup:.2f}x"
+        )
+        if psnrs:
+            line += f", 最低 PSNR {min(psnrs):.2f} dB"
+        lines.append(line)
+        for r in failed:
+            psnr = "尺寸不同" if r.psnr is None else f"PSNR {r.psnr:.2f} dB"
+            lines.append(f"  不通过 [{r.inputs}] {psnr}: {r.options}")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    import typer
+
+    def verify(
+        engine: Optional[List[str]] = typer.Option(
+            None, "--engine", "-e", help="要校验的实现 (默认全部)"
+        ),
+        files: Optional[List[str]] = typer.Option(
+            None, "--files", "-f", help="额外使用这些图片作为一组输入"
+        ),
+        repeat: int = typer.Option(1, "--repeat", help="每个组合重复合并的次数"),
+        output_format: str = typer.Option(
+            DEFAULT_FORMAT, "--format", help="比较时使用的无损输出格式"
+        ),
+    ):
+        """
+        校验各个合并实现与参考实现的输出是否一致
+        """
+        unknown = [name for name in engine or [] if name not in ENGINES]
+        if unknown:
+            typer.echo(
+                f"错误: 未知的实现 {', '.join(unknown)} (可选: {', '.join(ENGINES)})",
+                err=True,
+            )
+            raise typer.Exit(code=1)
+        with tempfile.TemporaryDirectory() as directory:
+            inputs: Dict[str, List[Source]] = dict(synthetic_inputs())
+            inputs.update(file_inputs(directory))
+            if files:
+                inputs["files"] = list(files)
+            results = run_equivalence(engine, inputs, None, output_format, repeat)
+        typer.echo(format_report(results))
+        if not all(r.passed for r in results):
+            raise typer.Exit(code=1)
+
+    typer.run(verify)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,66 @@
 文件选择器模块
 
 该模块提供了一个基于Textual的TUI界面，用于选择图片文件。
+目录在后台线程中用 os.scandir 增量扫描，扫描结果分批显示；
+图片尺寸只读取文件头，并且只为当前可见的行加载。
 """
 
 import os
+import sqlite3
+from fnmatch import fnmatch
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from rich.text import Text
+from textual import work
 from textual.app import App, ComposeResult
-from textual.widgets import Header, Footer, SelectionList
 from textual.binding import Binding
+from textual.widgets import Header, Footer, SelectionList
+from textual.worker import get_current_worker
+
+from .metadata_index import get_index
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp")
+
+# 每批推送到界面的条目数量
+SCAN_BATCH_SIZE = 256
+
+
+def iter_image_entries(
+    root: str = ".", recursive: bool = False, pattern: Optional[str] = None
+) -> Iterator[Tuple[str, os.DirEntry]]:
+    """
+    增量遍历目录中的图片文件，返回 (相对路径, DirEntry)
+
+    pattern 为 fnmatch 通配符，匹配相对路径或文件名（不区分大小写）。
+    """
+    pattern = pattern.lower() if pattern else None
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive and not entry.name.startswith("."):
+                                pending.append(entry.path)
+                            continue
+                        if not entry.is_file():
+                            continue
+                    except OSError:
+                        continue
+
+                    name = entry.name.lower()
+                    if not name.endswith(IMAGE_EXTENSIONS):
+                        continue
+                    path = os.path.normpath(entry.path)
+                    if pattern and not (
+                        fnmatch(name, pattern) or fnmatch(path.lower(), pattern)
+                    ):
+                        continue
+                    yield path, entry
+        except OSError:
+            continue
 
 
 class FileSelector(App):
@@ -17,22 +71,145 @@ class FileSelector(App):
         Binding("ctrl+x", "quit_and_return", "退出"),
     ]
 
+    def __init__(
+        self, root: str = ".", recursive: bool = False, pattern: Optional[str] = None
+    ):
+        super().__init__()
+        self.root = root
+        self.recursive = recursive
+        self.pattern = pattern
+        # (路径, 修改时间)，修改时间来自扫描时 DirEntry 缓存的 stat 结果
+        self._entries: List[Tuple[str, float]] = []
+        self._index_by_path: Dict[str, int] = {}
+        self._dimensions: Dict[str, Optional[Tuple[int, int]]] = {}
+        self._loading_dimensions: Set[str] = set()
+        self._batches = 0
+
     def compose(self) -> ComposeResult:
         """创建应用的子组件。"""
         yield Header(show_clock=True, name="选择图片文件")
-        image_files = [
-            f
-            for f in os.listdir(".")
-            if f.lower().endswith((".png", ".jpg", ".jpeg", ".gif", ".bmp"))
-        ]
-        # 按修改时间排序（最新的在前）
-        image_files.sort(key=lambda x: os.path.getmtime(x), reverse=True)
-        yield SelectionList[str](*[(f, f) for f in image_files])
+        yield SelectionList[str]()
         yield Footer()
 
     def on_mount(self) -> None:
         """应用挂载时的回调。"""
         self.query_one(SelectionList).focus()
+        self.sub_title = "正在扫描..."
+        self.scan_files()
+        self.set_interval(0.2, self._request_visible_dimensions)
+
+    @work(thread=True, exclusive=True, group="scan")
+    def scan_files(self) -> None:
+        """在后台线程中扫描目录并分批推送到界面。"""
+        worker = get_current_worker()
+        batch: List[Tuple[str, float]] = []
+        seen: Dict[str, List[str]] = {}
+        for path, entry in iter_image_entries(self.root, self.recursive, self.pattern):
+            if worker.is_cancelled:
+                return
+            try:
+                mtime = entry.stat().st_mtime
+            except OSError:
+                continue
+            batch.append((path, mtime))
+            seen.setdefault(os.path.dirname(entry.path), []).append(path)
+            if len(batch) >= SCAN_BATCH_SIZE:
+                self.call_from_thread(self._add_batch, batch)
+                batch = []
+        if batch:
+            self.call_from_thread(self._add_batch, batch)
+        if worker.is_cancelled:
+            return
+        self.call_from_thread(self._finish_scan)
+
+        # 清理索引中已删除的文件，看到的文件无需再检查是否存在
+        index = get_index()
+        for directory in seen if seen else [self.root]:
+            try:
+                index.forget_missing(directory, seen.get(directory, []))
+            except sqlite3.Error:
+                break
+
+    def _add_batch(self, batch: List[Tuple[str, float]]) -> None:
+        """把一批扫描结果追加到列表中（批内按修改时间排序）。"""
+        batch.sort(key=lambda item: item[1], reverse=True)
+        selection_list = self.query_one(SelectionList)
+        start = len(self._entries)
+        for offset, (path, _) in enumerate(batch):
+            self._index_by_path[path] = start + offset
+        self._entries.extend(batch)
+        selection_list.add_options([(self._prompt(path), path) for path, _ in batch])
+        if selection_list.highlighted is None:
+            selection_list.highlighted = 0
+        self._batches += 1
+        self.sub_title = f"正在扫描... 已找到 {len(self._entries)} 个文件"
+
+    def _finish_scan(self) -> None:
+        """扫描结束后按修改时间整体排序（最新的在前）。"""
+        self.sub_title = f"共 {len(self._entries)} 个文件"
+        if self._batches <= 1:
+            return
+
+        selection_list = self.query_one(SelectionList)
+        selected = set(selection_list.selected)
+        highlighted = selection_list.highlighted
+        highlighted_path = (
+            self._entries[highlighted][0] if highlighted is not None else None
+        )
+
+        self._entries.sort(key=lambda item: item[1], reverse=True)
+        self._index_by_path = {
+            path: index for index, (path, _) in enumerate(self._entries)
+        }
+        selection_list.clear_options()
+        selection_list.add_options(
+            [(self._prompt(path), path, path in selected) for path, _ in self._entries]
+        )
+        if highlighted_path is not None:
+            selection_list.highlighted = self._index_by_path[highlighted_path]
+
+    def _prompt(self, path: str) -> Text:
+        """生成列表行的显示内容，尺寸已加载时一并显示。"""
+        size = self._dimensions.get(path)
+        if size is None:
+            return Text(path)
+        return Text.assemble(path, (f"  {size[0]}x{size[1]}", "dim"))
+
+    def _request_visible_dimensions(self) -> None:
+        """为当前可见且尚未加载尺寸的行请求读取图片尺寸。"""
+        selection_list = self.query_one(SelectionList)
+        first = int(selection_list.scroll_offset.y)
+        last = min(first + selection_list.size.height, len(self._entries))
+        paths = [
+            self._entries[index][0]
+            for index in range(first, last)
+            if self._entries[index][0] not in self._dimensions
+            and self._entries[index][0] not in self._loading_dimensions
+        ]
+        if paths:
+            self._loading_dimensions.update(paths)
+            self.load_dimensions(paths)
+
+    @work(thread=True, group="dimensions")
+    def load_dimensions(self, paths: List[str]) -> None:
+        """在后台线程中通过元数据索引获取图片尺寸，文件变化时才读取文件头。"""
+        index = get_index()
+        for path in paths:
+            try:
+                size: Optional[Tuple[int, int]] = index.get(path).dimensions
+            except (OSError, ValueError, sqlite3.Error):
+                size = None
+            self.call_from_thread(self._show_dimensions, path, size)
+
+    def _show_dimensions(self, path: str, size: Optional[Tuple[int, int]]) -> None:
+        """更新对应行的显示内容。"""
+        self._loading_dimensions.discard(path)
+        self._dimensions[path] = size
+        index = self._index_by_path.get(path)
+        if index is not None and size is not None:
+            self.query_one(SelectionList).replace_option_prompt_at_index(
+                index, self._prompt(path)
+            )
 
     def action_quit_and_return(self) -> None:
         """退出应用并返回选中的文件。"""
@@ -0,0 +1,157 @@
+"""
+合并结果缓存模块
+
+该模块在每个输出文件旁写入一个指纹文件，记录输入文件的内容哈希、全部合并参数和工具版本。
+再次执行相同的合并时，如果指纹一致且输出文件未被改动，就可以直接跳过合并。
+输入文件先比较大小和修改时间，两者都一致时视为未变化；只有大小相同而修改时间
+不同时才计算内容哈希确认，首次合并和强制合并都不需要读取输入文件的内容。
+"""
+
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+from . import __version__
+from .color import BUILTIN_PROFILES
+from .metadata_index import ImageMetadata, file_hash, get_index
+
+FINGERPRINT_SUFFIX = ".fingerprint.json"
+
+
+def fingerprint_path(output: str) -> str:
+    """
+    返回输出文件对应的指纹文件路径（与输出文件同目录的隐藏文件）
+    """
+    directory, name = os.path.split(output)
+    return os.path.join(directory, f".{name}{FINGERPRINT_SUFFIX}")
+
+
+def compute_fingerprint(
+    files: List[str],
+    options: Dict[str, Any],
+    metas: Optional[List[ImageMetadata]] = None,
+) -> Dict[str, Any]:
+    """
+    计算一次合并任务的指纹
+
+    输入文件只记录大小和修改时间，内容哈希仅在元数据索引中已有时一并记录，
+    需要时由 is_up_to_date 补全。ICC 配置文件的内容哈希也计入指纹。
+    metas 为调用方已经查询到的输入元数据，未提供时查询索引。
+    """
+    if metas is None:
+        metas = get_index().get_many(files)
+    inputs = [
+        {
+            "path": meta.path,
+            "size": meta.size,
+            "mtime_ns": meta.mtime_ns,
+            "hash": meta.content_hash,
+        }
+        for meta in metas
+    ]
+    return {
+        "version": __version__,
+        # 经过 JSON 往返，保证元组等类型与读回的指纹可以直接比较
+        "options": json.loads(json.dumps(options, sort_keys=True)),
+        "profile_hash": _profile_hash(options.get("color_profile")),
+        "inputs": inputs,
+    }
+
+
+def _profile_hash(profile: Optional[str]) -> Optional[str]:
+    """
+    计算 ICC 配置文件的内容哈希，内置配置或文件无法读取时返回 None
+    """
+    if profile is None or profile.lower() in BUILTIN_PROFILES:
+        return None
+    try:
+        return file_hash(profile)
+    except OSError:
+        return None
+
+
+def _same_input(recorded: Dict[str, Any], current: Dict[str, Any]) -> bool:
+    """
+    比较单个输入文件是否未变化
+
+    大小和修改时间都一致时直接视为未变化；大小不同必然变化；只有修改时间不同时
+    计算内容哈希与记录比较，确认一致后把哈希补入当前指纹。记录中没有哈希时
+    无法确认，视为已变化。
+    """
+    if recorded.get("path") != current["path"]:
+        return False
+    if recorded.get("size") != current["size"]:
+        return False
+    if recorded.get("mtime_ns") == current["mtime_ns"]:
+        if current["hash"] is None:
+            current["hash"] = recorded.get("hash")
+        return True
+    if recorded.get("hash") is None:
+        return False
+    if current["hash"] is None:
+        current["hash"] = get_index().get(current["path"], with_hash=True).content_hash
+    return recorded["hash"] == current["hash"]
+
+
+def _same_job(recorded: Dict[str, Any], fingerprint: Dict[str, Any]) -> bool:
+    """
+    比较两个指纹是否对应同一个任务：输入内容相同即可，不要求修改时间一致
+    """
+    if recorded.get("version") != fingerprint["version"]:
+        return False
+    if recorded.get("options") != fingerprint["options"]:
+        return False
+    if recorded.get("profile_hash") != fingerprint["profile_hash"]:
+        return False
+    recorded_inputs = recorded.get("inputs", [])
+    if len(recorded_inputs) != len(fingerprint["inputs"]):
+        return False
+    return all(
+        _same_input(a, b) for a, b in zip(recorded_inputs, fingerprint["inputs"])
+    )
+
+
+def load_fingerprint(output: str) -> Optional[Dict[str, Any]]:
+    """
+    读取输出文件的指纹，不存在或无法解析时返回 None
+    """
+    try:
+        with open(fingerprint_path(output), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError, OSError):
+        return None
+
+
+def is_up_to_date(output: str, fingerprint: Dict[str, Any]) -> bool:
+    """
+    判断输出文件是否已经是该任务的最新结果
+
+    没有记录的指纹时不读取任何输入文件的内容。
+    """
+    recorded = load_fingerprint(output)
+    if recorded is None or not _same_job(recorded, fingerprint):
+        return False
+    try:
+        st = os.stat(output)
+    except OSError:
+        return False
+    recorded_output = recorded.get("output", {})
+    return (
+        recorded_output.get("size") == st.st_size
+        and recorded_output.get("mtime_ns") == st.st_mtime_ns
+    )
+
+
+def save_fingerprint(output: str, fingerprint: Dict[str, Any]) -> None:
+    """
+    在输出文件旁写入指纹，同时记录输出文件的大小和修改时间用于检查其是否被改动
+    """
+    st = os.stat(output)
+    record = dict(fingerprint)
+    record["output"] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    path = fingerprint_path(output)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(record, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
@@ -0,0 +1,470 @@
+"""
+布局规划模块
+
+该模块只根据图片尺寸计算合并后的画布大小、每张图片的放置区域以及分隔线位置，
+不读取任何像素数据，供图片合并和预览等功能共用。
+"""
+
+import math
+from statistics import median
+from typing import List, NamedTuple, Optional, Tuple
+
+Size = Tuple[int, int]
+Box = Tuple[int, int, int, int]
+
+
+class GridChoice(NamedTuple):
+    """
+    自动网格的搜索结果
+
+    cell_size 为单元格尺寸，图片按原始宽高比缩放后放入单元格；
+    waste 为画布中没有被图片覆盖的像素数（空白单元格、留白、间距和边距）。
+    """
+
+    cols: int
+    rows: int
+    cell_size: Size
+    canvas_size: Size
+    waste: int
+
+
+class LayoutPlan(NamedTuple):
+    """
+    布局规划结果
+
+    canvas_size: 画布尺寸 (宽, 高)
+    placements: 每张图片的放置区域 (x, y, 宽, 高)，顺序与输入一致
+    dividers: 分隔线矩形 [x0, y0, x1, y1]，包含端点，与 ImageDraw.rectangle 一致
+    grid: 自动网格选中的网格形状，其他布局为 None
+    """
+
+    canvas_size: Size
+    placements: List[Box]
+    dividers: List[Box]
+    grid: Optional[GridChoice] = None
+
+
+# 自动网格允许画布宽高比偏离目标宽高比的相对幅度
+ASPECT_TOLERANCE = 0.25
+
+# 自动网格最多尝试的单元格宽高比数量
+MAX_CELL_ASPECTS = 32
+
+
+def plan_layout(
+    sizes: List[Size],
+    orientation: str = "horizontal",
+    gap: int = 40,
+    divider: bool = True,
+    divider_thickness: int = 4,
+    align: str = "center",
+    uniform_height: Optional[int] = None,
+    uniform_width: Optional[int] = None,
+    margin: int = 0,
+    cols: Optional[int] = None,
+    rows: Optional[int] = None,
+    auto_grid: bool = False,
+    target_aspect: float = 1.0,
+    atlas: bool = False,
+    atlas_max_size: Optional[int] = None,
+    atlas_power_of_two: bool = False,
+) -> LayoutPlan:
+    """
+    根据参数选择图集、自动网格、网格布局或线性布局并进行规划
+    """
+    if atlas:
+        # 图集模块依赖本模块的类型定义，在这里导入避免循环导入
+        from .atlas import plan_atlas
+
+        return plan_atlas(
+            sizes=sizes,
+            gap=gap,
+            margin=margin,
+            max_size=atlas_max_size,
+            power_of_two=atlas_power_of_two,
+        )
+    if auto_grid:
+        return plan_auto_grid(
+            sizes=sizes,
+            gap=gap,
+            divider=divider,
+            divider_thickness=divider_thickness,
+            align=align,
+            margin=margin,
+            cols=cols,
+            rows=rows,
+            target_aspect=target_aspect,
+        )
+    if cols is not None or rows is not None:
+        return plan_grid(
+            sizes=sizes,
+            gap=gap,
+            divider=divider,
+            divider_thickness=divider_thickness,
+            margin=margin,
+            cols=cols,
+            rows=rows,
+        )
+    return plan_linear(
+        sizes=sizes,
+        orientation=orientation,
+        gap=gap,
+        divider=divider,
+        divider_thickness=divider_thickness,
+        align=align,
+        uniform_height=uniform_height,
+        uniform_width=uniform_width,
+        margin=margin,
+    )
+
+
+def plan_linear(
+    sizes: List[Size],
+    orientation: str,
+    gap: int,
+    divider: bool,
+    divider_thickness: int,
+    align: str,
+    uniform_height: Optional[int],
+    uniform_width: Optional[int],
+    margin: int,
+) -> LayoutPlan:
+    """
+    规划水平或垂直的线性布局
+    """
+    if orientation == "horizontal" and uniform_height is not None:
+        sizes = [(int(w * uniform_height / h), uniform_height) for w, h in sizes]
+    elif orientation == "vertical" and uniform_width is not None:
+        sizes = [(uniform_width, int(h * uniform_width / w)) for w, h in sizes]
+
+    widths = [w for w, _ in sizes]
+    heights = [h for _, h in sizes]
+    n = len(sizes)
+    num_gaps = max(n - 1, 0)
+    draw_divider = divider and divider_thickness > 0
+
+    total_dividers = num_gaps * (divider_thickness if draw_divider else 0)
+
+    if orientation == "horizontal":
+        canvas_w = sum(widths) + num_gaps * gap + total_dividers + 2 * margin
+        canvas_h = max(heights) + 2 * margin
+    else:
+        canvas_w = max(widths) + 2 * margin
+        canvas_h = sum(heights) + num_gaps * gap + total_dividers + 2 * margin
+
+    placements: List[Box] = []
+    dividers: List[Box] = []
+    cursor_x, cursor_y = margin, margin
+    for idx, (w, h) in enumerate(sizes):
+        if orientation == "horizontal":
+            if align == "center":
+                paste_y = margin + (canvas_h - 2 * margin - h) // 2
+            elif align == "end":
+                paste_y = canvas_h - margin - h
+            else:
+                paste_y = margin
+            placements.append((cursor_x, paste_y, w, h))
+            cursor_x += w
+
+            if idx < n - 1:
+                half_gap_left = gap // 2
+                cursor_x += half_gap_left
+                if draw_divider:
+                    dividers.append(
+                        (
+                            cursor_x,
+                            margin,
+                            cursor_x + divider_thickness - 1,
+                            canvas_h - margin - 1,
+                        )
+                    )
+                    cursor_x += divider_thickness
+                cursor_x += gap - half_gap_left
+        else:
+            if align == "center":
+                paste_x = margin + (canvas_w - 2 * margin - w) // 2
+            elif align == "end":
+                paste_x = canvas_w - margin - w
+            else:
+                paste_x = margin
+            placements.append((paste_x, cursor_y, w, h))
+            cursor_y += h
+
+            if idx < n - 1:
+                half_gap_top = gap // 2
+                cursor_y += half_gap_top
+                if draw_divider:
+                    dividers.append(
+                        (
+                            margin,
+                            cursor_y,
+                            canvas_w - margin - 1,
+                            cursor_y + divider_thickness - 1,
+                        )
+                    )
+                    cursor_y += divider_thickness
+                cursor_y += gap - half_gap_top
+
+    return LayoutPlan((canvas_w, canvas_h), placements, dividers)
+
+
+def grid_shape(n: int, cols: Optional[int], rows: Optional[int]) -> Tuple[int, int]:
+    """
+    计算网格布局的列数和行数
+    """
+    if cols is not None and rows is not None:
+        # 如果同时指定行数和列数，直接使用
+        grid_cols = cols
+        grid_rows = rows
+    elif cols is not None:
+        # 如果只指定列数，计算所需行数
+        grid_cols = cols
+        grid_rows = (n + grid_cols - 1) // grid_cols  # 向上取整
+    elif rows is not None:
+        # 如果只指定行数，计算所需列数
+        grid_rows = rows
+        grid_cols = (n + grid_rows - 1) // grid_rows  # 向上取整
+    else:
+        # 这种情况不应该发生，但为了安全起见
+        grid_cols = int(n**0.5)  # 简单的平方根布局
+        grid_rows = (n + grid_cols - 1) // grid_cols
+
+    # 确保网格大小能容纳所有图像
+    if grid_cols * grid_rows < n:
+        if cols is not None:  # 如果固定了列数
+            grid_rows = (n + grid_cols - 1) // grid_cols
+        elif rows is not None:  # 如果固定了行数
+            grid_cols = (n + grid_rows - 1) // grid_rows
+        else:  # 都没固定则调整
+            grid_cols = int(n**0.5)
+            grid_rows = (n + grid_cols - 1) // grid_cols
+
+    return grid_cols, grid_rows
+
+
+def plan_grid(
+    sizes: List[Size],
+    gap: int,
+    divider: bool,
+    divider_thickness: int,
+    margin: int,
+    cols: Optional[int],
+    rows: Optional[int],
+) -> LayoutPlan:
+    """
+    规划网格布局，所有图片统一缩放到最大宽度和最大高度
+    """
+    n = len(sizes)
+    grid_cols, grid_rows = grid_shape(n, cols, rows)
+
+    max_width = max((w for w, _ in sizes), default=0)
+    max_height = max((h for _, h in sizes), default=0)
+
+    draw_divider = divider and divider_thickness > 0
+    thickness = divider_thickness if draw_divider else 0
+
+    # 计算画布尺寸
+    total_gap_cols = max(grid_cols - 1, 0)
+    total_gap_rows = max(grid_rows - 1, 0)
+    canvas_w = (
+        grid_cols * max_width
+        + total_gap_cols * gap
+        + total_gap_cols * thickness
+        + 2 * margin
+    )
+    canvas_h = (
+        grid_rows * max_height
+        + total_gap_rows * gap
+        + total_gap_rows * thickness
+        + 2 * margin
+    )
+
+    placements: List[Box] = []
+    dividers: List[Box] = []
+    for idx in range(n):
+        # 计算网格中的行和列
+        row = idx // grid_cols
+        col = idx % grid_cols
+
+        # 计算在画布上的位置，启用 divider 时还需要考虑 divider 的偏移
+        x = margin + col * (max_width + gap + thickness) + col * thickness
+        y = margin + row * (max_height + gap + thickness) + row * thickness
+
+        # 绘制divider（如果是非最后一列或最后一行）
+        if draw_divider and col < grid_cols - 1:
+            # 垂直divider
+            x0 = x + max_width
+            dividers.append((x0, y, x0 + divider_thickness - 1, y + max_height - 1))
+
+        if draw_divider and row < grid_rows - 1:
+            # 水平divider
+            y0 = y + max_height
+            dividers.append((x, y0, x + max_width - 1, y0 + divider_thickness - 1))
+
+        placements.append((x, y, max_width, max_height))
+
+    return LayoutPlan((canvas_w, canvas_h), placements, dividers)
+
+
+def _fit(size: Size, cell: Size) -> Size:
+    """
+    按原始宽高比把图片缩放到刚好放入单元格
+    """
+    w, h = size
+    scale = min(cell[0] / w, cell[1] / h)
+    return max(1, round(w * scale)), max(1, round(h * scale))
+
+
+def _cell_aspects(sizes: List[Size]) -> List[float]:
+    """
+    单元格宽高比的候选值：输入图片的宽高比（数量较多时取分位数）
+    """
+    aspects = sorted({round(w / h, 3) for w, h in sizes})
+    if len(aspects) > MAX_CELL_ASPECTS:
+        step = (len(aspects) - 1) / (MAX_CELL_ASPECTS - 1)
+        aspects = [aspects[round(i * step)] for i in range(MAX_CELL_ASPECTS)]
+    return aspects
+
+
+def choose_grid(
+    sizes: List[Size],
+    gap: int,
+    divider: bool,
+    divider_thickness: int,
+    margin: int,
+    cols: Optional[int] = None,
+    rows: Optional[int] = None,
+    target_aspect: float = 1.0,
+) -> GridChoice:
+    """
+    只根据图片尺寸搜索网格的行列数和单元格尺寸
+
+    单元格面积取输入图片面积的中位数，宽高比从输入图片的宽高比中选择。单元格不会
+    放大到能容纳最大的输入，比中位数大的图片会按宽高比缩小，比它小的图片会放大，
+    各单元格中的图片大小接近。
+    在画布宽高比偏离 target_aspect（宽/高）不超过 ASPECT_TOLERANCE 的候选中
+    选择空白最少的布局，没有满足条件的候选时选择宽高比最接近的。
+    cols 或 rows 给出时只搜索另一个维度。
+    """
+    n = len(sizes)
+    if n == 0:
+        return GridChoice(0, 0, (0, 0), (2 * margin, 2 * margin), 0)
+
+    spacing = gap + (divider_thickness if divider and divider_thickness > 0 else 0)
+    cell_area = median(w * h for w, h in sizes)
+
+    # 每种单元格尺寸下图片覆盖的总面积与行列数无关，只需计算一次
+    cells = []
+    for aspect in _cell_aspects(sizes):
+        cell = (
+            max(1, round(math.sqrt(cell_area * aspect))),
+            max(1, round(math.sqrt(cell_area / aspect))),
+        )
+        covered = 0
+        for size in sizes:
+            fw, fh = _fit(size, cell)
+            covered += fw * fh
+        cells.append((cell, covered))
+
+    if cols is not None:
+        shapes = [grid_shape(n, cols, rows)]
+    elif rows is not None:
+        shapes = [grid_shape(n, None, rows)]
+    else:
+        shapes = sorted({(c, (n + c - 1) // c) for c in range(1, n + 1)})
+
+    best = None
+    best_key = None
+    for grid_cols, grid_rows in shapes:
+        for cell, covered in cells:
+            canvas = (
+                grid_cols * cell[0] + (grid_cols - 1) * spacing + 2 * margin,
+                grid_rows * cell[1] + (grid_rows - 1) * spacing + 2 * margin,
+            )
+            waste = canvas[0] * canvas[1] - covered
+            deviation = abs(math.log(canvas[0] / canvas[1] / target_aspect))
+            if deviation <= math.log(1 + ASPECT_TOLERANCE):
+                key = (0, waste, deviation)
+            else:
+                key = (1, deviation, waste)
+            if best_key is None or key < best_key:
+                best_key = key
+                best = GridChoice(grid_cols, grid_rows, cell, canvas, waste)
+    return best
+
+
+def plan_auto_grid(
+    sizes: List[Size],
+    gap: int,
+    divider: bool,
+    divider_thickness: int,
+    align: str,
+    margin: int,
+    cols: Optional[int] = None,
+    rows: Optional[int] = None,
+    target_aspect: float = 1.0,
+) -> LayoutPlan:
+    """
+    规划自动网格布局，图片保持宽高比放入单元格，并按 align 在单元格内对齐
+    """
+    choice = choose_grid(
+        sizes, gap, divider, divider_thickness, margin, cols, rows, target_aspect
+    )
+    cell_w, cell_h = choice.cell_size
+    draw_divider = divider and divider_thickness > 0
+    thickness = divider_thickness if draw_divider else 0
+    pitch_x = cell_w + gap + thickness
+    pitch_y = cell_h + gap + thickness
+
+    def offset(free: int) -> int:
+        if align == "center":
+            return free // 2
+        if align == "end":
+            return free
+        return 0
+
+    placements: List[Box] = []
+    dividers: List[Box] = []
+    for idx, size in enumerate(sizes):
+        row, col = divmod(idx, choice.cols)
+        x = margin + col * pitch_x
+        y = margin + row * pitch_y
+
+        # 与线性布局一致，分隔线位于间距的中间
+        if draw_divider and col < choice.cols - 1:
+            x0 = x + cell_w + gap // 2
+            dividers.append((x0, y, x0 + divider_thickness - 1, y + cell_h - 1))
+        if draw_divider and row < choice.rows - 1:
+            y0 = y + cell_h + gap // 2
+            dividers.append((x, y0, x + cell_w - 1, y0 + divider_thickness - 1))
+
+        w, h = _fit(size, choice.cell_size)
+        placements.append((x + offset(cell_w - w), y + offset(cell_h - h), w, h))
+
+    return LayoutPlan(choice.canvas_size, placements, dividers, choice)
+
+
+def scale_plan(plan: LayoutPlan, scale: float, min_divider: int = 1) -> LayoutPlan:
+    """
+    按比例缩放布局规划，用于低分辨率预览
+
+    缩放后的分隔线至少保留 min_divider 像素，避免在小画布上消失。
+    """
+    canvas_w, canvas_h = plan.canvas_size
+    new_canvas = (max(1, round(canvas_w * scale)), max(1, round(canvas_h * scale)))
+
+    placements = []
+    for x, y, w, h in plan.placements:
+        nx, ny = round(x * scale), round(y * scale)
+        nw = max(1, round((x + w) * scale) - nx)
+        nh = max(1, round((y + h) * scale) - ny)
+        placements.append((nx, ny, nw, nh))
+
+    dividers = []
+    for x0, y0, x1, y1 in plan.dividers:
+        nx0, ny0 = int(x0 * scale), int(y0 * scale)
+        nx1 = max(nx0 + min_divider - 1, int((x1 + 1) * scale) - 1)
+        ny1 = max(ny0 + min_divider - 1, int((y1 + 1) * scale) - 1)
+        dividers.append((nx0, ny0, nx1, ny1))
+
+    return LayoutPlan(new_canvas, placements, dividers)
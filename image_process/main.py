@@ -6,11 +6,85 @@
 """
 
 import typer
-from typing import List, Tuple, Optional
-from .merge_images import merge_images
+from typing import Any, Dict, List, Tuple, Optional
+from . import metrics
+from .atlas import atlas_map_path
+from .color import BUILTIN_PROFILES, RENDERING_INTENTS
+from .merge_images import MERGE_ERRORS, merge_images, merge_layouts
+from .progress import ProgressEvent
+from .remote import DEFAULT_CONCURRENCY, DEFAULT_RETRIES, DEFAULT_TIMEOUT
+from .sources import (
+    iter_concatenated_images,
+    read_path_list,
+    resolve_sources,
+    source_exists,
+)
 import os
+import sys
 from datetime import datetime
 
+# --layout 中各参数的类型
+LAYOUT_INT_KEYS = (
+    "gap",
+    "divider_thickness",
+    "uniform_height",
+    "uniform_width",
+    "margin",
+    "cols",
+    "rows",
+    "atlas_max_size",
+)
+LAYOUT_FLOAT_KEYS = ("target_aspect", "thumbnail_tolerance")
+LAYOUT_BOOL_KEYS = (
+    "divider",
+    "auto_grid",
+    "atlas",
+    "atlas_power_of_two",
+    "preserve_mode",
+)
+LAYOUT_COLOR_KEYS = ("divider_color", "bg_color")
+LAYOUT_STR_KEYS = (
+    "output",
+    "orientation",
+    "align",
+    "format",
+    "color_profile",
+    "rendering_intent",
+)
+
+
+def parse_layout(spec: str) -> Dict[str, Any]:
+    """
+    解析 --layout 参数，例如 "output=grid.png,cols=3,gap=10"
+
+    颜色写作 R/G/B，例如 bg_color=0/0/0；整数参数写 none 表示不设置。
+    """
+    layout: Dict[str, Any] = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        key, sep, value = item.partition("=")
+        key = key.strip().replace("-", "_")
+        value = value.strip()
+        if not sep:
+            raise ValueError(f"布局参数 '{item}' 缺少 '='")
+        if key in LAYOUT_INT_KEYS:
+            layout[key] = None if value.lower() == "none" else int(value)
+        elif key in LAYOUT_FLOAT_KEYS:
+            layout[key] = None if value.lower() == "none" else float(value)
+        elif key in LAYOUT_BOOL_KEYS:
+            layout[key] = value.lower() in ("1", "true", "yes", "on")
+        elif key in LAYOUT_COLOR_KEYS:
+            layout[key] = tuple(int(v) for v in value.split("/"))
+        elif key in LAYOUT_STR_KEYS:
+            layout["output_format" if key == "format" else key] = value
+        else:
+            raise ValueError(f"未知的布局参数 '{key}'")
+    if "output" not in layout:
+        raise ValueError(f"布局 '{spec}' 缺少 output")
+    return layout
+
+
 app = typer.Typer(
     help="图片处理工具",
     epilog="示例: image-process --files img1.jpg --files img2.jpg --output result.jpg",
@@ -19,8 +93,22 @@ app = typer.Typer(
 
 @app.command(help="合并多张图片")
 def merge(
-    files: List[str] = typer.Option(..., "--files", "-f", help="要合并的图片文件列表"),
-    output: str = typer.Option(..., "--output", "-o", help="输出文件路径"),
+    files: Optional[List[str]] = typer.Option(
+        None,
+        "--files",
+        "-f",
+        help="要合并的图片文件列表 (- 表示从标准输入读取以换行或 NUL 分隔的路径，"
+        "支持 bundle.zip::path/in/archive.png 形式的压缩包成员或整个压缩包)",
+    ),
+    output: str = typer.Option(
+        ..., "--output", "-o", help="输出文件路径 (- 表示写入标准输出)"
+    ),
+    output_format: Optional[str] = typer.Option(
+        None, "--format", help="输出格式 (如 PNG/JPEG/WEBP)，写入标准输出时必须指定"
+    ),
+    stdin_images: bool = typer.Option(
+        False, "--stdin-images", help="从标准输入读取首尾相接的图片数据作为输入"
+    ),
     add_timestamp: bool = typer.Option(
         False, "--timestamp", help="在输出文件名中添加时间戳"
     ),
@@ -50,32 +138,204 @@ def merge(
     margin: int = typer.Option(0, "--margin", help="边距 (像素)"),
     cols: Optional[int] = typer.Option(None, "--cols", help="指定列数 (启用网格布局)"),
     rows: Optional[int] = typer.Option(None, "--rows", help="指定行数 (启用网格布局)"),
+    auto_grid: bool = typer.Option(
+        False,
+        "--auto-grid",
+        help="自动网格: 根据图片尺寸搜索空白最少的行列数和单元格尺寸，图片保持宽高比",
+    ),
+    target_aspect: float = typer.Option(
+        1.0, "--target-aspect", help="自动网格的目标画布宽高比 (宽/高)，默认为 1.0"
+    ),
+    atlas: bool = typer.Option(
+        False,
+        "--atlas",
+        help="图集布局: 图片保持原始尺寸装入尽量小的画布，背景透明，"
+        "并在输出旁写出同名 .json 坐标表 (--gap 为图片间距，忽略分隔线)",
+    ),
+    atlas_max_size: Optional[int] = typer.Option(
+        None, "--atlas-max-size", help="图集画布的最大边长 (像素)"
+    ),
+    atlas_power_of_two: bool = typer.Option(
+        False, "--atlas-pot", help="图集画布的宽和高都取 2 的幂"
+    ),
+    animation_policy: str = typer.Option(
+        "loop",
+        "--animation-policy",
+        help="动图帧数或时长不一致时的处理策略 (loop/hold/lcm)",
+    ),
+    low_memory: bool = typer.Option(
+        False,
+        "--low-memory",
+        "--contact-sheet",
+        help="低内存模式: 逐张解码并粘贴，适合大量图片的网格缩略图",
+    ),
+    preserve_mode: bool = typer.Option(
+        True,
+        "--preserve-mode/--no-preserve-mode",
+        help="输入色彩模式一致时在最窄的模式 (L/LA/RGB/16 位灰度) 下合成并编码",
+    ),
+    thumbnail_tolerance: Optional[float] = typer.Option(
+        None,
+        "--thumbnail-tolerance",
+        help="允许使用 JPEG 内嵌的 EXIF 缩略图: "
+        "缩略图不小于放置区域的 (1 - 该值) 倍时代替原图解码，"
+        "0 表示缩略图不能小于放置区域 (默认不使用缩略图)",
+    ),
+    color_profile: Optional[str] = typer.Option(
+        None,
+        "--color-profile",
+        help="按嵌入的 ICC 配置把输入转换到该配置并嵌入输出 (srgb 或 ICC 文件路径)，"
+        "默认忽略配置",
+    ),
+    rendering_intent: str = typer.Option(
+        "perceptual",
+        "--rendering-intent",
+        help="色彩转换的渲染意图 (perceptual/relative/saturation/absolute)",
+    ),
+    force: bool = typer.Option(False, "--force", help="忽略结果指纹，强制重新合并"),
+    png_threads: Optional[int] = typer.Option(
+        None,
+        "--png-threads",
+        help="PNG 输出的压缩线程数，0 表示使用 CPU 核数 (默认单线程编码)",
+    ),
+    layout_specs: Optional[List[str]] = typer.Option(
+        None,
+        "--layout",
+        help="额外生成的布局，如 output=grid.png,cols=3 (未给出的参数沿用命令行参数，"
+        "所有布局共用一次解码)",
+    ),
+    http_concurrency: int = typer.Option(
+        DEFAULT_CONCURRENCY,
+        "--http-concurrency",
+        help="同时下载的 http(s) 输入数量上限",
+    ),
+    http_timeout: float = typer.Option(
+        DEFAULT_TIMEOUT,
+        "--http-timeout",
+        help="下载 http(s) 输入时的连接和读取超时 (秒)",
+    ),
+    http_retries: int = typer.Option(
+        DEFAULT_RETRIES,
+        "--http-retries",
+        help="下载失败 (连接错误、超时、5xx) 时的重试次数",
+    ),
+    http_cache: bool = typer.Option(
+        False,
+        "--http-cache/--no-http-cache",
+        help="把 http(s) 输入缓存到 ~/.cache/image-process-cli/http，"
+        "再次下载时用 ETag 校验",
+    ),
+    metrics_file: Optional[str] = typer.Option(
+        None,
+        "--metrics-file",
+        help="把运行指标写入该文件 (Prometheus 文本格式，"
+        "供 node exporter 的 textfile collector 读取)",
+    ),
 ):
     """
     合并多张图片
     """
+    files = list(files or [])
+    to_stdout = output == "-"
+    if to_stdout and not output_format:
+        typer.echo("错误: 写入标准输出时必须使用 --format 指定输出格式", err=True)
+        raise typer.Exit(code=1)
+
+    # 从标准输入读取路径列表或图片数据，两者只能选其一
+    if "-" in files:
+        if stdin_images:
+            typer.echo("错误: --files - 不能与 --stdin-images 同时使用", err=True)
+            raise typer.Exit(code=1)
+        index = files.index("-")
+        files[index : index + 1] = read_path_list(sys.stdin.buffer.read())
+    if not files and not stdin_images:
+        typer.echo("错误: 请使用 --files 或 --stdin-images 指定输入", err=True)
+        raise typer.Exit(code=1)
+
+    try:
+        layouts = [parse_layout(spec) for spec in layout_specs or []]
+    except ValueError as e:
+        typer.echo(f"错误: {e}", err=True)
+        raise typer.Exit(code=1)
+    if layouts and (to_stdout or any(item["output"] == "-" for item in layouts)):
+        typer.echo("错误: 使用 --layout 时不能写入标准输出", err=True)
+        raise typer.Exit(code=1)
+
     # 检查输入文件是否存在
     for file in files:
-        if not os.path.exists(file):
+        if not source_exists(file):
             typer.echo(f"错误: 文件 '{file}' 不存在", err=True)
             raise typer.Exit(code=1)
 
-    # 添加时间戳到输出文件名
-    if add_timestamp:
-        name, ext = os.path.splitext(output)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output = f"{name}_{timestamp}{ext}"
+    if to_stdout:
+        target = sys.stdout.buffer
+    else:
+        # 添加时间戳到输出文件名
+        if add_timestamp:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            output = _with_timestamp(output, timestamp)
+            for item in layouts:
+                item["output"] = _with_timestamp(item["output"], timestamp)
 
-    # 确保输出目录存在
-    output_dir = os.path.dirname(output)
-    if output_dir:
-        os.makedirs(output_dir, exist_ok=True)
+        # 确保输出目录存在
+        for path in [output] + [item["output"] for item in layouts]:
+            output_dir = os.path.dirname(path)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+        target = output
+
+    if atlas and to_stdout:
+        typer.echo("错误: 使用 --atlas 时不能写入标准输出", err=True)
+        raise typer.Exit(code=1)
+    if atlas_max_size is not None and atlas_max_size <= 0:
+        typer.echo("错误: --atlas-max-size 必须大于 0", err=True)
+        raise typer.Exit(code=1)
+    if target_aspect <= 0:
+        typer.echo("错误: --target-aspect 必须大于 0", err=True)
+        raise typer.Exit(code=1)
+    if thumbnail_tolerance is not None and not 0 <= thumbnail_tolerance < 1:
+        typer.echo("错误: --thumbnail-tolerance 必须在 [0, 1) 范围内", err=True)
+        raise typer.Exit(code=1)
+    if rendering_intent not in RENDERING_INTENTS:
+        typer.echo(
+            "错误: --rendering-intent 必须是 perceptual、relative、saturation "
+            "或 absolute",
+            err=True,
+        )
+        raise typer.Exit(code=1)
+    if color_profile is not None and color_profile.lower() not in BUILTIN_PROFILES:
+        if not os.path.isfile(color_profile):
+            typer.echo(f"错误: ICC 配置文件 '{color_profile}' 不存在", err=True)
+            raise typer.Exit(code=1)
+    if png_threads is not None and png_threads < 0:
+        typer.echo("错误: --png-threads 不能为负数", err=True)
+        raise typer.Exit(code=1)
+    if http_concurrency < 1 or http_timeout <= 0 or http_retries < 0:
+        typer.echo(
+            "错误: --http-concurrency 至少为 1，--http-timeout 必须大于 0，"
+            "--http-retries 不能为负数",
+            err=True,
+        )
+        raise typer.Exit(code=1)
+
+    if metrics_file:
+        metrics.enable()
 
     # 调用合并函数
     try:
-        result = merge_images(
-            files=files,
-            output=output,
+        sources = files
+        if stdin_images:
+            sources = files + list(iter_concatenated_images(sys.stdin.buffer))
+        # 并发下载 http(s) 输入，压缩包成员先读取图片头，避免合并时再解析压缩包
+        sources = resolve_sources(
+            sources,
+            concurrency=http_concurrency,
+            timeout=http_timeout,
+            retries=http_retries,
+            use_cache=http_cache,
+        )
+        options = dict(
+            output_format=output_format,
             orientation=orientation,
             gap=gap,
             divider=divider,
@@ -83,16 +343,87 @@ def merge(
             divider_color=divider_color,
             bg_color=bg_color,
             align=align,
-            uniform_height=uniform_height if orientation == "horizontal" else None,
-            uniform_width=uniform_width if orientation == "vertical" else None,
+            uniform_height=uniform_height,
+            uniform_width=uniform_width,
             margin=margin,
             cols=cols,
             rows=rows,
+            auto_grid=auto_grid,
+            target_aspect=target_aspect,
+            atlas=atlas,
+            atlas_max_size=atlas_max_size,
+            atlas_power_of_two=atlas_power_of_two,
+            animation_policy=animation_policy,
+            low_memory=low_memory,
+            preserve_mode=preserve_mode,
+            thumbnail_tolerance=thumbnail_tolerance,
+            color_profile=color_profile,
+            rendering_intent=rendering_intent,
+        )
+        if layouts:
+            # 多个布局共用一次解码，未给出的参数沿用命令行参数
+            specs = [dict(options, output=target)]
+            specs += [dict(options, **item) for item in layouts]
+            for spec in specs:
+                _drop_unused_uniform(spec)
+            results = merge_layouts(
+                sources, specs, force=force, png_threads=png_threads
+            )
+            for spec, result in zip(specs, results):
+                typer.echo(f"图片合并完成: {result}")
+                if spec.get("atlas"):
+                    typer.echo(f"图集坐标表: {atlas_map_path(result)}")
+            return
+
+        def report_grid(event: ProgressEvent) -> None:
+            # 输出合并实际使用的网格形状
+            grid = event.plan.grid if event.plan is not None else None
+            if grid is not None:
+                typer.echo(
+                    f"自动网格: {grid.cols} 列 x {grid.rows} 行, "
+                    f"单元格 {grid.cell_size[0]}x{grid.cell_size[1]}, "
+                    f"画布 {grid.canvas_size[0]}x{grid.canvas_size[1]}",
+                    err=to_stdout,
+                )
+
+        _drop_unused_uniform(options)
+        result = merge_images(
+            files=sources,
+            output=target,
+            force=force,
+            png_threads=png_threads,
+            progress=report_grid if auto_grid else None,
+            **options,
         )
-        typer.echo(f"图片合并完成: {result}")
-    except Exception as e:
+        if to_stdout:
+            sys.stdout.buffer.flush()
+            # 标准输出已用于图片数据，提示信息写入标准错误
+            typer.echo("图片合并完成: <标准输出>", err=True)
+        else:
+            typer.echo(f"图片合并完成: {result}")
+            if atlas:
+                typer.echo(f"图集坐标表: {atlas_map_path(result)}")
+    except MERGE_ERRORS as e:
         typer.echo(f"合并图片时出错: {str(e)}", err=True)
         raise typer.Exit(code=1)
+    finally:
+        if metrics_file:
+            metrics.write_textfile(metrics_file)
+
+
+def _with_timestamp(path: str, timestamp: str) -> str:
+    name, ext = os.path.splitext(path)
+    return f"{name}_{timestamp}{ext}"
+
+
+def _drop_unused_uniform(options: Dict[str, Any]) -> None:
+    """
+    统一高度只在水平排列时有效，统一宽度只在垂直排列时有效
+    """
+    if options["orientation"] != "horizontal":
+        options["uniform_height"] = None
+    if options["orientation"] != "vertical":
+        options["uniform_width"] = None
 
 
 def run_cli():
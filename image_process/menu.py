@@ -32,6 +32,7 @@ class MenuManager:
 6. 执行图片合并
 7. 重置配置
 8. 帮助
+9. 预览合并效果
 0. 退出
 
 当前状态:
@@ -86,6 +87,9 @@ class MenuManager:
 
         table.add_row("边距", str(config.margin))
         table.add_row("添加时间戳", "是" if config.add_timestamp else "否")
+        table.add_row("递归扫描子目录", "是" if config.scan_recursive else "否")
+        if config.scan_pattern:
+            table.add_row("文件名过滤", config.scan_pattern)
 
         self.console.print(table)
 
@@ -103,6 +107,7 @@ class MenuManager:
 - 自定义背景色和分隔线颜色
 - 设置图片对齐方式
 - 统一图片高度或宽度
+- 在终端中预览合并布局
 
 [bold]使用步骤:[/bold]
 1. 添加至少两张图片文件
@@ -112,6 +117,7 @@ class MenuManager:
 
 [bold]快捷键说明:[/bold]
 - 在提示符下按 Ctrl+C 可随时退出程序
+- 合并过程中按 Ctrl+C 可取消合并，输出文件不会被改动
 - 输入文件路径时直接回车可结束添加文件
         """
         self.console.print(Panel(help_text, title="帮助"))
@@ -1,11 +1,73 @@
 from PIL import Image, ImageDraw
-from typing import List, Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Tuple, Optional, Union
+import inspect
 import os
-
-
+import tarfile
+import threading
+import zipfile
+
+from . import job_cache, metrics
+from .animation import has_animated_input, is_animated_output, merge_animated
+from .atlas import atlas_map_path, write_atlas_map
+from .color import ColorManager
+from .decoding import (
+    MAPPED_FORMATS,
+    MAPPED_MODES,
+    MappedImage,
+    map_uncompressed,
+    open_reduced,
+)
+from .layout import LayoutPlan, plan_grid, plan_layout, plan_linear
+from .modes import (
+    ALPHA_MODES,
+    canvas_mode,
+    mode_color,
+    output_supports,
+    output_supports_alpha,
+    working_mode,
+)
+from .png_encoder import save_png
+from .progress import (
+    CancellationToken,
+    MergeCancelled,
+    ProgressCallback,
+    ProgressReporter,
+)
+from .sources import (
+    Metadata,
+    Source,
+    close_source,
+    is_path,
+    open_source,
+    resolve_sources,
+    source_metadata,
+    source_modes,
+    source_sizes,
+)
+
+
+# 不影响合并结果的参数，不写入结果指纹
+# png_threads 只影响编码速度，解码后的像素不变
+_CONTROL_PARAMETERS = ("files", "output", "force", "png_threads", "progress", "cancel")
+
+# 合并时可预期的错误，命令行和 TUI 捕获后提示用户，其余异常视为程序错误继续抛出
+# Image.UnidentifiedImageError 是 OSError 的子类；压缩包损坏时抛出 zipfile/tarfile 错误
+MERGE_ERRORS = (
+    OSError,
+    ValueError,
+    MergeCancelled,
+    Image.DecompressionBombError,
+    zipfile.BadZipFile,
+    tarfile.TarError,
+)
+
+
+@metrics.track_merge
 def merge_images(
-    files: List[str],
-    output: str,
+    files: List[Source],
+    output: Union[str, BinaryIO],
     orientation: str = "horizontal",
     gap: int = 40,
     divider: bool = True,
@@ -18,44 +80,394 @@ def merge_images(
     margin: int = 0,
     cols: Optional[int] = None,
     rows: Optional[int] = None,
-) -> str:
+    auto_grid: bool = False,
+    target_aspect: float = 1.0,
+    atlas: bool = False,
+    atlas_max_size: Optional[int] = None,
+    atlas_power_of_two: bool = False,
+    animation_policy: str = "loop",
+    low_memory: bool = False,
+    preserve_mode: bool = True,
+    thumbnail_tolerance: Optional[float] = None,
+    color_profile: Optional[str] = None,
+    rendering_intent: str = "perceptual",
+    force: bool = False,
+    output_format: Optional[str] = None,
+    png_threads: Optional[int] = None,
+    progress: Optional[ProgressCallback] = None,
+    cancel: Optional[CancellationToken] = None,
+) -> Union[str, BinaryIO]:
+    """
+    合并多张图片并写入 output，返回 output
+
+    progress 会收到各阶段的进度事件；cancel 被取消后在下一个阶段抛出 MergeCancelled，
+    编码期间在写出下一块数据前抛出，输出文件不会被改动。
+
+    thumbnail_tolerance 不为 None 时允许使用 JPEG 内嵌的 EXIF 缩略图代替原图：
+    缩略图不小于放置区域的 (1 - thumbnail_tolerance) 倍即可使用，
+    0 表示缩略图不能小于放置区域。
+
+    color_profile 不为 None 时按嵌入的 ICC 配置把每张输入转换到该配置（srgb 或 ICC
+    文件路径），在 RGB 下合成并在输出中嵌入该配置；没有嵌入配置的输入视为 sRGB。
+    动图输出不做色彩管理。
+
+    atlas 为 True 时按原始尺寸把图片装入尽量小的图集（atlas_max_size 限制最大边长，
+    atlas_power_of_two 要求边长为 2 的幂），输出格式支持透明通道时背景透明；输出为文件时
+    在旁边写出同名的 .json 坐标表。
+
+    png_threads 大于 1 时 PNG 输出在多个线程中压缩（0 表示使用 CPU 核数），
+    像素与单线程编码相同，文件大小基本相同。
+    """
+    # 除输入、输出和执行控制参数外的全部参数都会写入结果指纹
+    options = {
+        name: value
+        for name, value in locals().items()
+        if name not in _CONTROL_PARAMETERS
+    }
+    reporter = ProgressReporter(progress, cancel)
+
     assert orientation in ("horizontal", "vertical")
     assert gap >= 0 and divider_thickness >= 0 and margin >= 0
-
-    images = [Image.open(f).convert("RGBA") for f in files]
-
-    # 如果指定了网格布局参数，则使用网格布局
-    if cols is not None or rows is not None:
-        return _merge_images_grid(
-            images=images,
-            output=output,
+    assert thumbnail_tolerance is None or 0 <= thumbnail_tolerance < 1
+    assert png_threads is None or png_threads >= 0
+    assert atlas_max_size is None or atlas_max_size > 0
+
+    # 压缩包按存储顺序读取成员的图片头，成员数据在解码时才读出
+    files = resolve_sources(files)
+    # 指纹、模式选择和布局规划共用一次索引查询
+    metas = source_metadata(files)
+
+    # 输入和参数都未变化且输出文件完好时，直接返回已有结果
+    # 输入或输出不是本地文件（例如标准输入输出）时无法缓存
+    fingerprint = None
+    if is_path(output) and all(is_path(f) for f in files):
+        fingerprint = job_cache.compute_fingerprint(files, options, metas)
+        if not force:
+            # 图集的坐标表也必须存在
+            if job_cache.is_up_to_date(output, fingerprint) and (
+                not atlas or os.path.isfile(atlas_map_path(output))
+            ):
+                metrics.CACHE_REQUESTS.inc(cache="result", result="hit")
+                reporter.emit("done", nbytes=os.path.getsize(output))
+                return output
+            metrics.CACHE_REQUESTS.inc(cache="result", result="miss")
+
+    animated = is_animated_output(output, output_format) and has_animated_input(files)
+
+    # 动图输出不做色彩管理
+    color = None
+    if color_profile is not None and not animated:
+        color = ColorManager(color_profile, rendering_intent)
+
+    # 输入的色彩模式一致时在最窄的公共模式下合成并编码，否则沿用 RGBA
+    mode = None
+    if preserve_mode and not animated:
+        mode = _choose_mode(
+            files, output, output_format, bg_color, divider_color, metas
+        )
+    # 图集的背景透明，在带透明通道的模式下合成
+    transparent = (
+        atlas
+        and not animated
+        and output_supports_alpha(_output_format(output, output_format))
+    )
+    if transparent and mode not in ALPHA_MODES:
+        mode = "LA" if mode == "L" else "RGBA"
+    if color is not None and mode not in ("RGB", "RGBA"):
+        # 色彩管理的结果为 RGB，灰度等窄模式无法保存转换后的颜色
+        mode = None
+
+    use_thumbnails = thumbnail_tolerance is not None and not animated
+    streaming = low_memory or auto_grid or use_thumbnails or mode is not None
+    streaming = streaming or color is not None or atlas
+    if animated or streaming:
+        # 只根据文件头（元数据索引）规划布局，不预先解码任何图片
+        plan = plan_layout(
+            sizes=source_sizes(files, metas),
+            orientation=orientation,
             gap=gap,
             divider=divider,
             divider_thickness=divider_thickness,
-            divider_color=divider_color,
-            bg_color=bg_color,
             align=align,
+            uniform_height=uniform_height,
+            uniform_width=uniform_width,
             margin=margin,
             cols=cols,
             rows=rows,
+            auto_grid=auto_grid,
+            target_aspect=target_aspect,
+            atlas=atlas,
+            atlas_max_size=atlas_max_size,
+            atlas_power_of_two=atlas_power_of_two,
         )
-    else:
-        # 使用原有的线性布局
-        return _merge_images_linear(
-            images=images,
+        reporter.emit("planned", 0, len(files), plan=plan)
+
+    if animated:
+        # 输出为 GIF/WebP 且输入包含动图时，逐帧合并为动图
+        result = merge_animated(
+            files=files,
             output=output,
-            orientation=orientation,
-            gap=gap,
-            divider=divider,
-            divider_thickness=divider_thickness,
+            plan=plan,
+            bg_color=bg_color,
             divider_color=divider_color,
+            policy=animation_policy,
+            output_format=output_format,
+            reporter=reporter,
+        )
+    elif streaming:
+        # 逐张解码、缩放、粘贴并释放，峰值内存约为画布加一张图片
+        # 自动网格（图片保持宽高比放入搜索得到的单元格）、图集、EXIF 缩略图、
+        # 窄模式合成和色彩管理也走这里
+        # 低内存模式和使用缩略图时 JPEG 等格式按放置区域大小降采样解码
+        result = _merge_images_streaming(
+            files=files,
+            output=output,
+            plan=plan,
             bg_color=bg_color,
-            align=align,
-            uniform_height=uniform_height,
-            uniform_width=uniform_width,
-            margin=margin,
+            divider_color=divider_color,
+            output_format=output_format,
+            mode=mode or "RGBA",
+            reporter=reporter,
+            thumbnail_tolerance=thumbnail_tolerance,
+            reduce=low_memory or use_thumbnails,
+            png_threads=png_threads,
+            color=color,
+            transparent=transparent,
+            metas=metas,
+        )
+    else:
+        images = _decode_all(files, "RGBA", reporter)
+
+        # 如果指定了网格布局参数，则使用网格布局
+        if cols is not None or rows is not None:
+            result = _merge_images_grid(
+                images=images,
+                output=output,
+                gap=gap,
+                divider=divider,
+                divider_thickness=divider_thickness,
+                divider_color=divider_color,
+                bg_color=bg_color,
+                align=align,
+                margin=margin,
+                cols=cols,
+                rows=rows,
+                output_format=output_format,
+                reporter=reporter,
+                png_threads=png_threads,
+            )
+        else:
+            # 使用原有的线性布局
+            result = _merge_images_linear(
+                images=images,
+                output=output,
+                orientation=orientation,
+                gap=gap,
+                divider=divider,
+                divider_thickness=divider_thickness,
+                divider_color=divider_color,
+                bg_color=bg_color,
+                align=align,
+                uniform_height=uniform_height,
+                uniform_width=uniform_width,
+                margin=margin,
+                output_format=output_format,
+                reporter=reporter,
+                png_threads=png_threads,
+            )
+
+    if atlas and is_path(output):
+        write_atlas_map(atlas_map_path(output), os.path.basename(output), files, plan)
+    if fingerprint is not None:
+        job_cache.save_fingerprint(result, fingerprint)
+    return result
+
+
+def merge_layouts(
+    files: List[Source],
+    layouts: List[Dict[str, Any]],
+    max_workers: Optional[int] = None,
+    force: bool = False,
+    png_threads: Optional[int] = None,
+) -> List[Union[str, BinaryIO]]:
+    """
+    用同一组输入一次生成多种布局
+
+    layouts 中每一项是一个布局，必须包含 output，其余键与 merge_images 的参数相同，
+    未给出的参数使用 merge_images 的默认值。每张图片只解码一次，同一尺寸的缩放结果
+    只计算一次，各布局的合成和编码在线程池中并发进行。返回值与 layouts 顺序一致。
+    """
+    jobs = [(layout.get("output"), _layout_options(layout)) for layout in layouts]
+
+    files = resolve_sources(files)
+    metas = source_metadata(files)
+    results: List[Optional[Union[str, BinaryIO]]] = [None] * len(jobs)
+
+    # 动图、低内存模式和图集有各自的逐帧/逐张处理方式，交给 merge_images 单独完成；
+    # 共用的解码只能使用一种色彩管理设置，与第一个布局不同的布局也单独完成
+    pending = []
+    color_key = None
+    for i, (output, options) in enumerate(jobs):
+        animated = is_animated_output(
+            output, options["output_format"]
+        ) and has_animated_input(files)
+        key = (options["color_profile"], options["rendering_intent"])
+        if options["color_profile"] is None:
+            key = (None, None)
+        separate = animated or options["low_memory"] or options["atlas"]
+        if color_key is None and not separate:
+            color_key = key
+        if separate or key != color_key:
+            results[i] = merge_images(
+                files, output, force=force, png_threads=png_threads, **options
+            )
+            continue
+        fingerprint = None
+        if is_path(output) and all(is_path(f) for f in files):
+            fingerprint = job_cache.compute_fingerprint(files, options, metas)
+            if not force:
+                if job_cache.is_up_to_date(output, fingerprint):
+                    metrics.CACHE_REQUESTS.inc(cache="result", result="hit")
+                    results[i] = output
+                    continue
+                metrics.CACHE_REQUESTS.inc(cache="result", result="miss")
+        pending.append((i, output, options, fingerprint))
+    if not pending:
+        return results
+
+    # 所有布局都能使用同一个窄模式时才按窄模式解码，否则统一转换为 RGBA
+    modes = {
+        _choose_mode(
+            files,
+            output,
+            options["output_format"],
+            options["bg_color"],
+            options["divider_color"],
+            metas,
+        )
+        if options["preserve_mode"]
+        else None
+        for _, output, options, _ in pending
+    }
+    mode = modes.pop() if len(modes) == 1 else None
+    color = None
+    if color_key[0] is not None:
+        color = ColorManager(*color_key)
+        if mode not in ("RGB", "RGBA"):
+            mode = None
+    work_mode = mode or "RGBA"
+
+    # 只根据文件头规划布局
+    input_sizes = source_sizes(files, metas)
+    plans = [
+        plan_layout(
+            sizes=input_sizes,
+            orientation=options["orientation"],
+            gap=options["gap"],
+            divider=options["divider"],
+            divider_thickness=options["divider_thickness"],
+            align=options["align"],
+            uniform_height=options["uniform_height"],
+            uniform_width=options["uniform_width"],
+            margin=options["margin"],
+            cols=options["cols"],
+            rows=options["rows"],
+            auto_grid=options["auto_grid"],
+            target_aspect=options["target_aspect"],
+        )
+        for _, _, options, _ in pending
+    ]
+
+    # 所有布局都允许使用 EXIF 缩略图时，按各布局中最大的放置区域选择缩略图或降采样解码
+    tolerances = [options["thumbnail_tolerance"] for _, _, options, _ in pending]
+    tolerance = None if None in tolerances else min(tolerances)
+    targets = [
+        (
+            max(plan.placements[i][2] for plan in plans),
+            max(plan.placements[i][3] for plan in plans),
+        )
+        for i in range(len(files))
+    ]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        # 每张图片只解码并转换一次
+        images = list(
+            pool.map(
+                lambda f, t: _open_in_mode(f, work_mode, t, tolerance, color),
+                files,
+                targets,
+            )
+        )
+
+        # 同一张图片缩放到同一尺寸只计算一次，供所有布局共用
+        sizes = {
+            (index, (w, h))
+            for plan in plans
+            for index, (_, _, w, h) in enumerate(plan.placements)
+            if images[index].size != (w, h)
+        }
+        resized = dict(
+            zip(
+                sizes,
+                pool.map(
+                    lambda key: images[key[0]].resize(key[1], Image.Resampling.LANCZOS),
+                    sizes,
+                ),
+            )
         )
 
+        # 每个布局计为一次合并
+        @metrics.track_merge
+        def render(job, plan):
+            _, output, options, _ = job
+            tiles = [
+                resized.get((index, (w, h)), im)
+                for index, (im, (_, _, w, h)) in enumerate(zip(images, plan.placements))
+            ]
+            canvas = _compose(
+                tiles,
+                plan,
+                options["bg_color"],
+                options["divider_color"],
+                mode=canvas_mode(mode) if mode else "RGBA",
+            )
+            return _save_canvas(
+                canvas,
+                output,
+                options["output_format"],
+                png_threads=png_threads,
+                icc_profile=color.profile if color is not None else None,
+            )
+
+        futures = [pool.submit(render, job, plan) for job, plan in zip(pending, plans)]
+        for (i, _, _, fingerprint), future in zip(pending, futures):
+            results[i] = future.result()
+            if fingerprint is not None:
+                job_cache.save_fingerprint(results[i], fingerprint)
+
+    return results
+
+
+def _layout_options(layout: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    检查布局参数，返回补全了 merge_images 默认值的参数（不含 output）
+    """
+    parameters = inspect.signature(merge_images).parameters
+    defaults = {
+        name: p.default
+        for name, p in parameters.items()
+        if name not in _CONTROL_PARAMETERS
+    }
+    unknown = set(layout) - set(defaults) - {"output"}
+    if unknown or "output" not in layout:
+        raise ValueError(
+            f"无效的布局参数: {', '.join(sorted(unknown)) or '缺少 output'}"
+        )
+    options = dict(defaults)
+    options.update((k, v) for k, v in layout.items() if k != "output")
+    assert options["orientation"] in ("horizontal", "vertical")
+    return options
+
 
 def _merge_images_linear(
     images: List[Image.Image],
@@ -70,97 +482,25 @@ def _merge_images_linear(
     uniform_height: Optional[int],
     uniform_width: Optional[int],
     margin: int,
-) -> str:
-    if orientation == "horizontal" and uniform_height is not None:
-        new_imgs = []
-        for im in images:
-            w, h = im.size
-            nh = uniform_height
-            nw = int(w * nh / h)
-            new_imgs.append(im.resize((nw, nh), Image.Resampling.LANCZOS))
-        images = new_imgs
-    elif orientation == "vertical" and uniform_width is not None:
-        new_imgs = []
-        for im in images:
-            w, h = im.size
-            nw = uniform_width
-            nh = int(h * nw / w)
-            new_imgs.append(im.resize((nw, nh), Image.Resampling.LANCZOS))
-        images = new_imgs
-
-    widths = [im.width for im in images]
-    heights = [im.height for im in images]
-    n = len(images)
-    num_gaps = max(n - 1, 0)
-
-    total_dividers = num_gaps * (
-        divider_thickness if divider and divider_thickness > 0 else 0
+    output_format: Optional[str] = None,
+    reporter: Optional[ProgressReporter] = None,
+    png_threads: Optional[int] = None,
+) -> Union[str, BinaryIO]:
+    plan = plan_linear(
+        sizes=[im.size for im in images],
+        orientation=orientation,
+        gap=gap,
+        divider=divider,
+        divider_thickness=divider_thickness,
+        align=align,
+        uniform_height=uniform_height,
+        uniform_width=uniform_width,
+        margin=margin,
     )
-
-    if orientation == "horizontal":
-        canvas_w = sum(widths) + num_gaps * gap + total_dividers + 2 * margin
-        canvas_h = max(heights) + 2 * margin
-    else:
-        canvas_w = max(widths) + 2 * margin
-        canvas_h = sum(heights) + num_gaps * gap + total_dividers + 2 * margin
-
-    canvas = Image.new("RGBA", (canvas_w, canvas_h), bg_color + (255,))
-    draw = ImageDraw.Draw(canvas)
-
-    cursor_x, cursor_y = margin, margin
-    for idx, im in enumerate(images):
-        w, h = im.size
-
-        if orientation == "horizontal":
-            if align == "center":
-                paste_y = margin + (canvas_h - 2 * margin - h) // 2
-            elif align == "end":
-                paste_y = canvas_h - margin - h
-            else:
-                paste_y = margin
-            canvas.paste(im, (cursor_x, paste_y), im)
-            cursor_x += w
-
-            if idx < n - 1:
-                half_gap_left = gap // 2
-                cursor_x += half_gap_left
-                if divider and divider_thickness > 0:
-                    x0 = cursor_x
-                    x1 = cursor_x + divider_thickness - 1
-                    y0 = margin
-                    y1 = canvas_h - margin - 1
-                    draw.rectangle([x0, y0, x1, y1], fill=divider_color)
-                    cursor_x += divider_thickness
-                half_gap_right = gap - half_gap_left
-                cursor_x += half_gap_right
-        else:
-            if align == "center":
-                paste_x = margin + (canvas_w - 2 * margin - w) // 2
-            elif align == "end":
-                paste_x = canvas_w - margin - w
-            else:
-                paste_x = margin
-            canvas.paste(im, (paste_x, cursor_y), im)
-            cursor_y += h
-
-            if idx < n - 1:
-                half_gap_top = gap // 2
-                cursor_y += half_gap_top
-                if divider and divider_thickness > 0:
-                    x0 = margin
-                    x1 = canvas_w - margin - 1
-                    y0 = cursor_y
-                    y1 = cursor_y + divider_thickness - 1
-                    draw.rectangle([x0, y0, x1, y1], fill=divider_color)
-                    cursor_y += divider_thickness
-                half_gap_bottom = gap - half_gap_top
-                cursor_y += half_gap_bottom
-
-    output_dir = os.path.dirname(output)
-    if output_dir:
-        os.makedirs(output_dir, exist_ok=True)
-    canvas.convert("RGB").save(output)
-    return output
+    if reporter is not None:
+        reporter.emit("planned", 0, len(images), plan=plan)
+    canvas = _compose(images, plan, bg_color, divider_color, reporter=reporter)
+    return _save_canvas(canvas, output, output_format, reporter, png_threads)
 
 
 def _merge_images_grid(
@@ -175,116 +515,363 @@ def _merge_images_grid(
     margin: int,
     cols: Optional[int],
     rows: Optional[int],
-) -> str:
-    n = len(images)
-
-    # 计算网格布局的行列数
-    if cols is not None and rows is not None:
-        # 如果同时指定行数和列数，直接使用
-        grid_cols = cols
-        grid_rows = rows
-    elif cols is not None:
-        # 如果只指定列数，计算所需行数
-        grid_cols = cols
-        grid_rows = (n + grid_cols - 1) // grid_cols  # 向上取整
-    elif rows is not None:
-        # 如果只指定行数，计算所需列数
-        grid_rows = rows
-        grid_cols = (n + grid_rows - 1) // grid_rows  # 向上取整
-    else:
-        # 这种情况不应该发生，但为了安全起见
-        grid_cols = int(n**0.5)  # 简单的平方根布局
-        grid_rows = (n + grid_cols - 1) // grid_cols
-
-    # 确保网格大小能容纳所有图像
-    if grid_cols * grid_rows < n:
-        if cols is not None:  # 如果固定了列数
-            grid_rows = (n + grid_cols - 1) // grid_cols
-        elif rows is not None:  # 如果固定了行数
-            grid_cols = (n + grid_rows - 1) // grid_rows
-        else:  # 都没固定则调整
-            grid_cols = int(n**0.5)
-            grid_rows = (n + grid_cols - 1) // grid_cols
-
-    # 统一调整图像大小
-    # 找到网格中每个位置对应的实际图片，计算目标尺寸
-    max_width = 0
-    max_height = 0
-
-    for img in images:
-        max_width = max(max_width, img.width)
-        max_height = max(max_height, img.height)
-
-    # 缩放所有图片到统一尺寸
-    resized_images = []
-    for img in images:
-        resized_img = img.resize((max_width, max_height), Image.Resampling.LANCZOS)
-        resized_images.append(resized_img)
-
-    # 计算画布尺寸
-    total_gap_cols = max(grid_cols - 1, 0)
-    total_gap_rows = max(grid_rows - 1, 0)
-    total_divider_cols = total_gap_cols * (
-        divider_thickness if divider and divider_thickness > 0 else 0
-    )
-    total_divider_rows = total_gap_rows * (
-        divider_thickness if divider and divider_thickness > 0 else 0
+    output_format: Optional[str] = None,
+    reporter: Optional[ProgressReporter] = None,
+    png_threads: Optional[int] = None,
+) -> Union[str, BinaryIO]:
+    plan = plan_grid(
+        sizes=[im.size for im in images],
+        gap=gap,
+        divider=divider,
+        divider_thickness=divider_thickness,
+        margin=margin,
+        cols=cols,
+        rows=rows,
     )
+    if reporter is not None:
+        reporter.emit("planned", 0, len(images), plan=plan)
+    canvas = _compose(images, plan, bg_color, divider_color, reporter=reporter)
+    return _save_canvas(canvas, output, output_format, reporter, png_threads)
 
-    canvas_w = (
-        grid_cols * max_width + total_gap_cols * gap + total_divider_cols + 2 * margin
-    )
-    canvas_h = (
-        grid_rows * max_height + total_gap_rows * gap + total_divider_rows + 2 * margin
+
+def _merge_images_streaming(
+    files: List[Source],
+    output: Union[str, BinaryIO],
+    plan: LayoutPlan,
+    bg_color: Tuple[int, int, int],
+    divider_color: Tuple[int, int, int],
+    output_format: Optional[str] = None,
+    mode: str = "RGBA",
+    reporter: Optional[ProgressReporter] = None,
+    thumbnail_tolerance: Optional[float] = None,
+    reduce: bool = True,
+    png_threads: Optional[int] = None,
+    color: Optional[ColorManager] = None,
+    transparent: bool = False,
+    metas: Optional[Metadata] = None,
+) -> Union[str, BinaryIO]:
+    """
+    逐张解码并绘制到画布上
+
+    reduce 为 True 时 JPEG 等格式按放置区域大小降采样解码，允许时直接使用 EXIF 缩略图。
+    只有放置区域小于原图时降采样才会生效（例如 uniform_height/uniform_width 缩小的
+    线性布局）；cols/rows 网格的单元格等于最大输入的尺寸，输入都按原尺寸解码，
+    这时节省的内存来自逐张解码，而不是降采样。
+    未压缩的输入不需要缩放时内存映射后按条带粘贴，不解码整张图片；只有元数据中的格式
+    可能未压缩且尺寸等于放置区域时才打开文件检查能否映射。metas 为 source_metadata
+    的结果，未提供时查询索引。
+    给出 color 时每张图片先转换到目标色彩配置，输出嵌入该配置。
+    transparent 为 True 时画布为全透明的工作模式（必须带透明通道），图片连同透明通道
+    直接复制到画布上，用于放置区域互不重叠的图集。
+    """
+    reporter = reporter or ProgressReporter()
+    if transparent:
+        canvas = Image.new(mode, plan.canvas_size, 0)
+    else:
+        # 直接在不透明的画布上合成，保存时无需再复制一份画布
+        canvas = _compose([], plan, bg_color, divider_color, mode=canvas_mode(mode))
+    blend = mode in ALPHA_MODES and not transparent
+
+    if metas is None:
+        metas = source_metadata(files)
+    total = len(plan.placements)
+    for i, (source, (x, y, w, h)) in enumerate(zip(files, plan.placements)):
+        meta = metas[i]
+        mapped = None
+        if (
+            meta is not None
+            and meta.format in MAPPED_FORMATS
+            and meta.mode in MAPPED_MODES
+            and meta.dimensions == (w, h)
+        ):
+            mapped = map_uncompressed(source)
+        if mapped is not None:
+            with mapped:
+                if mapped.size == (w, h):
+                    metrics.record_decode(source, mapped)
+                    reporter.emit("decoded", i + 1, total)
+                    _paste_mapped(canvas, mapped, (x, y), mode, color, blend)
+                    reporter.emit("resized", i + 1, total)
+                    continue
+
+        im = open_reduced(source, (w, h) if reduce else None, thumbnail_tolerance)
+        try:
+            im.load()
+            metrics.record_decode(source, im)
+            tile = _to_mode(im, mode, color)
+            reporter.emit("decoded", i + 1, total)
+            if tile.size != (w, h):
+                tile = tile.resize((w, h), Image.Resampling.LANCZOS)
+            canvas.paste(tile, (x, y), tile if blend else None)
+            del tile
+        finally:
+            close_source(source, im)
+        reporter.emit("resized", i + 1, total)
+    reporter.emit("composed")
+
+    icc_profile = color.profile if color is not None else None
+    return _save_canvas(
+        canvas, output, output_format, reporter, png_threads, icc_profile, transparent
     )
 
-    canvas = Image.new("RGBA", (canvas_w, canvas_h), bg_color + (255,))
+
+def _to_mode(
+    im: Image.Image,
+    mode: str,
+    color: Optional[ColorManager] = None,
+    icc_profile: Optional[bytes] = None,
+) -> Image.Image:
+    """
+    给出 color 时先转换到目标色彩配置，再转换为工作模式，模式相同时不复制
+    """
+    if color is not None:
+        im = color.convert(im, icc_profile)
+    return im if im.mode == mode else im.convert(mode)
+
+
+def _paste_mapped(
+    canvas: Image.Image,
+    mapped: MappedImage,
+    position: Tuple[int, int],
+    mode: str,
+    color: Optional[ColorManager] = None,
+    blend: bool = True,
+) -> None:
+    """
+    把内存映射的图片逐条带转换为工作模式并粘贴到画布上，结果与整张粘贴相同
+
+    blend 为 False 时不按透明通道混合，连同透明通道直接复制。
+    """
+    x, y = position
+    for top, band in mapped.bands():
+        band = _to_mode(band, mode, color, mapped.icc_profile)
+        mask = band if blend and mode in ALPHA_MODES else None
+        canvas.paste(band, (x, y + top), mask)
+        del band
+
+
+def _compose(
+    images: List[Image.Image],
+    plan: LayoutPlan,
+    bg_color: Tuple[int, int, int],
+    divider_color: Tuple[int, int, int],
+    resample: Image.Resampling = Image.Resampling.LANCZOS,
+    mode: str = "RGBA",
+    reporter: Optional[ProgressReporter] = None,
+) -> Image.Image:
+    """
+    按布局规划把图片绘制到画布上，尺寸不符的图片会先缩放到放置区域大小
+
+    带透明通道的图片（RGBA/LA）按透明通道混合，画布为 RGB 时结果与 RGBA 画布转换为
+    RGB 后相同。背景色和分隔线颜色会转换为画布模式下的像素值。
+    """
+    canvas = Image.new(mode, plan.canvas_size, mode_color(bg_color, mode))
     draw = ImageDraw.Draw(canvas)
 
-    # 放置图像到网格中
-    for idx, img in enumerate(resized_images):
-        # 计算网格中的行和列
-        row = idx // grid_cols
-        col = idx % grid_cols
-
-        # 计算在画布上的位置
-        x = margin + col * (
-            max_width
-            + gap
-            + (divider_thickness if divider and divider_thickness > 0 else 0)
-        )
-        y = margin + row * (
-            max_height
-            + gap
-            + (divider_thickness if divider and divider_thickness > 0 else 0)
-        )
+    # 分隔线与图片区域互不重叠，先画分隔线不影响结果
+    for box in plan.dividers:
+        draw.rectangle(box, fill=mode_color(divider_color, mode))
+
+    for i, (im, (x, y, w, h)) in enumerate(zip(images, plan.placements)):
+        if im.size != (w, h):
+            im = im.resize((w, h), resample)
+        canvas.paste(im, (x, y), im if im.mode in ALPHA_MODES else None)
+        if reporter is not None:
+            reporter.emit("resized", i + 1, len(images))
+
+    if reporter is not None:
+        reporter.emit("composed")
+    return canvas
+
 
-        # 如果启用了divider，需要考虑divider的偏移
-        if divider and divider_thickness > 0:
-            x += col * divider_thickness
-            y += row * divider_thickness
-
-        # 绘制divider（如果是非最后一列或最后一行）
-        if divider and divider_thickness > 0 and col < grid_cols - 1:
-            # 垂直divider
-            x0 = x + max_width
-            x1 = x0 + divider_thickness - 1
-            y0 = y
-            y1 = y + max_height - 1
-            draw.rectangle([x0, y0, x1, y1], fill=divider_color)
-
-        if divider and divider_thickness > 0 and row < grid_rows - 1:
-            # 水平divider
-            x0 = x
-            x1 = x + max_width - 1
-            y0 = y + max_height
-            y1 = y0 + divider_thickness - 1
-            draw.rectangle([x0, y0, x1, y1], fill=divider_color)
-
-        canvas.paste(img, (x, y), img)
-
-    output_dir = os.path.dirname(output)
-    if output_dir:
-        os.makedirs(output_dir, exist_ok=True)
-    canvas.convert("RGB").save(output)
+def _choose_mode(
+    files: List[Source],
+    output: Union[str, BinaryIO],
+    output_format: Optional[str],
+    bg_color: Tuple[int, int, int],
+    divider_color: Tuple[int, int, int],
+    metas: Optional[Metadata] = None,
+) -> Optional[str]:
+    """
+    根据输入的文件头选择工作模式，输出格式无法保存该模式时返回 None
+    """
+    mode = working_mode(source_modes(files, metas), bg_color, divider_color)
+    if mode is None:
+        return None
+    return (
+        mode if output_supports(mode, _output_format(output, output_format)) else None
+    )
+
+
+def _output_format(
+    output: Union[str, BinaryIO], output_format: Optional[str]
+) -> Optional[str]:
+    """
+    输出格式，未指定时根据输出文件的扩展名判断
+    """
+    if output_format is None and is_path(output):
+        extension = os.path.splitext(output)[1].lower()
+        output_format = Image.registered_extensions().get(extension)
+    return output_format
+
+
+def _decode_all(
+    files: List[Source], mode: str, reporter: ProgressReporter
+) -> List[Image.Image]:
+    """
+    依次解码全部输入，每解码一张发出一次进度事件
+    """
+    images = []
+    for i, source in enumerate(files):
+        images.append(_open_in_mode(source, mode))
+        reporter.emit("decoded", i + 1, len(files))
+    return images
+
+
+def _open_in_mode(
+    source: Source,
+    mode: str,
+    target: Optional[Tuple[int, int]] = None,
+    thumbnail_tolerance: Optional[float] = None,
+    color: Optional[ColorManager] = None,
+) -> Image.Image:
+    """
+    打开输入并解码为工作模式，模式相同时不复制
+
+    返回的图片已经解码完毕，可以在多个线程中同时读取。给出 thumbnail_tolerance 时
+    按 target 降采样解码，或在缩略图足够大时使用 EXIF 缩略图。给出 color 时先转换到
+    目标色彩配置。
+    """
+    if thumbnail_tolerance is not None:
+        im = open_reduced(source, target, thumbnail_tolerance)
+    else:
+        im = open_source(source)
+    im.load()
+    metrics.record_decode(source, im)
+    return _to_mode(im, mode, color)
+
+
+@contextmanager
+def _atomic_output(output: str) -> Iterator[str]:
+    """
+    返回同目录下的临时文件路径，写入成功后替换为目标文件，失败或取消时删除临时文件
+
+    临时文件保留原扩展名，Pillow 仍可根据扩展名确定输出格式。
+    """
+    directory, name = os.path.split(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    extension = os.path.splitext(name)[1]
+    tmp_path = os.path.join(
+        directory, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp{extension}"
+    )
+    try:
+        yield tmp_path
+        os.replace(tmp_path, output)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _stream_position(stream: BinaryIO) -> Optional[int]:
+    try:
+        return stream.tell()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def _save_canvas(
+    canvas: Image.Image,
+    output: Union[str, BinaryIO],
+    output_format: Optional[str] = None,
+    reporter: Optional[ProgressReporter] = None,
+    png_threads: Optional[int] = None,
+    icc_profile: Optional[bytes] = None,
+    keep_alpha: bool = False,
+) -> Union[str, BinaryIO]:
+    reporter = reporter or ProgressReporter()
+    # 窄模式（L、RGB、I;16）的画布直接编码，不再扩展为 RGB
+    if canvas.mode in ALPHA_MODES and not keep_alpha:
+        canvas = canvas.convert("RGB")
+    if icc_profile is not None:
+        # 多线程 PNG 编码从 info 中读取配置，其他格式通过保存参数嵌入
+        canvas.info["icc_profile"] = icc_profile
+    reporter.emit("encoding")
+    # 没有取消令牌时不包装输出，保留 Pillow 直接写文件描述符的路径
+    check = reporter.check if reporter.cancel is not None else None
+    if not is_path(output):
+        # 输出到数据流（例如标准输出）时必须显式指定格式
+        start = _stream_position(output)
+        _encode(canvas, output, output_format, png_threads, check)
+        end = _stream_position(output)
+        nbytes = end - start if start is not None and end is not None else None
+        metrics.record_output(canvas.size, nbytes)
+        reporter.emit("done", nbytes=nbytes)
+        return output
+    with _atomic_output(output) as tmp_path:
+        _encode(
+            canvas, tmp_path, _output_format(output, output_format), png_threads, check
+        )
+    nbytes = os.path.getsize(output)
+    metrics.record_output(canvas.size, nbytes)
+    reporter.emit("done", nbytes=nbytes)
     return output
+
+
+class _CheckedWriter:
+    """
+    包装输出文件，每次写入前检查取消令牌
+
+    不提供 fileno，Pillow（包括 libtiff）只能通过 write 逐块写出编码数据，
+    编码大画布时也能在两次写入之间响应取消。
+    """
+
+    def __init__(self, fp: BinaryIO, check: Callable[[], None]):
+        self._fp = fp
+        self._check = check
+
+    def write(self, data: bytes) -> int:
+        self._check()
+        return self._fp.write(data)
+
+    def tell(self) -> int:
+        return self._fp.tell()
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        return self._fp.seek(offset, whence)
+
+    def flush(self) -> None:
+        self._fp.flush()
+
+
+def _encode(
+    canvas: Image.Image,
+    output: Union[str, BinaryIO],
+    output_format: Optional[str],
+    png_threads: Optional[int],
+    check: Optional[Callable[[], None]] = None,
+) -> None:
+    """
+    编码画布，PNG 输出且 png_threads 不为 None 或 1 时多线程压缩
+
+    check 不为 None 时在编码过程中反复调用，用于响应取消。
+    """
+    threaded_png = (
+        png_threads not in (None, 1) and (output_format or "").upper() == "PNG"
+    )
+    if is_path(output) and (threaded_png or check is not None):
+        with open(output, "wb") as f:
+            _encode(canvas, f, output_format, png_threads, check)
+        return
+    if check is not None:
+        output = _CheckedWriter(output, check)
+    if threaded_png:
+        save_png(canvas, output, png_threads, check=check)
+        return
+    params = {}
+    if "icc_profile" in canvas.info:
+        params["icc_profile"] = canvas.info["icc_profile"]
+    canvas.save(output, format=output_format, **params)
@@ -0,0 +1,237 @@
+"""
+图片元数据索引模块
+
+该模块在用户缓存目录下维护一个 SQLite 索引，按 (路径, 修改时间, 文件大小)
+记录图片的尺寸、模式、是否含透明通道、格式以及内容哈希。文件未变化时直接返回索引中的
+记录，只需一次 stat 而无需打开文件；文件变化时才重新读取文件头并更新索引。
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from PIL import Image
+
+from . import metrics
+
+CACHE_DIR = Path.home() / ".cache" / "image-process-cli"
+INDEX_FILE = CACHE_DIR / "metadata.sqlite3"
+
+# 计算内容哈希时每次读取的字节数
+HASH_CHUNK_SIZE = 1 << 20
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    mode TEXT NOT NULL,
+    has_alpha INTEGER NOT NULL,
+    format TEXT,
+    content_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS images_directory ON images (directory);
+"""
+
+
+class ImageMetadata(NamedTuple):
+    """
+    单张图片的元数据
+    """
+
+    path: str
+    mtime_ns: int
+    size: int
+    width: int
+    height: int
+    mode: str
+    has_alpha: bool
+    format: Optional[str]
+    content_hash: Optional[str]
+
+    @property
+    def dimensions(self) -> Tuple[int, int]:
+        return self.width, self.height
+
+
+class MetadataIndex:
+    """
+    图片元数据索引类
+
+    同一个实例可以在多个线程中使用，内部通过锁串行化数据库访问。
+    """
+
+    def __init__(self, db_path=INDEX_FILE):
+        self.db_path = str(db_path)
+        if self.db_path != ":memory:":
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        if self.db_path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self.probes = 0
+
+    def get(
+        self, path: str, stat: Optional[os.stat_result] = None, with_hash: bool = False
+    ) -> ImageMetadata:
+        """
+        获取图片元数据，索引中的记录过期时重新读取文件头
+
+        with_hash 为 True 时保证返回结果包含内容哈希。
+        """
+        stats = [stat] if stat is not None else None
+        return self.get_many([path], stats, with_hash)[0]
+
+    def get_many(
+        self,
+        paths: Iterable[str],
+        stats: Optional[List[os.stat_result]] = None,
+        with_hash: bool = False,
+    ) -> List[ImageMetadata]:
+        """
+        批量获取图片元数据，所有更新在一个事务中提交
+        """
+        paths = [os.path.abspath(p) for p in paths]
+        if stats is None:
+            stats = [os.stat(p) for p in paths]
+
+        results = []
+        updates = []
+        with self._lock:
+            for path, st in zip(paths, stats):
+                row = self._conn.execute(
+                    "SELECT path, mtime_ns, size, width, height, mode, has_alpha,"
+                    " format, content_hash FROM images WHERE path = ?",
+                    (path,),
+                ).fetchone()
+                meta = ImageMetadata(*row[:6], bool(row[6]), *row[7:]) if row else None
+                if (
+                    meta is None
+                    or meta.mtime_ns != st.st_mtime_ns
+                    or meta.size != st.st_size
+                ):
+                    meta = self._probe(path, st)
+                    updates.append(meta)
+                    metrics.CACHE_REQUESTS.inc(cache="metadata", result="miss")
+                else:
+                    metrics.CACHE_REQUESTS.inc(cache="metadata", result="hit")
+                if with_hash and meta.content_hash is None:
+                    meta = meta._replace(content_hash=file_hash(path))
+                    updates.append(meta)
+                results.append(meta)
+
+            if updates:
+                with self._conn:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO images"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        [
+                            (
+                                m.path,
+                                os.path.dirname(m.path),
+                                m.mtime_ns,
+                                m.size,
+                                m.width,
+                                m.height,
+                                m.mode,
+                                int(m.has_alpha),
+                                m.format,
+                                m.content_hash,
+                            )
+                            for m in updates
+                        ],
+                    )
+        return results
+
+    def forget_missing(self, directory: str, present: Iterable[str]) -> int:
+        """
+        删除目录下已经不存在的文件记录，返回删除的条数
+
+        present 为扫描时在该目录中看到的文件路径。扫描只列出部分文件（例如文件选择器
+        不显示的格式，或被过滤条件隐藏的文件），因此不在 present 中的记录还要确认文件
+        确实不存在才删除，其他命令索引的文件不受影响。
+        """
+        directory = os.path.abspath(directory)
+        present_set = {os.path.abspath(p) for p in present}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path FROM images WHERE directory = ?", (directory,)
+            ).fetchall()
+            missing = [
+                (p,) for (p,) in rows if p not in present_set and not os.path.exists(p)
+            ]
+            if missing:
+                with self._conn:
+                    self._conn.executemany("DELETE FROM images WHERE path = ?", missing)
+        return len(missing)
+
+    def close(self) -> None:
+        """
+        关闭数据库连接
+        """
+        with self._lock:
+            self._conn.close()
+
+    def _probe(self, path: str, st: os.stat_result) -> ImageMetadata:
+        """
+        只读取文件头获取图片信息
+        """
+        self.probes += 1
+        with Image.open(path) as im:
+            has_alpha = im.mode in ("RGBA", "LA", "PA", "RGBa", "La") or (
+                "transparency" in im.info
+            )
+            return ImageMetadata(
+                path=path,
+                mtime_ns=st.st_mtime_ns,
+                size=st.st_size,
+                width=im.width,
+                height=im.height,
+                mode=im.mode,
+                has_alpha=has_alpha,
+                format=im.format,
+                content_hash=None,
+            )
+
+
+def file_hash(path: str) -> str:
+    """
+    计算文件内容哈希
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+_default_index: Optional[MetadataIndex] = None
+_default_lock = threading.Lock()
+
+
+def get_index() -> MetadataIndex:
+    """
+    获取进程内共享的元数据索引，缓存目录不可写时退回到内存数据库
+    """
+    global _default_index
+    with _default_lock:
+        if _default_index is None:
+            try:
+                _default_index = MetadataIndex()
+            except (OSError, sqlite3.Error):
+                _default_index = MetadataIndex(":memory:")
+        return _default_index
+
+
+def image_sizes(paths: Iterable[str]) -> List[Tuple[int, int]]:
+    """
+    通过索引获取一组图片的尺寸，文件未变化时不会打开文件
+    """
+    return [meta.dimensions for meta in get_index().get_many(paths)]
@@ -0,0 +1,365 @@
+"""
+运行指标模块
+
+该模块维护一个进程内的指标注册表，合并函数和命令行会更新其中的计数器和直方图：
+合并次数（按结果）、失败次数（按异常类型）、合并耗时、各阶段（解码/缩放/编码）耗时、
+输入和输出字节数、像素吞吐量以及各类缓存的命中情况。
+
+指标默认关闭，关闭时每次更新只做一次布尔判断。启用后可以写成文本文件供 node exporter
+的 textfile collector 读取，也可以在长时间运行的进程中通过本地 HTTP 的 /metrics 提供。
+设置环境变量 IMAGE_PROCESS_METRICS_FILE 或 IMAGE_PROCESS_METRICS_PORT
+即可在 TUI 中启用。
+"""
+
+import atexit
+import functools
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# 耗时直方图的桶上界（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+_enabled = False
+
+
+def enable() -> None:
+    """
+    启用指标采集
+    """
+    global _enabled
+    _enabled = True
+
+
+def disable() -> None:
+    """
+    关闭指标采集，已采集的数据保留
+    """
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """
+    指标基类，按标签值分别保存数据
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    """
+    只增不减的计数器
+    """
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if not _enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self, openmetrics: bool) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}_total{_format_labels(self.labelnames, key)} "
+            f"{_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Histogram(_Metric):
+    """
+    直方图，记录每个桶的累计次数、总次数和总和
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value: float, **labels: str) -> None:
+        if not _enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ([0], 0.0))
+            return counts[-1]
+
+    def samples(self, openmetrics: bool) -> List[str]:
+        with self._lock:
+            items = sorted((k, (list(c), s)) for k, (c, s) in self._values.items())
+        lines = []
+        for key, (counts, total) in items:
+            for bound, count in zip(self.buckets, counts):
+                labels = _format_labels(
+                    self.labelnames + ("le",), key + (_format_value(bound),)
+                )
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    指标注册表
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def counter(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def clear(self) -> None:
+        for metric in self._metrics:
+            metric.clear()
+
+    def render(self, openmetrics: bool = False) -> str:
+        """
+        导出为文本格式
+
+        openmetrics 为 False 时输出 Prometheus 文本格式（node exporter 的
+        textfile collector 使用该格式），为 True 时输出 OpenMetrics 格式。
+        两者的区别在于计数器的 TYPE 名称和结尾的 # EOF。
+        """
+        lines = []
+        for metric in self._metrics:
+            family = metric.name
+            if metric.kind == "counter" and not openmetrics:
+                family = f"{metric.name}_total"
+            lines.append(f"# HELP {family} {metric.documentation}")
+            lines.append(f"# TYPE {family} {metric.kind}")
+            lines.extend(metric.samples(openmetrics))
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+MERGES = REGISTRY.counter(
+    "image_process_merges", "合并任务数，按结果 (ok/error/cancelled) 区分", ("status",)
+)
+FAILURES = REGISTRY.counter(
+    "image_process_failures", "合并失败次数，按异常类型区分", ("error",)
+)
+MERGE_SECONDS = REGISTRY.histogram(
+    "image_process_merge_duration_seconds", "单次合并的耗时"
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    "image_process_stage_duration_seconds",
+    "各阶段的耗时 (decode/resize 为单张图片，encode 为整个输出)",
+    ("stage",),
+)
+INPUT_BYTES = REGISTRY.counter(
+    "image_process_input_bytes",
+    "解码的输入大小 (本地文件为文件大小，http(s) 为下载的字节数)",
+)
+BYTES_WRITTEN = REGISTRY.counter("image_process_written_bytes", "写出的输出字节数")
+PIXELS = REGISTRY.counter(
+    "image_process_pixels", "处理的像素数 (decoded: 解码, output: 输出画布)", ("kind",)
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "image_process_cache_requests",
+    "缓存查询次数，按缓存 (metadata/result/preview/http/icc) 和结果 (hit/miss) 区分",
+    ("cache", "result"),
+)
+
+
+def track_merge(func):
+    """
+    装饰合并函数：统计合并次数、失败类型和耗时，关闭时直接调用原函数
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        from .progress import MergeCancelled
+
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except MergeCancelled:
+            MERGES.inc(status="cancelled")
+            raise
+        except Exception as e:
+            MERGES.inc(status="error")
+            FAILURES.inc(error=type(e).__name__)
+            raise
+        MERGES.inc(status="ok")
+        MERGE_SECONDS.observe(time.perf_counter() - start)
+        return result
+
+    return wrapper
+
+
+def record_decode(source, im) -> None:
+    """
+    记录一次解码的像素数，输入为本地文件时同时记录文件大小
+
+    记录的是输入大小而不是实际读取的字节数：降采样解码、EXIF 缩略图和内存映射实际
+    读取的数据可能更少。
+    """
+    if not _enabled:
+        return
+    PIXELS.inc(im.width * im.height, kind="decoded")
+    if isinstance(source, str):
+        try:
+            INPUT_BYTES.inc(os.path.getsize(source))
+        except OSError:
+            pass
+
+
+def record_output(size: Tuple[int, int], nbytes: Optional[int]) -> None:
+    """
+    记录一次输出的画布像素数和写出的字节数
+    """
+    if not _enabled:
+        return
+    PIXELS.inc(size[0] * size[1], kind="output")
+    if nbytes:
+        BYTES_WRITTEN.inc(nbytes)
+
+
+def write_textfile(path: str, registry: MetricsRegistry = REGISTRY) -> None:
+    """
+    把指标写入文本文件，先写临时文件再替换，避免 node exporter 读到不完整的内容
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(registry.render())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+        body = self.registry.render(openmetrics).encode("utf-8")
+        self.send_response(200)
+        self.send_header(
+            "Content-Type",
+            OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE,
+        )
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 不在终端输出访问日志
+        pass
+
+
+def serve(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    在后台线程中启动 /metrics HTTP 服务并启用指标采集，返回服务对象
+    """
+    enable()
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def configure_from_env() -> None:
+    """
+    根据环境变量启用指标：IMAGE_PROCESS_METRICS_FILE 在进程退出时写入文本文件，
+    IMAGE_PROCESS_METRICS_PORT 在本地端口提供 /metrics
+    """
+    path = os.environ.get("IMAGE_PROCESS_METRICS_FILE")
+    port = os.environ.get("IMAGE_PROCESS_METRICS_PORT")
+    if path:
+        enable()
+        atexit.register(write_textfile, path)
+    if port:
+        serve(int(port))
@@ -0,0 +1,98 @@
+"""
+工作模式选择模块
+
+默认情况下所有输入都会转换为 RGBA（每像素 4 字节）再合成。当一批输入的色彩模式一致时，
+可以直接在更窄的模式下合成并编码：灰度图使用 L（1 字节），带透明通道的灰度图使用 LA，
+不透明的彩色图使用 RGB，16 位灰度图使用 I;16 以保留精度。输入模式混杂、含调色板或
+背景色/分隔线颜色无法在该模式下表示时，返回 None，沿用 RGBA 合成。
+"""
+
+from typing import List, Optional, Tuple, Union
+
+# 16 位灰度图在不同字节序下的模式名
+SIXTEEN_BIT_MODES = ("I;16", "I;16L", "I;16B")
+
+# 带透明通道的工作模式，粘贴时以自身的透明通道作为蒙版
+ALPHA_MODES = ("RGBA", "LA")
+
+# 可以直接保存 16 位灰度图的输出格式
+SIXTEEN_BIT_FORMATS = ("PNG", "TIFF")
+
+# 可以保存透明通道的输出格式
+ALPHA_FORMATS = ("PNG", "WEBP", "TIFF", "TGA")
+
+Color = Tuple[int, int, int]
+
+
+def _is_gray(color: Color) -> bool:
+    return color[0] == color[1] == color[2]
+
+
+def working_mode(
+    modes: List[Tuple[str, bool]], bg_color: Color, divider_color: Color
+) -> Optional[str]:
+    """
+    根据各输入的 (模式, 是否含透明通道) 选择最窄的公共工作模式
+
+    只在结果与 RGBA 合成完全一致（16 位输入则保留完整精度）时返回窄模式，否则返回 None。
+    """
+    if not modes:
+        return None
+    kinds = {mode for mode, _ in modes}
+    # 带 transparency 信息的 L/RGB 图片实际含透明像素，交给 RGBA 处理
+    if any(has_alpha and mode not in ALPHA_MODES for mode, has_alpha in modes):
+        return None
+    gray_colors = _is_gray(bg_color) and _is_gray(divider_color)
+
+    if kinds <= {"1", "L"}:
+        return "L" if gray_colors else "RGB"
+    if kinds <= {"1", "L", "LA"}:
+        return "LA" if gray_colors else None
+    if kinds == {"RGB"}:
+        return "RGB"
+    if kinds <= set(SIXTEEN_BIT_MODES) and gray_colors:
+        return "I;16"
+    return None
+
+
+def output_supports(mode: str, output_format: Optional[str]) -> bool:
+    """
+    判断输出格式能否不经转换直接保存该工作模式下的画布
+    """
+    if mode in SIXTEEN_BIT_MODES:
+        return (output_format or "").upper() in SIXTEEN_BIT_FORMATS
+    return True
+
+
+def output_supports_alpha(output_format: Optional[str]) -> bool:
+    """
+    判断输出格式能否保存透明通道
+    """
+    return (output_format or "").upper() in ALPHA_FORMATS
+
+
+def canvas_mode(mode: str) -> str:
+    """
+    工作模式对应的画布模式：画布背景不透明，不需要透明通道
+    """
+    if mode == "LA":
+        return "L"
+    if mode == "RGBA":
+        return "RGB"
+    return mode
+
+
+def mode_color(color: Color, mode: str) -> Union[int, Tuple[int, ...]]:
+    """
+    把 8 位 RGB 颜色转换为指定模式下的像素值，灰度模式要求颜色本身是灰色
+    """
+    if mode in ("L", "1"):
+        return color[0]
+    if mode == "LA":
+        return (color[0], 255)
+    if mode in SIXTEEN_BIT_MODES:
+        # 8 位扩展到 16 位: 0xAB -> 0xABAB
+        return color[0] * 257
+    if mode == "RGBA":
+        return tuple(color) + (255,)
+    return tuple(color)
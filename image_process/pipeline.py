@@ -0,0 +1,335 @@
+"""
+流水线调度模块
+
+在同一进程中连续执行多个合并任务时，每个任务依次解码、合成、编码，解码时编码器空闲，
+编码时其他核空闲。MergePipeline 把这三个阶段拆成独立的工作线程组，阶段之间用有界队列
+连接：任务 N+1 解码的同时任务 N 在合成、任务 N-1 在编码。Pillow 在解码、缩放和 zlib
+压缩时释放 GIL，各阶段可以在不同的核上同时运行。
+
+- decode: 读取文件头规划布局，解码全部输入并转换、缩放到放置区域
+- compose: 把缩放后的图片和分隔线绘制到画布上
+- encode: 编码画布并写出结果指纹
+
+队列的容量限制了同时驻留在内存中的已解码任务和画布数量。合成结果与 merge_layouts
+生成单个布局时相同；动图、低内存模式和图集有各自的处理方式，在解码阶段直接交给
+merge_images 完整执行。
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, BinaryIO, Dict, List, NamedTuple, Optional, Union
+
+from PIL import Image
+
+from . import job_cache, metrics
+from .animation import has_animated_input, is_animated_output
+from .color import ColorManager
+from .layout import LayoutPlan, plan_layout
+from .merge_images import (
+    _choose_mode,
+    _compose,
+    _layout_options,
+    _open_in_mode,
+    _save_canvas,
+    merge_images,
+)
+from .modes import canvas_mode
+from .progress import (
+    CancellationToken,
+    MergeCancelled,
+    ProgressCallback,
+    ProgressReporter,
+)
+from .sources import (
+    Source,
+    is_path,
+    resolve_sources,
+    source_metadata,
+    source_sizes,
+)
+
+STAGES = ("decode", "compose", "encode")
+
+# 阶段之间的队列容量，即每个阶段最多积压的任务数
+DEFAULT_QUEUE_SIZE = 2
+
+# 通知工作线程退出
+_STOP = object()
+
+
+class _Job:
+    """
+    在各阶段之间传递的合并任务
+    """
+
+    def __init__(
+        self,
+        files: List[Source],
+        output: Union[str, BinaryIO],
+        options: Dict[str, Any],
+        reporter: ProgressReporter,
+        future: Future,
+    ):
+        self.files = files
+        self.output = output
+        self.options = options
+        self.reporter = reporter
+        self.future = future
+        self.start = 0.0
+        # 交给 merge_images 完整执行的任务由 merge_images 统计
+        self.delegated = False
+        self.fingerprint: Optional[Dict[str, Any]] = None
+        self.plan: Optional[LayoutPlan] = None
+        self.mode: Optional[str] = None
+        self.color: Optional[ColorManager] = None
+        self.tiles: List[Image.Image] = []
+        self.canvas: Optional[Image.Image] = None
+
+
+class _Stage(NamedTuple):
+    name: str
+    queue: "queue.Queue"
+    threads: List[threading.Thread]
+
+
+class MergePipeline:
+    """
+    按解码、合成、编码三个阶段流水线执行合并任务
+
+    每个阶段的线程数可以分别设置，queue_size 为阶段之间的队列容量。submit 返回
+    Future，结果与 merge_images 的返回值相同。用作上下文管理器时退出前等待全部任务完成。
+    """
+
+    def __init__(
+        self,
+        decode_workers: int = 1,
+        compose_workers: int = 1,
+        encode_workers: int = 1,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        force: bool = False,
+        png_threads: Optional[int] = None,
+    ):
+        if min(decode_workers, compose_workers, encode_workers) < 1:
+            raise ValueError("每个阶段至少需要一个工作线程")
+        if queue_size < 1:
+            raise ValueError("队列容量至少为 1")
+        self.force = force
+        self.png_threads = png_threads
+        self._closed = False
+        self._lock = threading.Lock()
+
+        # 提交的任务不限数量，已解码的任务和画布受队列容量限制
+        handlers = (self._decode_job, self._compose_job, self._encode_job)
+        workers = (decode_workers, compose_workers, encode_workers)
+        self._stages: List[_Stage] = []
+        for i, (name, handler, count) in enumerate(zip(STAGES, handlers, workers)):
+            stage = _Stage(name, queue.Queue(queue_size if i else 0), [])
+            for n in range(count):
+                thread = threading.Thread(
+                    target=self._run_stage,
+                    args=(i, handler),
+                    name=f"merge-{name}-{n}",
+                    daemon=True,
+                )
+                stage.threads.append(thread)
+            self._stages.append(stage)
+        for stage in self._stages:
+            for thread in stage.threads:
+                thread.start()
+
+    def submit(
+        self,
+        files: List[Source],
+        output: Union[str, BinaryIO],
+        progress: Optional[ProgressCallback] = None,
+        cancel: Optional[CancellationToken] = None,
+        **options: Any,
+    ) -> Future:
+        """
+        提交一个合并任务，参数与 merge_images 相同，参数无效时立即抛出 ValueError
+        """
+        options = _layout_options(dict(options, output=output))
+        future: Future = Future()
+        job = _Job(files, output, options, ProgressReporter(progress, cancel), future)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("流水线已关闭")
+            self._stages[0].queue.put(job)
+        return future
+
+    def close(self) -> None:
+        """
+        等待已提交的任务全部完成后停止工作线程
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        # 上游阶段的线程全部退出后，下游队列中不会再有新任务
+        for stage in self._stages:
+            for _ in stage.threads:
+                stage.queue.put(_STOP)
+            for thread in stage.threads:
+                thread.join()
+
+    def __enter__(self) -> "MergePipeline":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _run_stage(self, index: int, handler) -> None:
+        source = self._stages[index].queue
+        target = self._stages[index + 1].queue if index + 1 < len(STAGES) else None
+        while True:
+            job = source.get()
+            if job is _STOP:
+                return
+            # 还未开始的任务可以通过 Future.cancel() 取消
+            if index == 0 and not job.future.set_running_or_notify_cancel():
+                continue
+            try:
+                passed = handler(job)
+            except Exception as e:
+                _record_merge(job, e)
+                job.future.set_exception(e)
+                continue
+            except BaseException as e:
+                # KeyboardInterrupt、SystemExit 不算任务失败：通知等待的调用方后继续抛出
+                job.future.set_exception(e)
+                raise
+            if passed and target is not None:
+                target.put(job)
+
+    def _decode_job(self, job: _Job) -> bool:
+        """
+        规划布局并解码全部输入，任务已经完成时返回 False
+        """
+        job.start = time.perf_counter()
+        options = job.options
+        files = job.files = resolve_sources(job.files)
+        animated = is_animated_output(
+            job.output, options["output_format"]
+        ) and has_animated_input(files)
+        if animated or options["low_memory"] or options["atlas"]:
+            job.delegated = True
+            job.future.set_result(
+                merge_images(
+                    files,
+                    job.output,
+                    force=self.force,
+                    png_threads=self.png_threads,
+                    progress=job.reporter.callback,
+                    cancel=job.reporter.cancel,
+                    **options,
+                )
+            )
+            return False
+
+        metas = source_metadata(files)
+        if is_path(job.output) and all(is_path(f) for f in files):
+            job.fingerprint = job_cache.compute_fingerprint(files, options, metas)
+            if not self.force:
+                if job_cache.is_up_to_date(job.output, job.fingerprint):
+                    metrics.CACHE_REQUESTS.inc(cache="result", result="hit")
+                    job.reporter.emit("done", nbytes=os.path.getsize(job.output))
+                    _record_merge(job)
+                    job.future.set_result(job.output)
+                    return False
+                metrics.CACHE_REQUESTS.inc(cache="result", result="miss")
+
+        if options["preserve_mode"]:
+            job.mode = _choose_mode(
+                files,
+                job.output,
+                options["output_format"],
+                options["bg_color"],
+                options["divider_color"],
+                metas,
+            )
+        if options["color_profile"] is not None:
+            job.color = ColorManager(
+                options["color_profile"], options["rendering_intent"]
+            )
+            if job.mode not in ("RGB", "RGBA"):
+                job.mode = None
+
+        job.plan = plan_layout(
+            sizes=source_sizes(files, metas),
+            orientation=options["orientation"],
+            gap=options["gap"],
+            divider=options["divider"],
+            divider_thickness=options["divider_thickness"],
+            align=options["align"],
+            uniform_height=options["uniform_height"],
+            uniform_width=options["uniform_width"],
+            margin=options["margin"],
+            cols=options["cols"],
+            rows=options["rows"],
+            auto_grid=options["auto_grid"],
+            target_aspect=options["target_aspect"],
+        )
+        job.reporter.emit("planned", 0, len(files), plan=job.plan)
+
+        for i, (source, (_, _, w, h)) in enumerate(zip(files, job.plan.placements)):
+            im = _open_in_mode(
+                source,
+                job.mode or "RGBA",
+                (w, h),
+                options["thumbnail_tolerance"],
+                job.color,
+            )
+            job.reporter.emit("decoded", i + 1, len(files))
+            if im.size != (w, h):
+                im = im.resize((w, h), Image.Resampling.LANCZOS)
+            job.tiles.append(im)
+        return True
+
+    def _compose_job(self, job: _Job) -> bool:
+        job.canvas = _compose(
+            job.tiles,
+            job.plan,
+            job.options["bg_color"],
+            job.options["divider_color"],
+            mode=canvas_mode(job.mode) if job.mode else "RGBA",
+            reporter=job.reporter,
+        )
+        job.tiles = []
+        return True
+
+    def _encode_job(self, job: _Job) -> bool:
+        result = _save_canvas(
+            job.canvas,
+            job.output,
+            job.options["output_format"],
+            job.reporter,
+            self.png_threads,
+            job.color.profile if job.color is not None else None,
+        )
+        job.canvas = None
+        if job.fingerprint is not None:
+            job_cache.save_fingerprint(result, job.fingerprint)
+        _record_merge(job)
+        job.future.set_result(result)
+        return True
+
+
+def _record_merge(job: _Job, error: Optional[BaseException] = None) -> None:
+    """
+    与 metrics.track_merge 相同地统计流水线执行的合并
+
+    交给 merge_images 的任务已经由 merge_images 统计过。
+    """
+    if not metrics.is_enabled() or job.delegated:
+        return
+    if error is None:
+        metrics.MERGES.inc(status="ok")
+        metrics.MERGE_SECONDS.observe(time.perf_counter() - job.start)
+    elif isinstance(error, MergeCancelled):
+        metrics.MERGES.inc(status="cancelled")
+    else:
+        metrics.MERGES.inc(status="error")
+        metrics.FAILURES.inc(error=type(error).__name__)
@@ -0,0 +1,343 @@
+"""
+多线程 PNG 编码模块
+
+Pillow 编码 PNG 时在单个线程中完成 zlib 压缩，大画布的大部分编码时间都花在这里。
+该模块把画布按行切成若干块，在线程池中分别过滤并压缩（Pillow 的逐像素运算和 zlib
+压缩时都释放 GIL），最后拼接成一个合法的 zlib 数据流写入 IDAT。
+
+过滤由本模块完成：把扫描行看作 L 模式的字节图像，用 ImageChops 整块计算
+None/Sub/Up/Average/Paeth 过滤，不需要先让 Pillow 编码一遍再解压。与 Pillow 逐行
+比较五种过滤不同，每块只用抽样的若干行选出一种过滤方式，再对整块计算这一种。
+Pillow 不支持按字节运算的模式（P、1 等）仍由 Pillow 以不压缩的方式编码得到过滤后的
+扫描行。
+
+每块用它之前 32KB 的过滤后数据作为预设字典，块之间以 sync flush 分隔，压缩率与整体压缩
+基本相同。
+"""
+
+import io
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, List, Optional, Tuple
+
+from PIL import Image, ImageChops, ImageStat
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# 与 Pillow 保存 PNG 的默认压缩级别相同
+DEFAULT_COMPRESS_LEVEL = 6
+
+# 每块过滤后数据的目标大小（字节）
+CHUNK_BYTES = 1 << 21
+
+# deflate 的回溯窗口，预设字典取前一块末尾这么多字节
+_WINDOW = 1 << 15
+
+_ADLER_BASE = 65521
+
+# 可以按字节过滤的模式: (PNG 中的原始数据格式, 每像素字节数)
+_RAW_MODES = {
+    "L": ("L", 1),
+    "LA": ("LA", 2),
+    "RGB": ("RGB", 3),
+    "RGBA": ("RGBA", 4),
+    "I;16": ("I;16B", 2),
+}
+
+# PNG 的五种过滤方式
+_FILTERS = (_NONE, _SUB, _UP, _AVERAGE, _PAETH) = range(5)
+
+# 选择过滤方式时每块抽取的小块数，以及每个小块的行数和宽度（像素）
+_SAMPLE_BLOCKS = 16
+_SAMPLE_ROWS = 4
+_SAMPLE_WIDTH = 256
+
+# 过滤结果按有符号字节取绝对值，用于比较过滤方式
+_COST = [min(v, 256 - v) for v in range(256)]
+_ZERO = [255] + [0] * 255
+_NONZERO = [0] + [255] * 255
+
+
+def resolve_threads(threads: int) -> int:
+    """
+    线程数为 0 时使用 CPU 核数
+    """
+    return threads or os.cpu_count() or 1
+
+
+def _adler32_combine(adler1: int, adler2: int, len2: int) -> int:
+    """
+    由两段数据各自的 Adler-32 计算拼接后的 Adler-32（zlib 的 adler32_combine）
+    """
+    rem = len2 % _ADLER_BASE
+    sum1 = adler1 & 0xFFFF
+    sum2 = (rem * sum1) % _ADLER_BASE
+    sum1 += (adler2 & 0xFFFF) + _ADLER_BASE - 1
+    sum2 += (adler1 >> 16) + (adler2 >> 16) + _ADLER_BASE - rem
+    sum1 %= _ADLER_BASE
+    sum2 %= _ADLER_BASE
+    return (sum2 << 16) | sum1
+
+
+def _chunks(data: bytes) -> List[Tuple[bytes, bytes]]:
+    """
+    把 PNG 数据拆成 (类型, 内容) 列表
+    """
+    chunks = []
+    pos = len(PNG_SIGNATURE)
+    while pos < len(data):
+        (length,) = struct.unpack_from(">I", data, pos)
+        kind = data[pos + 4 : pos + 8]
+        chunks.append((kind, data[pos + 8 : pos + 8 + length]))
+        pos += 12 + length
+    return chunks
+
+
+def _write_chunk(fp: BinaryIO, kind: bytes, body: bytes) -> None:
+    fp.write(struct.pack(">I", len(body)))
+    fp.write(kind)
+    fp.write(body)
+    fp.write(struct.pack(">I", zlib.crc32(body, zlib.crc32(kind))))
+
+
+def _filtered_rows(im: Image.Image) -> Tuple[List[Tuple[bytes, bytes]], bytes]:
+    """
+    用 Pillow 以压缩级别 0 编码图片，返回 IDAT 之前的数据块和过滤后的扫描行
+    """
+    buffer = io.BytesIO()
+    im.save(buffer, "PNG", compress_level=0)
+    chunks = _chunks(buffer.getvalue())
+    header = []
+    idat = []
+    for kind, body in chunks:
+        if kind == b"IDAT":
+            idat.append(body)
+        elif not idat and kind != b"IEND":
+            header.append((kind, body))
+    return header, zlib.decompress(b"".join(idat))
+
+
+def _shifted(x: Image.Image, dx: int, dy: int) -> Image.Image:
+    """
+    把字节图像向右平移 dx、向下平移 dy，空出的位置补 0
+    """
+    out = Image.new("L", x.size, 0)
+    w, h = x.size
+    if dx < w and dy < h:
+        out.paste(x.crop((0, 0, w - dx, h - dy)), (dx, dy))
+    return out
+
+
+def _paeth(a: Image.Image, b: Image.Image, c: Image.Image) -> Image.Image:
+    """
+    逐字节计算 Paeth 预测值，a、b、c 分别为左侧、上方和左上方的字节
+
+    pa = |b - c|，pb = |a - c|。a、b 在 c 的同一侧时 pc = pa + pb，预测值为 a
+    (pa <= pb) 或 b；在两侧时 pc = |pa - pb|，2pa <= pb 时为 a，2pb <= pa 时为 b，
+    否则为 c。这样所有中间结果都不超过 255，可以在 L 模式下计算。
+    """
+    pa = ImageChops.difference(b, c)
+    pb = ImageChops.difference(a, c)
+    a_above = ImageChops.subtract(a, c).point(_NONZERO)
+    a_below = ImageChops.subtract(c, a).point(_NONZERO)
+    b_above = ImageChops.subtract(b, c).point(_NONZERO)
+    b_below = ImageChops.subtract(c, b).point(_NONZERO)
+    opposite = ImageChops.lighter(
+        ImageChops.multiply(a_above, b_below), ImageChops.multiply(a_below, b_above)
+    )
+    pa_le_pb = ImageChops.subtract(pa, pb).point(_ZERO)
+    twice_pa_le_pb = ImageChops.subtract(pa, ImageChops.subtract(pb, pa)).point(_ZERO)
+    twice_pb_le_pa = ImageChops.subtract(pb, ImageChops.subtract(pa, pb)).point(_ZERO)
+    use_a = Image.composite(twice_pa_le_pb, pa_le_pb, opposite)
+    use_b = ImageChops.lighter(twice_pb_le_pa, ImageChops.invert(opposite))
+    return Image.composite(a, Image.composite(b, c, use_b), use_a)
+
+
+def _as_bytes(im: Image.Image) -> Image.Image:
+    """
+    把扫描行看作 L 模式的字节图像，宽度为每行的字节数
+    """
+    rawmode, bpp = _RAW_MODES[im.mode]
+    return Image.frombytes("L", (im.width * bpp, im.height), im.tobytes("raw", rawmode))
+
+
+def _apply_filter(x: Image.Image, bpp: int, kind: int) -> Image.Image:
+    """
+    对字节图像 x 的每一行使用第 kind 种过滤，第一行的上一行视为全 0
+    """
+    if kind == _NONE:
+        return x
+    if kind == _UP:
+        return ImageChops.subtract_modulo(x, _shifted(x, 0, 1))
+    a = _shifted(x, bpp, 0)
+    if kind == _SUB:
+        return ImageChops.subtract_modulo(x, a)
+    b = _shifted(x, 0, 1)
+    if kind == _AVERAGE:
+        return ImageChops.subtract_modulo(x, ImageChops.add(a, b, scale=2))
+    return ImageChops.subtract_modulo(x, _paeth(a, b, _shifted(x, bpp, 1)))
+
+
+def _choose_filter(im: Image.Image, top: int, bottom: int) -> int:
+    """
+    为第 top 到 bottom 行选择一种过滤方式
+
+    在这些行中沿对角线均匀抽取若干小块，连同上一行和左侧一列拼成一张小图，比较各种
+    过滤后绝对值之和（不计作为上一行和左侧的部分）。结果只取决于图片和行范围，
+    压缩后面各块的线程可以据此还原前面各块的过滤结果作为预设字典。
+    """
+    start = max(top, 1)
+    if start >= bottom:
+        return _NONE
+    rows = min(_SAMPLE_ROWS, bottom - start)
+    width = min(_SAMPLE_WIDTH, im.width)
+    # 抽样块的左上角，每块上方多取一行
+    ys = _spread(start - 1, bottom - rows - 1, _SAMPLE_BLOCKS)
+    xs = _spread(0, im.width - width, _SAMPLE_BLOCKS)
+    sample = Image.new(im.mode, (width, _SAMPLE_BLOCKS * (rows + 1)))
+    for i, (x, y) in enumerate(zip(xs, ys)):
+        sample.paste(im.crop((x, y, x + width, y + rows + 1)), (0, i * (rows + 1)))
+    data = _as_bytes(sample)
+    bpp = _RAW_MODES[im.mode][1]
+    mask = Image.new("L", data.size, 255)
+    if width > 1:
+        mask.paste(0, (0, 0, bpp, data.height))
+    for i in range(_SAMPLE_BLOCKS):
+        mask.paste(0, (0, i * (rows + 1), data.width, i * (rows + 1) + 1))
+    costs = [
+        ImageStat.Stat(_apply_filter(data, bpp, kind).point(_COST), mask).sum[0]
+        for kind in _FILTERS
+    ]
+    return min(_FILTERS, key=lambda kind: costs[kind])
+
+
+def _spread(first: int, last: int, count: int) -> List[int]:
+    """
+    在 first 到 last 之间（含两端）均匀取 count 个整数
+    """
+    return [first + i * (last - first) // max(1, count - 1) for i in range(count)]
+
+
+def _filter_rows(im: Image.Image, top: int, bottom: int, kind: int) -> bytes:
+    """
+    返回第 top 到 bottom 行以第 kind 种过滤得到的扫描行（每行以过滤类型字节开头）
+    """
+    start = max(top - 1, 0)
+    x = _as_bytes(im.crop((0, start, im.width, bottom)))
+    x = _apply_filter(x, _RAW_MODES[im.mode][1], kind)
+    out = Image.new("L", (x.width + 1, bottom - top), kind)
+    # 多取的上一行只参与过滤，粘贴时移出画面
+    out.paste(x, (1, start - top))
+    return out.tobytes()
+
+
+def _chunk_data(
+    im: Image.Image,
+    bounds: List[Tuple[int, int]],
+    kinds: List[int],
+    i: int,
+    row_bytes: int,
+) -> Tuple[bytes, Optional[bytes]]:
+    """
+    返回第 i 块过滤后的数据，以及它之前 32KB 过滤后的数据（第一块为 None）
+
+    kinds 是各块选用的过滤方式。前面的数据可能跨越多块，各自按所在块的过滤方式
+    重新过滤，与这些块写出的数据相同。
+    """
+    top, bottom = bounds[i]
+    context = min(top, -(-_WINDOW // row_bytes))
+    if im.mode not in _RAW_MODES:
+        # Pillow 逐行选择过滤方式，从上下文之前一行开始过滤即与整张图片的结果相同
+        start = max(top - context - 1, 0)
+        data = _filtered_rows(im.crop((0, start, im.width, bottom)))[1]
+        data = data[(top - context - start) * row_bytes :]
+        zdict = data[: context * row_bytes]
+        return data[context * row_bytes :], zdict or None
+    data = _filter_rows(im, top, bottom, kinds[i])
+    before = []
+    for j in range(i - 1, -1, -1):
+        if top - context >= bounds[j][1]:
+            break
+        start = max(bounds[j][0], top - context)
+        before.append(_filter_rows(im, start, bounds[j][1], kinds[j]))
+    zdict = b"".join(reversed(before))[-_WINDOW:]
+    return data, zdict or None
+
+
+def _compress_rows(
+    im: Image.Image,
+    bounds: List[Tuple[int, int]],
+    kinds: List[int],
+    i: int,
+    row_bytes: int,
+    level: int,
+) -> Tuple[bytes, int, int]:
+    """
+    过滤并压缩第 i 块，返回 (压缩数据, Adler-32, 数据长度)
+
+    块之前 32KB 过滤后的数据作为预设字典。
+    """
+    data, zdict = _chunk_data(im, bounds, kinds, i, row_bytes)
+    if zdict:
+        compressor = zlib.compressobj(
+            level, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, zdict
+        )
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 9)
+    last = i == len(bounds) - 1
+    compressed = compressor.compress(data) + compressor.flush(
+        zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+    )
+    return compressed, zlib.adler32(data), len(data)
+
+
+def save_png(
+    im: Image.Image,
+    fp: BinaryIO,
+    threads: int = 0,
+    compress_level: int = DEFAULT_COMPRESS_LEVEL,
+    check: Optional[Callable[[], None]] = None,
+) -> None:
+    """
+    用多个线程把图片编码为 PNG 写入 fp，像素与 Pillow 编码的结果相同
+
+    threads 为 0 时使用 CPU 核数。check 不为 None 时在压缩和写出每块之前调用，
+    抛出异常即中止编码，尚未开始的块也不再压缩。
+    """
+    check = check or (lambda: None)
+    threads = resolve_threads(threads)
+    # IDAT 之前的数据块取自 Pillow 编码的第一行，过滤后每行的字节数含过滤类型字节
+    header, first_row = _filtered_rows(im.crop((0, 0, im.width, 1)))
+    row_bytes = len(first_row)
+    rows = max(1, CHUNK_BYTES // row_bytes)
+    bounds = [(top, min(top + rows, im.height)) for top in range(0, im.height, rows)]
+
+    def compress(i: int):
+        check()
+        return _compress_rows(im, bounds, kinds, i, row_bytes, compress_level)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(threads, len(bounds)))) as pool:
+        # 压缩每块时还要按前面各块的过滤方式重新过滤预设字典，所以先选好过滤方式
+        kinds = []
+        if im.mode in _RAW_MODES:
+            kinds = list(pool.map(lambda bound: _choose_filter(im, *bound), bounds))
+        results = pool.map(compress, range(len(bounds)))
+        fp.write(PNG_SIGNATURE)
+        # zlib 头：deflate、32KB 窗口、默认压缩级别，无预设字典
+        zlib_header = b"\x78\x9c"
+        adler = 1
+        for i, (compressed, chunk_adler, length) in enumerate(results):
+            check()
+            if i == 0:
+                for kind, body in header:
+                    if kind == b"IHDR":
+                        body = body[:4] + struct.pack(">I", im.height) + body[8:]
+                    _write_chunk(fp, kind, body)
+                compressed = zlib_header + compressed
+            adler = _adler32_combine(adler, chunk_adler, length)
+            if i == len(bounds) - 1:
+                compressed += struct.pack(">I", adler)
+            _write_chunk(fp, b"IDAT", compressed)
+    _write_chunk(fp, b"IEND", b"")
@@ -0,0 +1,164 @@
+"""
+布局预览模块
+
+该模块在终端中以低分辨率渲染当前合并布局。输入图片只解码一次缩略图并缓存，
+调整参数后再次预览时只需重新规划布局并合成小画布，然后用半块字符输出到终端。
+"""
+
+from typing import Dict, List, Tuple
+
+from PIL import Image
+from rich.color import Color
+from rich.style import Style
+from rich.text import Text
+
+from . import metrics
+from .decoding import open_reduced
+from .layout import plan_layout, scale_plan
+from .merge_images import _compose
+from .metadata_index import get_index
+
+# 缩略图最长边，足以覆盖常见终端宽度下单张图片的预览尺寸
+THUMBNAIL_SIZE = 256
+
+# 终端预览的分辨率很低，EXIF 缩略图只要达到缩略图尺寸的一半即可使用
+PREVIEW_THUMBNAIL_TOLERANCE = 0.5
+
+UPPER_HALF_BLOCK = "▀"
+
+
+class PreviewRenderer:
+    """
+    预览渲染类
+
+    缩略图按 (路径, 修改时间, 文件大小) 缓存，参数变化时可直接复用；
+    原始尺寸和文件状态来自元数据索引。
+    """
+
+    def __init__(self, thumbnail_size: int = THUMBNAIL_SIZE):
+        self.thumbnail_size = thumbnail_size
+        self._cache: Dict[
+            str, Tuple[Tuple[int, int], Tuple[int, int], Image.Image]
+        ] = {}
+
+    def _load(self, path: str) -> Tuple[Tuple[int, int], Image.Image]:
+        """
+        返回图片的原始尺寸和缩略图，文件未变化时直接使用缓存
+        """
+        meta = get_index().get(path)
+        stamp = (meta.mtime_ns, meta.size)
+        cached = self._cache.get(path)
+        if cached is not None and cached[0] == stamp:
+            metrics.CACHE_REQUESTS.inc(cache="preview", result="hit")
+            return cached[1], cached[2]
+        metrics.CACHE_REQUESTS.inc(cache="preview", result="miss")
+
+        size = meta.dimensions
+        # 按缩略图的实际尺寸（保持宽高比放入方框）选择 EXIF 缩略图或降采样解码
+        scale = min(
+            self.thumbnail_size / max(size[0], 1),
+            self.thumbnail_size / max(size[1], 1),
+            1,
+        )
+        target = (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+        with open_reduced(path, target, PREVIEW_THUMBNAIL_TOLERANCE) as im:
+            im.thumbnail(
+                (self.thumbnail_size, self.thumbnail_size), Image.Resampling.BILINEAR
+            )
+            thumb = im.convert("RGBA")
+
+        self._cache[path] = (stamp, size, thumb)
+        return size, thumb
+
+    def render(
+        self, files: List[str], config, max_width: int, max_height: int
+    ) -> Image.Image:
+        """
+        按当前配置渲染不超过 max_width x max_height 像素的预览图
+        """
+        sizes = []
+        thumbs = []
+        for path in files:
+            size, thumb = self._load(path)
+            sizes.append(size)
+            thumbs.append(thumb)
+
+        plan = plan_layout(
+            sizes=sizes,
+            orientation=config.orientation,
+            gap=config.gap,
+            divider=config.divider,
+            divider_thickness=config.divider_thickness,
+            align=config.align,
+            uniform_height=config.uniform_height
+            if config.orientation == "horizontal"
+            else None,
+            uniform_width=config.uniform_width
+            if config.orientation == "vertical"
+            else None,
+            margin=config.margin,
+            cols=config.cols,
+            rows=config.rows,
+        )
+        canvas_w, canvas_h = plan.canvas_size
+        scale = min(1.0, max_width / canvas_w, max_height / canvas_h)
+        small_plan = scale_plan(plan, scale)
+
+        canvas = _compose(
+            thumbs,
+            small_plan,
+            tuple(config.bg_color),
+            tuple(config.divider_color),
+            resample=Image.Resampling.BILINEAR,
+        )
+        return canvas.convert("RGB")
+
+    def render_text(self, files: List[str], config, columns: int, lines: int) -> Text:
+        """
+        渲染预览并转换为可直接打印到终端的半块字符文本
+        """
+        image = self.render(files, config, columns, lines * 2)
+        return to_half_blocks(image)
+
+    def clear(self) -> None:
+        """
+        清空缩略图缓存
+        """
+        self._cache.clear()
+
+
+def to_half_blocks(image: Image.Image) -> Text:
+    """
+    把 RGB 图片转换为半块字符文本，每个字符显示上下两个像素
+    """
+    width, height = image.size
+    pixels = image.load()
+    styles: Dict[Tuple[Tuple[int, int, int], Tuple[int, int, int]], Style] = {}
+    text = Text(no_wrap=True, overflow="crop")
+
+    for y in range(0, height, 2):
+        run_style = None
+        run_length = 0
+        for x in range(width):
+            top = pixels[x, y]
+            bottom = pixels[x, y + 1] if y + 1 < height else top
+            key = (top, bottom)
+            style = styles.get(key)
+            if style is None:
+                style = Style(
+                    color=Color.from_rgb(*top), bgcolor=Color.from_rgb(*bottom)
+                )
+                styles[key] = style
+            if style is run_style:
+                run_length += 1
+                continue
+            if run_length:
+                text.append(UPPER_HALF_BLOCK * run_length, run_style)
+            run_style = style
+            run_length = 1
+        if run_length:
+            text.append(UPPER_HALF_BLOCK * run_length, run_style)
+        if y + 2 < height:
+            text.append("\n")
+
+    return text
@@ -0,0 +1,119 @@
+"""
+合并进度与取消模块
+
+merge_images 在各阶段之间发出结构化的进度事件，并在发出事件前检查取消令牌；
+encoding 之后编码器每写出一块数据前也会检查（见 ProgressReporter.check）。
+取消后抛出 MergeCancelled，已解码的图片随之释放，输出文件保持原样（输出先写入临时文件，
+完成后才替换到目标位置）。
+
+进度事件的阶段依次为（需要先解码全部图片才能规划布局时，planned 在 decoded 之后发出）:
+- planned: 布局规划完成，total 为输入数量，plan 为布局规划结果
+- decoded: 第 current 张（共 total 张）图片解码完成
+- resized: 第 current 张图片已缩放到放置区域并绘制到画布上
+- composed: 画布合成完成
+- encoding: 开始编码输出
+- done: 输出写入完成，bytes 为输出的字节数（无法获知时为 None）
+
+启用运行指标时，相邻两个事件之间的时间记为对应阶段的耗时（见 metrics 模块）。
+"""
+
+import threading
+import time
+from typing import Callable, NamedTuple, Optional
+
+from . import metrics
+from .layout import LayoutPlan
+
+STAGES = ("planned", "decoded", "resized", "composed", "encoding", "done")
+
+# 事件对应的指标阶段：该事件与上一个事件之间的时间即为该阶段的耗时
+_METRIC_STAGES = {"decoded": "decode", "resized": "resize", "done": "encode"}
+
+
+class ProgressEvent(NamedTuple):
+    """
+    进度事件
+    """
+
+    stage: str
+    current: int = 0
+    total: int = 0
+    bytes: Optional[int] = None
+    plan: Optional[LayoutPlan] = None
+
+
+ProgressCallback = Callable[[ProgressEvent], None]
+
+
+class MergeCancelled(Exception):
+    """
+    合并被取消
+    """
+
+
+class CancellationToken:
+    """
+    取消令牌，可以在其他线程中调用 cancel()
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self) -> None:
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+
+class ProgressReporter:
+    """
+    把进度事件转发给回调，并在每个阶段之间检查取消令牌
+    """
+
+    def __init__(
+        self,
+        callback: Optional[ProgressCallback] = None,
+        cancel: Optional[CancellationToken] = None,
+    ):
+        self.callback = callback
+        self.cancel = cancel
+        self._last_stage: Optional[str] = None
+        self._last_time = time.perf_counter()
+
+    def check(self) -> None:
+        """
+        已取消时抛出 MergeCancelled
+        """
+        if self.cancel is not None and self.cancel.cancelled:
+            raise MergeCancelled("合并已取消")
+
+    def emit(
+        self,
+        stage: str,
+        current: int = 0,
+        total: int = 0,
+        nbytes: Optional[int] = None,
+        plan: Optional[LayoutPlan] = None,
+    ) -> None:
+        """
+        检查取消令牌后发出进度事件，done 事件不再检查取消
+        """
+        if stage != "done":
+            self.check()
+        if metrics.is_enabled():
+            self._observe(stage)
+        if self.callback is not None:
+            self.callback(ProgressEvent(stage, current, total, nbytes, plan))
+
+    def _observe(self, stage: str) -> None:
+        now = time.perf_counter()
+        metric_stage = _METRIC_STAGES.get(stage)
+        # 命中结果缓存时只有 done 事件，没有编码过程
+        if metric_stage is not None and (
+            stage != "done" or self._last_stage == "encoding"
+        ):
+            metrics.STAGE_SECONDS.observe(now - self._last_time, stage=metric_stage)
+        self._last_stage = stage
+        self._last_time = now
@@ -0,0 +1,408 @@
+"""
+远程输入模块
+
+合并的输入可以是 http(s):// 地址。所有地址在线程池中并发下载，同一主机的 keep-alive
+连接放回连接池复用；每个连接有超时限制，连接错误和 5xx/429 响应按指数退避重试，
+响应带 Retry-After 时至少等待该时间。复用的连接已被服务器关闭时换新连接重发一次，
+不计入重试次数。响应数据边下载边送入 ImageFile.Parser 增量解码，下载完成时图片也
+基本解码完毕；可能是动图的 GIF/WebP/APNG 只保存数据，下载完成后再打开。
+
+启用磁盘缓存后，带 ETag 或 Last-Modified 的响应保存在
+~/.cache/image-process-cli/http 中，再次下载时发送条件请求，服务器返回 304 时直接
+使用缓存的文件。
+"""
+
+import email.utils
+import hashlib
+import http.client
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+from PIL import Image, ImageFile
+
+from . import metrics
+from .metadata_index import CACHE_DIR
+
+HTTP_CACHE_DIR = CACHE_DIR / "http"
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_RETRIES = 3
+
+# 每次从响应中读取的字节数
+CHUNK_SIZE = 1 << 16
+
+# 重试前等待的基础时间（秒），每次重试翻倍
+RETRY_BACKOFF = 0.2
+
+# 服务器通过 Retry-After 要求等待的最长时间（秒）
+MAX_RETRY_AFTER = 60.0
+
+MAX_REDIRECTS = 5
+
+# 增量解码只得到第一帧，这些格式的动图需要从完整数据重新打开
+_ANIMATED_FORMATS = ("GIF", "PNG", "WEBP")
+
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+_REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+_USER_AGENT = "image-process-cli"
+
+_Key = Tuple[str, str, int]
+
+
+def is_url(source) -> bool:
+    """
+    判断输入是否为 http(s) 地址
+    """
+    return isinstance(source, str) and source.lower().startswith(
+        ("http://", "https://")
+    )
+
+
+class _RetryableError(Exception):
+    """
+    可以重试的服务器响应（5xx/429），retry_after 为服务器要求等待的秒数
+    """
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _retry_after(response: http.client.HTTPResponse) -> Optional[float]:
+    """
+    解析 Retry-After（秒数或 HTTP 日期），没有或无法解析时返回 None
+    """
+    value = response.getheader("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class ConnectionPool:
+    """
+    按 (协议, 主机, 端口) 保存空闲的 keep-alive 连接
+
+    同一实例可以在多个线程中使用，每个连接同一时间只被一个线程持有。
+    """
+
+    def __init__(self, max_idle: int = DEFAULT_CONCURRENCY):
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle: Dict[_Key, List[http.client.HTTPConnection]] = {}
+
+    def acquire(self, key: _Key, timeout: float) -> http.client.HTTPConnection:
+        with self._lock:
+            idle = self._idle.get(key)
+            conn = idle.pop() if idle else None
+        if conn is None:
+            scheme, host, port = key
+            if scheme == "https":
+                conn = http.client.HTTPSConnection(host, port, timeout=timeout)
+            else:
+                conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        else:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+        return conn
+
+    def release(self, key: _Key, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        with self._lock:
+            conns = [c for idle in self._idle.values() for c in idle]
+            self._idle.clear()
+        for conn in conns:
+            conn.close()
+
+
+# 进程内共享的连接池，长时间运行的进程在多次合并之间复用连接
+_POOL = ConnectionPool()
+
+
+def _cache_paths(url: str) -> Tuple[str, str]:
+    name = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    base = os.path.join(HTTP_CACHE_DIR, name[:2], name)
+    return base + ".data", base + ".json"
+
+
+def _load_cache_entry(url: str) -> Optional[Dict[str, str]]:
+    data_path, meta_path = _cache_paths(url)
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if entry.get("url") != url or not os.path.isfile(data_path):
+        return None
+    return entry
+
+
+def _needs_full_data(im: Image.Image) -> bool:
+    """
+    增量解码只得到第一帧，可能是动图时需要完整数据重新打开
+    """
+    if im.format == "PNG":
+        # APNG 的 acTL 块位于图像数据之前，读完文件头即可判断
+        return getattr(im, "is_animated", False)
+    return im.format in _ANIMATED_FORMATS
+
+
+class _Download:
+    """
+    单次下载的状态：把数据送入增量解码器，并在需要缓存时同时写入临时文件
+
+    识别出格式之前同时保留原始数据；之后要么只增量解码，要么（可能是动图时）
+    只保留原始数据，响应体不会在内存中保存两份。
+    """
+
+    def __init__(self, url: str, cache_file: Optional[str]):
+        self.url = url
+        self.parser: Optional[ImageFile.Parser] = ImageFile.Parser()
+        self.chunks: List[bytes] = []
+        self.nbytes = 0
+        self.cache_file = cache_file
+        self._tmp = None
+        if cache_file is not None:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            self._tmp_path = f"{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+            self._tmp = open(self._tmp_path, "wb")
+
+    def feed(self, chunk: bytes) -> None:
+        self.nbytes += len(chunk)
+        if self._tmp is not None:
+            self._tmp.write(chunk)
+        if self.parser is None:
+            self.chunks.append(chunk)
+            return
+        self.parser.feed(chunk)
+        if self.parser.image is None:
+            self.chunks.append(chunk)
+        elif _needs_full_data(self.parser.image):
+            self.chunks.append(chunk)
+            self.parser = None
+        else:
+            self.chunks = []
+
+    def finish(self) -> Image.Image:
+        if self.parser is not None:
+            im = self.parser.close()
+        else:
+            im = Image.open(io.BytesIO(b"".join(self.chunks)))
+            self.chunks = []
+            if not getattr(im, "is_animated", False):
+                im.load()
+        if self._tmp is not None:
+            self._tmp.close()
+            os.replace(self._tmp_path, self.cache_file)
+            self._tmp = None
+        return im
+
+    def abort(self) -> None:
+        if self._tmp is not None:
+            self._tmp.close()
+            self._tmp = None
+            try:
+                os.remove(self._tmp_path)
+            except OSError:
+                pass
+
+
+def _request(
+    url: str,
+    headers: Dict[str, str],
+    timeout: float,
+    pool: ConnectionPool,
+    on_body,
+) -> Tuple[int, http.client.HTTPResponse]:
+    """
+    发出一次 GET 请求，状态码为 200 时把响应体分块交给 on_body
+
+    读完响应后，服务器允许保持连接时把连接放回连接池。返回 (状态码, 响应)。
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    port = parts.port or (443 if scheme == "https" else 80)
+    key = (scheme, parts.hostname or "", port)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+
+    conn = pool.acquire(key, timeout)
+    # 连接池中的连接已经建立过，新连接在发出请求时才建立
+    reused = conn.sock is not None
+    try:
+        try:
+            conn.request("GET", path, headers=headers)
+            response = conn.getresponse()
+        except (
+            http.client.RemoteDisconnected,
+            BrokenPipeError,
+            ConnectionResetError,
+        ):
+            if not reused:
+                raise
+            # 服务器已关闭空闲的 keep-alive 连接，换新连接重发一次
+            conn.close()
+            conn.request("GET", path, headers=headers)
+            response = conn.getresponse()
+        if response.status == 200:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                on_body(chunk)
+        else:
+            response.read()
+    except BaseException:
+        conn.close()
+        raise
+    if response.will_close:
+        conn.close()
+    else:
+        pool.release(key, conn)
+    return response.status, response
+
+
+def fetch_image(
+    url: str,
+    timeout: float = DEFAULT_TIMEOUT,
+    retries: int = DEFAULT_RETRIES,
+    use_cache: bool = False,
+    pool: Optional[ConnectionPool] = None,
+) -> Image.Image:
+    """
+    下载并解码一张图片
+
+    连接错误、超时和 5xx/429 响应最多重试 retries 次；404 抛出 FileNotFoundError，
+    其他错误状态抛出 OSError。
+    """
+    pool = pool or _POOL
+    entry = _load_cache_entry(url) if use_cache else None
+    data_path = _cache_paths(url)[0]
+
+    target = url
+    redirects = 0
+    attempt = 0
+    while True:
+        headers = {"User-Agent": _USER_AGENT, "Accept-Encoding": "identity"}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        download = _Download(target, data_path if use_cache else None)
+        try:
+            status, response = _request(target, headers, timeout, pool, download.feed)
+            if status in _RETRY_STATUSES:
+                raise _RetryableError(f"HTTP {status}", _retry_after(response))
+        except (OSError, http.client.HTTPException, _RetryableError) as e:
+            download.abort()
+            if attempt >= retries:
+                raise OSError(f"下载 '{url}' 失败: {e}") from e
+            delay = RETRY_BACKOFF * 2**attempt
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, MAX_RETRY_AFTER))
+            time.sleep(delay)
+            attempt += 1
+            continue
+        except BaseException:
+            download.abort()
+            raise
+
+        if status in _REDIRECT_STATUSES and response.getheader("Location"):
+            download.abort()
+            redirects += 1
+            if redirects > MAX_REDIRECTS:
+                raise OSError(f"下载 '{url}' 失败: 重定向次数过多")
+            target = urljoin(target, response.getheader("Location"))
+            continue
+
+        if status == 304 and entry is not None:
+            download.abort()
+            metrics.CACHE_REQUESTS.inc(cache="http", result="hit")
+            im = Image.open(data_path)
+            im.load()
+            return im
+        if status != 200:
+            download.abort()
+            message = f"下载 '{url}' 失败: HTTP {status} {response.reason}"
+            if status == 404:
+                raise FileNotFoundError(message)
+            raise OSError(message)
+
+        try:
+            im = download.finish()
+        except OSError as e:
+            download.abort()
+            raise OSError(f"无法解码 '{url}': {e}") from e
+        except BaseException:
+            download.abort()
+            raise
+        metrics.INPUT_BYTES.inc(download.nbytes)
+        if use_cache:
+            metrics.CACHE_REQUESTS.inc(cache="http", result="miss")
+            _save_cache_entry(url, response, data_path)
+        return im
+
+
+def _save_cache_entry(url: str, response: http.client.HTTPResponse, data_path: str):
+    """
+    记录缓存文件的校验信息，响应不带 ETag/Last-Modified 或禁止缓存时删除缓存文件
+    """
+    _, meta_path = _cache_paths(url)
+    etag = response.getheader("ETag")
+    last_modified = response.getheader("Last-Modified")
+    no_store = "no-store" in (response.getheader("Cache-Control") or "").lower()
+    if no_store or not (etag or last_modified):
+        for path in (data_path, meta_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return
+    tmp_path = f"{meta_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"url": url, "etag": etag, "last_modified": last_modified}, f)
+    os.replace(tmp_path, meta_path)
+
+
+def fetch_images(
+    urls: List[str],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    timeout: float = DEFAULT_TIMEOUT,
+    retries: int = DEFAULT_RETRIES,
+    use_cache: bool = False,
+) -> List[Image.Image]:
+    """
+    并发下载一组图片，同时进行的下载不超过 concurrency 个，返回值与 urls 顺序一致
+    """
+    if not urls:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(urls)))) as pool:
+        return list(
+            pool.map(lambda url: fetch_image(url, timeout, retries, use_cache), urls)
+        )
@@ -4,6 +4,8 @@
 该模块负责处理图片合并参数的配置界面。
 """
 
+from typing import Callable, Optional
+
 from rich.console import Console
 from rich.prompt import Prompt, Confirm, IntPrompt
 
@@ -16,9 +18,27 @@ class SettingsConfigurer:
     def __init__(self, console: Console):
         self.console = console
 
-    def configure_settings(self, config) -> None:
+    def configure_settings(
+        self, config, preview: Optional[Callable[[], None]] = None
+    ) -> None:
         """
         配置合并参数
+
+        提供 preview 时，每轮设置结束后可以预览当前布局并选择继续调整。
+        """
+        while True:
+            self._ask_settings(config)
+            if preview is None or not Confirm.ask("是否预览当前布局?", default=True):
+                break
+            preview()
+            if not Confirm.ask("是否继续调整参数?", default=False):
+                break
+
+        self.console.print("[green]配置已更新[/green]")
+
+    def _ask_settings(self, config) -> None:
+        """
+        依次询问各项合并参数
         """
         self.console.print("\n[bold]配置合并参数:[/bold]")
 
@@ -134,4 +154,11 @@ class SettingsConfigurer:
             "是否在输出文件名中添加时间戳?", default=config.add_timestamp
         )
 
-        self.console.print("[green]配置已更新[/green]")
+        # 文件选择器的扫描方式
+        config.scan_recursive = Confirm.ask(
+            "添加文件时是否递归扫描子目录?", default=config.scan_recursive
+        )
+        config.scan_pattern = Prompt.ask(
+            "添加文件时的文件名过滤 (如 *.png，直接回车不过滤)",
+            default=config.scan_pattern,
+        ).strip()
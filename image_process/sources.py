@@ -0,0 +1,551 @@
+"""
+输入来源模块
+
+合并的输入既可以是文件路径，也可以是已经打开的图片对象（例如从标准输入读取的图片），
+还可以是 zip/tar 压缩包中的成员（"bundle.zip::path/in/archive.png"）、整个压缩包
+或 http(s):// 地址。
+该模块统一处理这些来源的打开、尺寸获取和存在性检查，并提供从标准输入读取
+路径列表以及拆分连续拼接的图片数据流的功能。
+"""
+
+import io
+import os
+import struct
+import tarfile
+import threading
+import zipfile
+from collections import OrderedDict
+from functools import partial
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
+
+from PIL import Image
+
+from .metadata_index import ImageMetadata, get_index
+from .remote import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_RETRIES,
+    DEFAULT_TIMEOUT,
+    fetch_image,
+    fetch_images,
+    is_url,
+)
+
+Source = Union[str, Image.Image, "ArchiveMember"]
+
+# 每次从数据流读取的字节数
+STREAM_CHUNK_SIZE = 1 << 16
+
+# 压缩包路径与成员路径之间的分隔符
+ARCHIVE_SEPARATOR = "::"
+ARCHIVE_EXTENSIONS = (
+    ".zip",
+    ".tar",
+    ".tar.gz",
+    ".tgz",
+    ".tar.bz2",
+    ".tbz2",
+    ".tar.xz",
+    ".txz",
+)
+
+
+# 已打开的图片上记录原始名称（压缩包成员、http(s) 地址等）的属性
+SOURCE_NAME_ATTR = "source_name"
+
+
+def _named(im: Image.Image, name: str) -> Image.Image:
+    setattr(im, SOURCE_NAME_ATTR, name)
+    return im
+
+
+def source_name(source: Source) -> Optional[str]:
+    """
+    输入的名称：路径或地址本身，压缩包成员为 archive::member，标准输入中的图片为
+    stdin-<序号>.<格式>，无法得知时返回 None
+    """
+    if isinstance(source, str):
+        return source
+    name = getattr(source, SOURCE_NAME_ATTR, None)
+    return name or getattr(source, "filename", None) or None
+
+
+def is_path(source: Source) -> bool:
+    """
+    判断输入是否为本地文件路径（压缩包成员和 http(s) 地址不算）
+    """
+    return (
+        isinstance(source, str)
+        and not is_url(source)
+        and split_archive_member(source) is None
+    )
+
+
+def split_archive_member(source: Source) -> Optional[Tuple[str, str]]:
+    """
+    把 "bundle.zip::path/in/archive.png" 拆分为 (压缩包路径, 成员路径)
+    """
+    if not isinstance(source, str) or is_url(source) or ARCHIVE_SEPARATOR not in source:
+        return None
+    archive, member = source.split(ARCHIVE_SEPARATOR, 1)
+    return archive, member
+
+
+def is_archive(source: Source) -> bool:
+    """
+    判断输入是否为整个压缩包
+    """
+    return (
+        isinstance(source, str)
+        and source.lower().endswith(ARCHIVE_EXTENSIONS)
+        and os.path.isfile(source)
+    )
+
+
+def _is_image_name(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in Image.registered_extensions()
+
+
+class ArchiveMember:
+    """
+    压缩包中的图片成员，打开时才从压缩包读取数据
+
+    size、mode、info 取自解析压缩包时读到的图片头，规划布局和选择模式不需要读取成员
+    数据；open_source 每次打开都重新读取，关闭后数据随之释放。
+    """
+
+    def __init__(self, name: str, read: Callable[[], bytes], header: Image.Image):
+        self.source_name = name
+        self._read = read
+        self.size = header.size
+        self.mode = header.mode
+        self.info = dict(header.info)
+
+    def open(self) -> Image.Image:
+        return _named(Image.open(io.BytesIO(self._read())), self.source_name)
+
+
+class _ZipReader:
+    """
+    在多个线程中共用的 zip 压缩包，读取成员时加锁
+    """
+
+    def __init__(self, archive: str):
+        self._zf = zipfile.ZipFile(archive)
+        self._lock = threading.Lock()
+
+    def infolist(self) -> List[zipfile.ZipInfo]:
+        return self._zf.infolist()
+
+    def read(self, info: zipfile.ZipInfo) -> bytes:
+        with self._lock:
+            return self._zf.read(info)
+
+    def header(self, info: zipfile.ZipInfo) -> Image.Image:
+        with self._lock, self._zf.open(info) as f:
+            # 只读取图片头
+            with Image.open(f) as im:
+                return im
+
+
+def _read_range(path: str, offset: int, size: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def _is_plain_tar(archive: str) -> bool:
+    try:
+        with tarfile.open(archive, "r:"):
+            return True
+    except tarfile.ReadError:
+        return False
+
+
+def _read_archive(
+    archive: str, names: Set[str], all_images: bool
+) -> List[Tuple[str, ArchiveMember]]:
+    """
+    按压缩包内的存储顺序读取成员的图片头，保证磁盘读取是顺序的
+
+    names 为需要读取的成员，all_images 为 True 时读取所有图片成员。zip 和未压缩的
+    tar 只记住成员的位置，合并时再读取数据；压缩的 tar 只能顺序读取，成员数据在
+    这次遍历中读入内存。
+    """
+    opened = []
+
+    def wanted(name: str) -> bool:
+        return name in names or (all_images and _is_image_name(name))
+
+    def add(member: str, read: Callable[[], bytes], header: Image.Image) -> None:
+        name = f"{archive}{ARCHIVE_SEPARATOR}{member}"
+        opened.append((member, ArchiveMember(name, read, header)))
+
+    if zipfile.is_zipfile(archive):
+        reader = _ZipReader(archive)
+        infos = sorted(reader.infolist(), key=lambda info: info.header_offset)
+        for info in infos:
+            if not info.is_dir() and wanted(info.filename):
+                add(info.filename, partial(reader.read, info), reader.header(info))
+    elif _is_plain_tar(archive):
+        with tarfile.open(archive, "r:") as tf:
+            for member in tf:
+                if member.isfile() and wanted(member.name):
+                    with Image.open(tf.extractfile(member)) as header:
+                        pass
+                    read = partial(
+                        _read_range, archive, member.offset_data, member.size
+                    )
+                    add(member.name, read, header)
+    else:
+        # 压缩的 tar 只能顺序读取，一次遍历取出所有需要的成员
+        with tarfile.open(archive, "r:*") as tf:
+            for member in tf:
+                if member.isfile() and wanted(member.name):
+                    data = tf.extractfile(member).read()
+                    with Image.open(io.BytesIO(data)) as header:
+                        pass
+                    add(member.name, partial(bytes, data), header)
+
+    missing = names - {name for name, _ in opened}
+    if missing:
+        raise FileNotFoundError(
+            f"压缩包 '{archive}' 中不存在: {', '.join(sorted(missing))}"
+        )
+    return opened
+
+
+def resolve_archives(sources: List[Source]) -> List[Source]:
+    """
+    把压缩包成员和整个压缩包展开为 ArchiveMember，其余输入保持不变
+
+    此时只读取成员的图片头，成员数据在打开时才直接从压缩包读入内存解码，不会解压到
+    磁盘。整个压缩包按存储顺序展开为其中所有的图片成员。
+    """
+    requests: Dict[str, Tuple[Set[str], List[bool]]] = OrderedDict()
+    for source in sources:
+        ref = split_archive_member(source)
+        if ref is not None:
+            requests.setdefault(ref[0], (set(), [False]))[0].add(ref[1])
+        elif is_archive(source):
+            requests.setdefault(source, (set(), [False]))[1][0] = True
+    if not requests:
+        return list(sources)
+
+    members: Dict[str, List[Tuple[str, ArchiveMember]]] = {
+        archive: _read_archive(archive, names, all_images[0])
+        for archive, (names, all_images) in requests.items()
+    }
+
+    resolved: List[Source] = []
+    for source in sources:
+        ref = split_archive_member(source)
+        if ref is not None:
+            resolved.append(dict(members[ref[0]])[ref[1]])
+        elif isinstance(source, str) and source in members:
+            resolved.extend(im for name, im in members[source] if _is_image_name(name))
+        else:
+            resolved.append(source)
+    return resolved
+
+
+def resolve_sources(
+    sources: List[Source],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    timeout: float = DEFAULT_TIMEOUT,
+    retries: int = DEFAULT_RETRIES,
+    use_cache: bool = False,
+) -> List[Source]:
+    """
+    并发下载全部 http(s) 地址，并展开压缩包成员和整个压缩包，本地文件路径保持不变
+    """
+    urls = [s for s in sources if is_url(s)]
+    if urls:
+        fetched = iter(fetch_images(urls, concurrency, timeout, retries, use_cache))
+        sources = [_named(next(fetched), s) if is_url(s) else s for s in sources]
+    return resolve_archives(sources)
+
+
+def open_source(source: Source) -> Image.Image:
+    """
+    打开输入，已经打开的图片对象直接返回
+    """
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, ArchiveMember):
+        return source.open()
+    if is_url(source):
+        return fetch_image(source)
+    return Image.open(source)
+
+
+def close_source(source: Source, im: Image.Image) -> None:
+    """
+    关闭由 open_source 打开的图片，调用方传入的图片对象保持不变
+    """
+    if im is not source:
+        im.close()
+
+
+Metadata = List[Optional[ImageMetadata]]
+
+
+def source_metadata(sources: List[Source]) -> Metadata:
+    """
+    一次批量查询全部文件路径输入的元数据，其他输入对应 None
+
+    同一次合并中规划布局、选择模式和计算指纹共用查询结果，每个文件只查询一次索引。
+    """
+    paths = [s for s in sources if is_path(s)]
+    metas = iter(get_index().get_many(paths)) if paths else iter(())
+    return [next(metas) if is_path(s) else None for s in sources]
+
+
+def source_sizes(
+    sources: List[Source], metas: Optional[Metadata] = None
+) -> List[Tuple[int, int]]:
+    """
+    获取一组输入的尺寸，文件路径通过元数据索引获取，不需要解码
+
+    metas 为 source_metadata 的结果，未提供时查询索引。
+    """
+    if metas is None:
+        metas = source_metadata(sources)
+    return [
+        meta.dimensions if meta is not None else s.size
+        for s, meta in zip(sources, metas)
+    ]
+
+
+def source_modes(
+    sources: List[Source], metas: Optional[Metadata] = None
+) -> List[Tuple[str, bool]]:
+    """
+    获取一组输入的 (色彩模式, 是否含透明通道)，文件路径通过元数据索引获取
+
+    metas 为 source_metadata 的结果，未提供时查询索引。
+    """
+    if metas is None:
+        metas = source_metadata(sources)
+    result = []
+    for source, meta in zip(sources, metas):
+        if meta is not None:
+            result.append((meta.mode, meta.has_alpha))
+        else:
+            has_alpha = source.mode in ("RGBA", "LA", "PA", "RGBa", "La") or (
+                "transparency" in source.info
+            )
+            result.append((source.mode, has_alpha))
+    return result
+
+
+def source_exists(source: Source) -> bool:
+    """
+    检查输入是否存在，压缩包成员只检查压缩包本身，http(s) 地址在下载时检查
+    """
+    if is_url(source):
+        return True
+    ref = split_archive_member(source)
+    if ref is not None:
+        return os.path.isfile(ref[0])
+    if is_path(source):
+        return os.path.exists(source)
+    return True
+
+
+def read_path_list(data: bytes) -> List[str]:
+    """
+    解析以换行符或 NUL 分隔的路径列表，包含 NUL 时按 NUL 分隔
+    """
+    parts = data.split(b"\0") if b"\0" in data else data.splitlines()
+    return [os.fsdecode(p) for p in parts if p.strip()]
+
+
+class _StreamBuffer:
+    """
+    带缓冲的数据流读取器，用于在不知道图片长度时向前查看数据
+    """
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.buffer = bytearray()
+
+    def ensure(self, n: int) -> bool:
+        """
+        保证缓冲区中至少有 n 个字节，数据流结束时返回 False
+        """
+        while len(self.buffer) < n:
+            chunk = self.stream.read(max(STREAM_CHUNK_SIZE, n - len(self.buffer)))
+            if not chunk:
+                return False
+            self.buffer += chunk
+        return True
+
+    def require(self, n: int) -> None:
+        if not self.ensure(n):
+            raise ValueError("图片数据流意外结束")
+
+    def find(self, sub: bytes, start: int) -> int:
+        """
+        从 start 开始查找 sub，必要时继续读取数据流
+        """
+        while True:
+            index = self.buffer.find(sub, start)
+            if index >= 0:
+                return index
+            start = max(start, len(self.buffer) - len(sub) + 1)
+            self.require(len(self.buffer) + 1)
+
+    def take(self, n: int) -> bytes:
+        self.require(n)
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+
+def _png_length(buf: _StreamBuffer) -> int:
+    offset = 8
+    while True:
+        buf.require(offset + 8)
+        (length,) = struct.unpack(">I", buf.buffer[offset : offset + 4])
+        chunk_type = bytes(buf.buffer[offset + 4 : offset + 8])
+        offset += 12 + length
+        if chunk_type == b"IEND":
+            return offset
+
+
+def _jpeg_length(buf: _StreamBuffer) -> int:
+    offset = 2
+    while True:
+        buf.require(offset + 2)
+        if buf.buffer[offset] != 0xFF:
+            raise ValueError("无效的 JPEG 数据")
+        marker = buf.buffer[offset + 1]
+        if marker == 0xFF:
+            # 填充字节
+            offset += 1
+            continue
+        if marker == 0xD9:
+            return offset + 2
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            offset += 2
+            continue
+        buf.require(offset + 4)
+        (length,) = struct.unpack(">H", buf.buffer[offset + 2 : offset + 4])
+        offset += 2 + length
+        if marker == 0xDA:
+            # 跳过熵编码数据，直到遇到非填充、非 RST 的标记
+            while True:
+                offset = buf.find(b"\xff", offset)
+                buf.require(offset + 2)
+                following = buf.buffer[offset + 1]
+                if following == 0x00 or 0xD0 <= following <= 0xD7:
+                    offset += 2
+                    continue
+                if following == 0xFF:
+                    offset += 1
+                    continue
+                break
+
+
+def _gif_length(buf: _StreamBuffer) -> int:
+    def skip_sub_blocks(offset: int) -> int:
+        while True:
+            buf.require(offset + 1)
+            size = buf.buffer[offset]
+            offset += 1 + size
+            if size == 0:
+                return offset
+
+    buf.require(13)
+    flags = buf.buffer[10]
+    offset = 13
+    if flags & 0x80:
+        offset += 3 * (2 ** ((flags & 0x07) + 1))
+    while True:
+        buf.require(offset + 1)
+        block = buf.buffer[offset]
+        if block == 0x3B:
+            return offset + 1
+        if block == 0x21:
+            offset = skip_sub_blocks(offset + 2)
+        elif block == 0x2C:
+            buf.require(offset + 10)
+            local_flags = buf.buffer[offset + 9]
+            offset += 10
+            if local_flags & 0x80:
+                offset += 3 * (2 ** ((local_flags & 0x07) + 1))
+            offset = skip_sub_blocks(offset + 1)
+        else:
+            raise ValueError("无效的 GIF 数据")
+
+
+def _pnm_length(buf: _StreamBuffer) -> int:
+    magic = bytes(buf.buffer[:2])
+    fields_needed = 2 if magic == b"P4" else 3
+    fields = []
+    offset = 2
+    while len(fields) < fields_needed:
+        buf.require(offset + 1)
+        ch = buf.buffer[offset : offset + 1]
+        if ch == b"#":
+            offset = buf.find(b"\n", offset) + 1
+        elif ch.isspace():
+            offset += 1
+        else:
+            start = offset
+            while True:
+                buf.require(offset + 1)
+                if not buf.buffer[offset : offset + 1].isdigit():
+                    break
+                offset += 1
+            fields.append(int(buf.buffer[start:offset]))
+    # 头部之后紧跟一个空白字符
+    offset += 1
+
+    width, height = fields[0], fields[1]
+    if magic == b"P4":
+        return offset + (width + 7) // 8 * height
+    sample_size = 1 if fields[2] < 256 else 2
+    channels = 3 if magic == b"P6" else 1
+    return offset + width * height * channels * sample_size
+
+
+def _image_length(buf: _StreamBuffer) -> int:
+    """
+    根据文件头识别格式并计算当前图片的字节长度
+    """
+    buf.require(12)
+    head = bytes(buf.buffer[:12])
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return _png_length(buf)
+    if head.startswith(b"\xff\xd8"):
+        return _jpeg_length(buf)
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return _gif_length(buf)
+    if head.startswith(b"BM"):
+        return struct.unpack("<I", head[2:6])[0]
+    if head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+        return struct.unpack("<I", head[4:8])[0] + 8
+    if head[:2] in (b"P4", b"P5", b"P6"):
+        return _pnm_length(buf)
+    raise ValueError("不支持的图片数据格式 (支持 PNG/JPEG/GIF/BMP/WebP/PNM)")
+
+
+def iter_concatenated_images(stream: BinaryIO) -> Iterator[Image.Image]:
+    """
+    从数据流中依次读取首尾相接的多张图片
+
+    每读完一张图片就立即返回，调用方可以在读取后续数据的同时解码已读取的图片。
+    """
+    buf = _StreamBuffer(stream)
+    index = 0
+    while buf.ensure(1):
+        # 忽略图片之间的空白（例如 shell 拼接时多出的换行）
+        while buf.ensure(1) and buf.buffer[:1].isspace():
+            del buf.buffer[:1]
+        if not buf.ensure(1):
+            break
+        data = buf.take(_image_length(buf))
+        im = Image.open(io.BytesIO(data))
+        yield _named(im, f"stdin-{index}.{(im.format or 'img').lower()}")
+        index += 1
@@ -0,0 +1,662 @@
+"""
+分块渲染模块
+
+超大的网格可以拆分为多个矩形输出分块，由多个进程（可以在不同机器上）并行渲染:
+
+1. plan_tiles 规划布局并把工作清单 manifest.json 写入共享目录；
+2. 任意数量的 run_worker 进程通过锁文件认领分块，渲染后写入 tiles/ 目录；
+3. stitch_tiles 把全部分块拼接为分块 TIFF、DZI (Deep Zoom) 或普通图片。
+
+锁文件用 O_EXCL 创建，渲染期间定期更新修改时间。持有锁的进程崩溃后，锁文件超过
+stale_after 秒未更新（同一台机器上进程已不存在时立即）即视为失效，分块重新回到队列。
+每个分块都用平移后的布局规划调用 _compose 渲染，拼接结果与一次性合并逐像素一致。
+"""
+
+import json
+import math
+import os
+import shutil
+import socket
+import struct
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from typing import BinaryIO, Callable, Iterator, List, NamedTuple, Optional, Tuple
+
+from PIL import Image
+
+from .layout import Box, LayoutPlan, plan_layout
+from .progress import CancellationToken, ProgressReporter
+from .sources import Source, is_path, resolve_sources, source_sizes
+
+MANIFEST_NAME = "manifest.json"
+TILES_DIR = "tiles"
+PYRAMID_DIR = "pyramid"
+
+# 分块边长必须是 16 的倍数（TIFF 分块的要求），且为偶数以便逐块生成 DZI 金字塔
+DEFAULT_TILE_SIZE = 2048
+# 锁文件超过该时间（秒）未更新即视为持有者已崩溃
+DEFAULT_STALE_AFTER = 120.0
+# 等待其他进程时查询分块状态的间隔（秒）
+POLL_INTERVAL = 1.0
+
+DZI_TILE_SIZE = 254
+DZI_OVERLAP = 1
+
+
+class TileManifest(NamedTuple):
+    """
+    分块渲染的工作清单
+
+    tiles 为每个分块在画布上的区域 [x0, y0, x1, y1)，按行优先顺序排列。
+    """
+
+    sources: List[str]
+    canvas_size: Tuple[int, int]
+    tile_size: int
+    placements: List[Box]
+    dividers: List[Box]
+    bg_color: Tuple[int, int, int]
+    divider_color: Tuple[int, int, int]
+    tiles: List[Box]
+
+    @property
+    def grid(self) -> Tuple[int, int]:
+        """
+        分块的 (列数, 行数)
+        """
+        w, h = self.canvas_size
+        return math.ceil(w / self.tile_size), math.ceil(h / self.tile_size)
+
+
+def tile_path(work_dir: str, index: int) -> str:
+    return os.path.join(work_dir, TILES_DIR, f"{index:06d}.png")
+
+
+def _lock_path(work_dir: str, index: int) -> str:
+    return os.path.join(work_dir, TILES_DIR, f"{index:06d}.lock")
+
+
+def load_manifest(work_dir: str) -> TileManifest:
+    with open(os.path.join(work_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return TileManifest(
+        sources=data["sources"],
+        canvas_size=tuple(data["canvas_size"]),
+        tile_size=data["tile_size"],
+        placements=[tuple(p) for p in data["placements"]],
+        dividers=[tuple(d) for d in data["dividers"]],
+        bg_color=tuple(data["bg_color"]),
+        divider_color=tuple(data["divider_color"]),
+        tiles=[tuple(t) for t in data["tiles"]],
+    )
+
+
+def plan_tiles(
+    files: List[str],
+    work_dir: str,
+    tile_size: int = DEFAULT_TILE_SIZE,
+    orientation: str = "horizontal",
+    gap: int = 40,
+    divider: bool = True,
+    divider_thickness: int = 4,
+    divider_color: Tuple[int, int, int] = (200, 200, 200),
+    bg_color: Tuple[int, int, int] = (255, 255, 255),
+    align: str = "center",
+    uniform_height: Optional[int] = None,
+    uniform_width: Optional[int] = None,
+    margin: int = 0,
+    cols: Optional[int] = None,
+    rows: Optional[int] = None,
+) -> TileManifest:
+    """
+    规划布局并把工作清单写入 work_dir，布局参数与 merge_images 相同
+
+    输入必须能被所有渲染进程访问（共享目录中的文件或 http(s) 地址），本地路径会转换为
+    绝对路径。只读取文件头获取尺寸，不解码图片。
+    """
+    if tile_size <= 0 or tile_size % 16:
+        raise ValueError("分块边长必须是 16 的正整数倍")
+    sources = [os.path.abspath(f) if is_path(f) else f for f in files]
+    sizes = source_sizes(
+        [f if is_path(f) else resolve_sources([f])[0] for f in sources]
+    )
+    plan = plan_layout(
+        sizes=sizes,
+        orientation=orientation,
+        gap=gap,
+        divider=divider,
+        divider_thickness=divider_thickness,
+        align=align,
+        uniform_height=uniform_height,
+        uniform_width=uniform_width,
+        margin=margin,
+        cols=cols,
+        rows=rows,
+    )
+    w, h = plan.canvas_size
+    tiles = [
+        (x, y, min(x + tile_size, w), min(y + tile_size, h))
+        for y in range(0, h, tile_size)
+        for x in range(0, w, tile_size)
+    ]
+    manifest = TileManifest(
+        sources=sources,
+        canvas_size=plan.canvas_size,
+        tile_size=tile_size,
+        placements=plan.placements,
+        dividers=plan.dividers,
+        bg_color=tuple(bg_color),
+        divider_color=tuple(divider_color),
+        tiles=tiles,
+    )
+    os.makedirs(os.path.join(work_dir, TILES_DIR), exist_ok=True)
+    tmp_path = os.path.join(work_dir, f".{MANIFEST_NAME}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest._asdict(), f)
+    os.replace(tmp_path, os.path.join(work_dir, MANIFEST_NAME))
+    return manifest
+
+
+def _intersects(a: Box, b: Box) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def render_tile(manifest: TileManifest, index: int) -> Image.Image:
+    """
+    渲染一个分块，结果与完整画布上对应区域的像素相同
+
+    只解码与分块相交的图片。把布局规划平移到分块坐标系后交给 _compose，超出分块的部分
+    在粘贴和绘制时被裁掉，缩放仍按完整的放置区域进行。
+    """
+    from .merge_images import _compose, _open_in_mode
+
+    x0, y0, x1, y1 = manifest.tiles[index]
+    indices = [
+        i
+        for i, (x, y, w, h) in enumerate(manifest.placements)
+        if _intersects((x, y, x + w, y + h), (x0, y0, x1, y1))
+    ]
+    plan = LayoutPlan(
+        canvas_size=(x1 - x0, y1 - y0),
+        placements=[
+            (x - x0, y - y0, w, h)
+            for x, y, w, h in (manifest.placements[i] for i in indices)
+        ],
+        dividers=[
+            (a - x0, b - y0, c - x0, d - y0)
+            for a, b, c, d in manifest.dividers
+            if _intersects((a, b, c + 1, d + 1), (x0, y0, x1, y1))
+        ],
+    )
+    sources: List[Source] = resolve_sources([manifest.sources[i] for i in indices])
+    images = [_open_in_mode(source, "RGBA") for source in sources]
+    canvas = _compose(images, plan, manifest.bg_color, manifest.divider_color)
+    return canvas.convert("RGB")
+
+
+class TileLock:
+    """
+    分块的锁文件，持有期间在后台线程中定期更新修改时间
+    """
+
+    def __init__(self, path: str, token: str, heartbeat: float):
+        self.path = path
+        self.token = token
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._beat, args=(heartbeat,), daemon=True
+        )
+        self._thread.start()
+
+    def _beat(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            info = _read_lock(self.path)
+            if info and info.get("token") != self.token:
+                # 锁已被其他进程判定失效并接管
+                return
+            try:
+                os.utime(self.path)
+            except OSError:
+                # 其他进程可能正把锁改名后检查，检查后会放回原处
+                continue
+
+    def release(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        # 只删除自己的锁，锁被接管后不影响新的持有者
+        if _read_lock(self.path).get("token") == self.token:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def __enter__(self) -> "TileLock":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+def _read_lock(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _is_stale(path: str, stale_after: float) -> bool:
+    """
+    判断锁文件是否失效：同一台机器上的持有进程已退出，或超过 stale_after 秒未更新
+    """
+    try:
+        age = time.time() - os.path.getmtime(path)
+    except OSError:
+        return False
+    info = _read_lock(path)
+    if info.get("host") == socket.gethostname() and isinstance(info.get("pid"), int):
+        if not _pid_alive(info["pid"]):
+            return True
+    # 锁文件刚创建、尚未写入内容时只按修改时间判断
+    return age > stale_after
+
+
+def _remove_stale(path: str, moved: str, stale_after: float) -> bool:
+    """
+    接管失效的锁：改名为本进程独有的 moved 后再次检查，仍然失效才删除
+
+    多个进程同时接管时只有一个能改名成功。判断失效与改名之间，其他进程可能已经接管
+    并创建了新锁，改名得到的就是新锁：这时用硬链接放回原处（原处已有锁时不覆盖）并
+    放弃该分块。返回是否删除了失效的锁。
+    """
+    try:
+        os.rename(path, moved)
+    except OSError:
+        return False
+    if _is_stale(moved, stale_after):
+        try:
+            os.remove(moved)
+        except OSError:
+            pass
+        return True
+    try:
+        os.link(moved, path)
+    except OSError:
+        pass
+    try:
+        os.remove(moved)
+    except OSError:
+        pass
+    return False
+
+
+def claim_tile(
+    work_dir: str, index: int, stale_after: float = DEFAULT_STALE_AFTER
+) -> Optional[TileLock]:
+    """
+    尝试认领一个分块，成功时返回锁，分块已完成或被其他进程持有时返回 None
+    """
+    path = _lock_path(work_dir, index)
+    token = uuid.uuid4().hex
+    for _ in range(2):
+        if os.path.exists(tile_path(work_dir, index)):
+            return None
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            if not _is_stale(path, stale_after):
+                return None
+            if not _remove_stale(path, f"{path}.stale.{token}", stale_after):
+                return None
+            continue
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(
+                {"host": socket.gethostname(), "pid": os.getpid(), "token": token}, f
+            )
+        lock = TileLock(path, token, heartbeat=max(stale_after / 4, 0.05))
+        # 认领前其他进程可能刚好完成了该分块
+        if os.path.exists(tile_path(work_dir, index)):
+            lock.release()
+            return None
+        return lock
+    return None
+
+
+def pending_tiles(work_dir: str, manifest: TileManifest) -> List[int]:
+    return [
+        i
+        for i in range(len(manifest.tiles))
+        if not os.path.exists(tile_path(work_dir, i))
+    ]
+
+
+def run_worker(
+    work_dir: str,
+    stale_after: float = DEFAULT_STALE_AFTER,
+    wait: bool = True,
+    on_tile: Optional[Callable[[int, int], None]] = None,
+) -> int:
+    """
+    反复认领并渲染分块，返回本进程渲染的分块数
+
+    wait 为 True 时一直运行到所有分块完成（期间接管失效的锁）；为 False 时没有可认领的
+    分块就返回。每完成一个分块调用 on_tile(分块序号, 分块总数)。
+    """
+    from .merge_images import _atomic_output
+
+    manifest = load_manifest(work_dir)
+    rendered = 0
+    while True:
+        pending = pending_tiles(work_dir, manifest)
+        if not pending:
+            return rendered
+        progressed = False
+        for index in pending:
+            lock = claim_tile(work_dir, index, stale_after)
+            if lock is None:
+                continue
+            with lock:
+                tile = render_tile(manifest, index)
+                with _atomic_output(tile_path(work_dir, index)) as tmp_path:
+                    # 中间结果以最快的压缩级别保存
+                    tile.save(tmp_path, format="PNG", compress_level=1)
+            rendered += 1
+            progressed = True
+            if on_tile is not None:
+                on_tile(index, len(manifest.tiles))
+        if not progressed:
+            if not wait:
+                return rendered
+            time.sleep(POLL_INTERVAL)
+
+
+class _TileGrid:
+    """
+    按固定边长切分、逐块保存在磁盘上的图像，裁剪时只读取相交的分块
+    """
+
+    def __init__(
+        self,
+        size: Tuple[int, int],
+        tile_size: int,
+        path_of: Callable[[int, int], str],
+    ):
+        self.size = size
+        self.tile_size = tile_size
+        self.path_of = path_of
+        self.cols = math.ceil(size[0] / tile_size)
+        self.rows = math.ceil(size[1] / tile_size)
+        # 按行扫描时最多同时用到两行分块
+        self._cache: "OrderedDict[Tuple[int, int], Image.Image]" = OrderedDict()
+        self._capacity = 2 * self.cols + 2
+
+    def load(self, col: int, row: int) -> Image.Image:
+        """
+        读取一个分块，不经过缓存
+        """
+        with Image.open(self.path_of(col, row)) as f:
+            return f.convert("RGB")
+
+    def tile(self, col: int, row: int) -> Image.Image:
+        key = (col, row)
+        im = self._cache.get(key)
+        if im is None:
+            im = self.load(col, row)
+            self._cache[key] = im
+            if len(self._cache) > self._capacity:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return im
+
+    def crop(self, box: Box) -> Image.Image:
+        x0, y0, x1, y1 = box
+        t = self.tile_size
+        out = Image.new("RGB", (x1 - x0, y1 - y0))
+        for row in range(y0 // t, (y1 - 1) // t + 1):
+            for col in range(x0 // t, (x1 - 1) // t + 1):
+                im = self.tile(col, row)
+                out.paste(im, (col * t - x0, row * t - y0))
+        return out
+
+    def half(
+        self, path_of: Callable[[int, int], str], check: Callable[[], None]
+    ) -> "_TileGrid":
+        """
+        生成长宽各缩小一半的下一级图像，每个新分块由 2x2 个分块 2x2 平均得到
+
+        分块边长为偶数，逐块缩小与整张图片缩小的结果相同。生成每个分块前调用 check。
+        """
+        size = (math.ceil(self.size[0] / 2), math.ceil(self.size[1] / 2))
+        smaller = _TileGrid(size, self.tile_size, path_of)
+        half = self.tile_size // 2
+        for row in range(smaller.rows):
+            for col in range(smaller.cols):
+                check()
+                x0, y0 = col * self.tile_size, row * self.tile_size
+                w = min(self.tile_size, size[0] - x0)
+                h = min(self.tile_size, size[1] - y0)
+                out = Image.new("RGB", (w, h))
+                for dy in range(2):
+                    for dx in range(2):
+                        c, r = 2 * col + dx, 2 * row + dy
+                        if c < self.cols and r < self.rows:
+                            out.paste(self.tile(c, r).reduce(2), (dx * half, dy * half))
+                path = path_of(col, row)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                out.save(path, format="PNG", compress_level=1)
+        return smaller
+
+
+def _manifest_grid(work_dir: str, manifest: TileManifest) -> _TileGrid:
+    cols = manifest.grid[0]
+    return _TileGrid(
+        manifest.canvas_size,
+        manifest.tile_size,
+        lambda col, row: tile_path(work_dir, row * cols + col),
+    )
+
+
+def _write_tiled_tiff(
+    output: BinaryIO,
+    size: Tuple[int, int],
+    tile_size: int,
+    tiles: Iterator[Image.Image],
+    check: Callable[[], None],
+) -> None:
+    """
+    逐块写入 deflate 压缩的 RGB 分块 TIFF，内存中只保留一个分块
+
+    边缘分块补齐到完整边长。未压缩数据可能超过 4GB 时写为 BigTIFF。
+    压缩每个分块前调用 check。
+    """
+    w, h = size
+    big = w * h * 3 * 1.01 + (1 << 20) >= 1 << 32
+    offset_format = "Q" if big else "I"
+    offset_type = 16 if big else 4
+    inline = 8 if big else 4
+
+    start = output.tell()
+    if big:
+        output.write(b"II" + struct.pack("<HHHQ", 43, 8, 0, 0))
+    else:
+        output.write(b"II" + struct.pack("<HI", 42, 0))
+
+    offsets, counts = [], []
+    for tile in tiles:
+        check()
+        if tile.size != (tile_size, tile_size):
+            padded = Image.new("RGB", (tile_size, tile_size))
+            padded.paste(tile, (0, 0))
+            tile = padded
+        data = zlib.compress(tile.tobytes(), 6)
+        offsets.append(output.tell() - start)
+        counts.append(len(data))
+        output.write(data)
+        if len(data) % 2:
+            output.write(b"\0")
+
+    # (标签, 类型, 值): 类型 3 为 SHORT, 4 为 LONG, 16 为 LONG8
+    entries = [
+        (256, 4, [w]),
+        (257, 4, [h]),
+        (258, 3, [8, 8, 8]),
+        (259, 3, [8]),
+        (262, 3, [2]),
+        (277, 3, [3]),
+        (284, 3, [1]),
+        (322, 4, [tile_size]),
+        (323, 4, [tile_size]),
+        (324, offset_type, offsets),
+        (325, offset_type, counts),
+    ]
+    formats = {3: "H", 4: "I", 16: "Q"}
+    fields = []
+    for tag, kind, values in entries:
+        data = struct.pack(f"<{len(values)}{formats[kind]}", *values)
+        if len(data) > inline:
+            value = struct.pack(f"<{offset_format}", output.tell() - start)
+            output.write(data)
+            if len(data) % 2:
+                output.write(b"\0")
+        else:
+            value = data.ljust(inline, b"\0")
+        fields.append((tag, kind, len(values), value))
+
+    ifd_offset = output.tell() - start
+    if big:
+        output.write(struct.pack("<Q", len(fields)))
+        for tag, kind, count, value in fields:
+            output.write(struct.pack("<HHQ", tag, kind, count) + value)
+        output.write(struct.pack("<Q", 0))
+        output.seek(start + 8)
+        output.write(struct.pack("<Q", ifd_offset))
+    else:
+        output.write(struct.pack("<H", len(fields)))
+        for tag, kind, count, value in fields:
+            output.write(struct.pack("<HHI", tag, kind, count) + value)
+        output.write(struct.pack("<I", 0))
+        output.seek(start + 4)
+        output.write(struct.pack("<I", ifd_offset))
+    output.seek(0, os.SEEK_END)
+
+
+def _write_dzi(
+    output: str,
+    work_dir: str,
+    grid: _TileGrid,
+    tile_format: str,
+    check: Callable[[], None],
+) -> None:
+    """
+    写入 Deep Zoom 图像: output (.dzi) 描述文件和 <名称>_files/<级别>/<列>_<行> 分块
+
+    各级图像由上一级逐块 2x2 平均得到，中间结果保存在工作目录的 pyramid/ 中。
+    每写出一个分块前调用 check；描述文件最后写入，中途取消时不会留下 .dzi。
+    """
+    base = os.path.splitext(output)[0]
+    files_dir = f"{base}_files"
+    extension = "jpeg" if tile_format == "JPEG" else tile_format.lower()
+    w, h = grid.size
+    max_level = math.ceil(math.log2(max(w, h))) if max(w, h) > 1 else 0
+
+    level_grid = grid
+    for level in range(max_level, -1, -1):
+        if level < max_level:
+            level_dir = os.path.join(work_dir, PYRAMID_DIR, str(level))
+            level_grid = level_grid.half(
+                lambda col, row, d=level_dir: os.path.join(d, f"{col}_{row}.png"),
+                check,
+            )
+        lw, lh = level_grid.size
+        target_dir = os.path.join(files_dir, str(level))
+        os.makedirs(target_dir, exist_ok=True)
+        for row in range(math.ceil(lh / DZI_TILE_SIZE)):
+            for col in range(math.ceil(lw / DZI_TILE_SIZE)):
+                check()
+                x, y = col * DZI_TILE_SIZE, row * DZI_TILE_SIZE
+                box = (
+                    max(x - DZI_OVERLAP, 0),
+                    max(y - DZI_OVERLAP, 0),
+                    min(x + DZI_TILE_SIZE + DZI_OVERLAP, lw),
+                    min(y + DZI_TILE_SIZE + DZI_OVERLAP, lh),
+                )
+                level_grid.crop(box).save(
+                    os.path.join(target_dir, f"{col}_{row}.{extension}"),
+                    format=tile_format,
+                )
+
+    descriptor = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+        f'Format="{extension}" Overlap="{DZI_OVERLAP}" TileSize="{DZI_TILE_SIZE}">\n'
+        f'  <Size Width="{w}" Height="{h}"/>\n'
+        "</Image>\n"
+    )
+    with open(output, "w", encoding="utf-8") as f:
+        f.write(descriptor)
+    shutil.rmtree(os.path.join(work_dir, PYRAMID_DIR), ignore_errors=True)
+
+
+def stitch_tiles(
+    work_dir: str,
+    output: str,
+    output_format: Optional[str] = None,
+    cancel: Optional[CancellationToken] = None,
+) -> str:
+    """
+    把全部分块拼接为输出，返回 output
+
+    - .tif/.tiff: 分块 TIFF，逐块写入，内存中只保留一个分块
+    - .dzi: Deep Zoom 图像，output_format 为分块格式 (默认 JPEG)
+    - 其他扩展名: 拼接为一张普通图片（需要容纳整个画布的内存）
+
+    cancel 被取消后在下一个分块处抛出 MergeCancelled，临时文件随之删除。
+    """
+    from .merge_images import _atomic_output, _save_canvas
+
+    reporter = ProgressReporter(cancel=cancel)
+    manifest = load_manifest(work_dir)
+    missing = pending_tiles(work_dir, manifest)
+    if missing:
+        raise ValueError(f"还有 {len(missing)} 个分块未完成")
+
+    extension = os.path.splitext(output)[1].lower()
+    grid = _manifest_grid(work_dir, manifest)
+    if extension == ".dzi":
+        _write_dzi(
+            output, work_dir, grid, (output_format or "JPEG").upper(), reporter.check
+        )
+        return output
+    if extension in (".tif", ".tiff") and output_format is None:
+        tiles = (
+            grid.load(col, row) for row in range(grid.rows) for col in range(grid.cols)
+        )
+        with _atomic_output(output) as tmp_path, open(tmp_path, "wb") as f:
+            _write_tiled_tiff(
+                f, manifest.canvas_size, manifest.tile_size, tiles, reporter.check
+            )
+        return output
+
+    canvas = Image.new("RGB", manifest.canvas_size)
+    for row in range(grid.rows):
+        for col in range(grid.cols):
+            reporter.check()
+            canvas.paste(
+                grid.load(col, row),
+                (col * manifest.tile_size, row * manifest.tile_size),
+            )
+    return _save_canvas(canvas, output, output_format, reporter)
@@ -6,17 +6,40 @@
 """
 
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from rich.console import Console
 from rich.prompt import Prompt, Confirm
 from rich.panel import Panel
-from .merge_images import merge_images
+from rich.progress import (
+    BarColumn,
+    Progress,
+    TaskProgressColumn,
+    TextColumn,
+    TimeElapsedColumn,
+)
+from . import metrics
+from .merge_images import MERGE_ERRORS, merge_images
 from datetime import datetime
 from .config import ConfigManager
 from .file_selector import FileSelector
 from .menu import MenuManager
+from .preview import PreviewRenderer
+from .progress import CancellationToken, MergeCancelled, ProgressEvent
 from .settings_configurer import SettingsConfigurer
 
 
+# 进度条中各阶段的显示名称
+STAGE_LABELS = {
+    "planned": "规划布局",
+    "decoded": "解码图片",
+    "resized": "缩放合成",
+    "composed": "合成完成",
+    "encoding": "编码输出",
+    "done": "写入完成",
+}
+
+
 class ImageProcessorTUI:
     """
     图片处理 TUI 类
@@ -28,6 +51,7 @@ class ImageProcessorTUI:
         self.config = ConfigManager()
         self.menu_manager = MenuManager(self.console)
         self.settings_configurer = SettingsConfigurer(self.console)
+        self.preview_renderer = PreviewRenderer()
 
     def run(self):
         """
@@ -56,6 +80,8 @@ class ImageProcessorTUI:
                 self.reset_config()
             elif choice == "8":
                 self.menu_manager.show_help()
+            elif choice == "9":
+                self.preview()
             elif choice == "0":
                 self.console.print("[yellow]再见！[/yellow]")
                 break
@@ -64,7 +90,11 @@ class ImageProcessorTUI:
         """
         添加图片文件
         """
-        selector = FileSelector()
+        # 扫描方式在“配置合并参数”中设置
+        selector = FileSelector(
+            recursive=self.config.scan_recursive,
+            pattern=self.config.scan_pattern or None,
+        )
         selected_files = selector.run()
         if selected_files:
             for file_path in selected_files:
@@ -110,9 +140,40 @@ class ImageProcessorTUI:
         """
         配置合并参数
         """
-        self.settings_configurer.configure_settings(self.config)
+        self.settings_configurer.configure_settings(
+            self.config, preview=self.preview if self.files else None
+        )
         self.config.save_config()
 
+    def preview(self):
+        """
+        在终端中预览当前布局
+        """
+        if not self.files:
+            self.console.print("[red]错误: 尚未添加任何图片文件[/red]")
+            return
+
+        missing_files = [file for file in self.files if not os.path.exists(file)]
+        if missing_files:
+            self.console.print("[red]以下文件不存在:[/red]")
+            for file in missing_files:
+                self.console.print(f"  - {file}")
+            return
+
+        columns, lines = self.console.size
+        start = time.perf_counter()
+        try:
+            text = self.preview_renderer.render_text(
+                self.files, self.config, columns, max(lines - 4, 4)
+            )
+        except MERGE_ERRORS as e:
+            self.console.print(f"[red]生成预览时出错: {str(e)}[/red]")
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        self.console.print(text)
+        self.console.print(f"[dim]预览耗时 {elapsed_ms:.0f} ms[/dim]")
+
     def show_current_config(self):
         """
         显示当前配置
@@ -176,7 +237,7 @@ class ImageProcessorTUI:
             return
 
         try:
-            result = merge_images(
+            result = self._merge_with_progress(
                 files=self.files,
                 output=self.config.output,
                 orientation=self.config.orientation,
@@ -203,12 +264,62 @@ class ImageProcessorTUI:
             self.files.clear()
             self.console.print("[green]图片列表已清空[/green]")
 
-        except Exception as e:
+        except MergeCancelled:
+            self.console.print("[yellow]合并已取消，输出文件未被改动[/yellow]")
+        except MERGE_ERRORS as e:
             self.console.print(f"[red]合并图片时出错: {str(e)}[/red]")
         finally:
             # 恢复原始输出路径
             self.config.output = original_output
 
+    def _merge_with_progress(self, **kwargs):
+        """
+        在后台线程中合并图片并显示进度条，按 Ctrl+C 取消
+        """
+        token = CancellationToken()
+        counts = {"steps": 0}
+
+        with Progress(
+            TextColumn("{task.description}"),
+            BarColumn(),
+            TaskProgressColumn(),
+            TimeElapsedColumn(),
+            console=self.console,
+        ) as progress:
+            task = progress.add_task("准备中", total=None)
+
+            def on_progress(event: ProgressEvent):
+                # 解码和缩放各 n 步，合成、编码、完成各 1 步
+                if event.total:
+                    progress.update(task, total=2 * event.total + 3)
+                if event.stage != "planned":
+                    counts["steps"] += 1
+                description = STAGE_LABELS.get(event.stage, event.stage)
+                if event.total:
+                    description += f" {event.current}/{event.total}"
+                progress.update(
+                    task, completed=counts["steps"], description=description
+                )
+                if event.stage == "done":
+                    progress.update(task, total=counts["steps"])
+
+            # 合并中的异常保存在 future 中，等待结束后由 result() 重新抛出
+            executor = ThreadPoolExecutor(max_workers=1)
+            future = executor.submit(
+                merge_images, progress=on_progress, cancel=token, **kwargs
+            )
+            executor.shutdown(wait=False)
+            # 带超时轮询而不是直接 future.result，被 Ctrl+C 打断后仍能等待线程结束
+            try:
+                while not wait([future], timeout=0.1).done:
+                    pass
+            except KeyboardInterrupt:
+                token.cancel()
+                progress.update(task, description="正在取消...")
+                wait([future])
+
+        return future.result()
+
     def reset_config(self):
         """
         重置配置为默认值
@@ -228,6 +339,8 @@ def run_tui():
     """
     运行 TUI 界面的入口点
     """
+    # TUI 是长时间运行的进程，可以通过环境变量启用 /metrics 或指标文件
+    metrics.configure_from_env()
     app = ImageProcessorTUI()
     app.run()
 
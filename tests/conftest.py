@@ -0,0 +1,29 @@
+import pytest
+from PIL import ImageCms
+
+from image_process import metrics
+
+
+@pytest.fixture
+def enabled_metrics():
+    """
+    启用并清空运行指标，测试结束后关闭
+    """
+    metrics.REGISTRY.clear()
+    metrics.enable()
+    yield metrics
+    metrics.disable()
+    metrics.REGISTRY.clear()
+
+
+@pytest.fixture
+def other_profile(tmp_path):
+    """
+    写出一个与内置 sRGB 字节不同的合法 RGB 配置，返回文件路径
+    """
+    data = bytearray(ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes())
+    # 配置头 24-35 字节为创建时间，修改后配置仍然有效
+    data[24:36] = bytes([7, 208, 0, 1, 0, 1, 0, 0, 0, 0, 0, 0])
+    path = tmp_path / "other.icc"
+    path.write_bytes(bytes(data))
+    return str(path)
@@ -0,0 +1,80 @@
+import pytest
+from PIL import Image
+
+from image_process.merge_images import merge_images
+
+SIZE = 20
+
+# 第一个输入 3 帧共 300ms，第二个输入 2 帧共 400ms
+FIRST = [(255, 0, 0), (0, 255, 0), (0, 0, 255)]
+SECOND = [(255, 255, 0), (0, 255, 255)]
+
+
+def _animated(path, colors, duration):
+    frames = [Image.new("RGB", (SIZE, SIZE), color) for color in colors]
+    frames[0].save(
+        path, save_all=True, append_images=frames[1:], duration=duration, loop=0
+    )
+    return str(path)
+
+
+def _frames(path):
+    """
+    返回 [(时长, 第一个输入的颜色下标, 第二个输入的颜色下标)]
+    """
+    result = []
+    with Image.open(path) as im:
+        for i in range(im.n_frames):
+            im.seek(i)
+            frame = im.convert("RGB")
+            result.append(
+                (
+                    im.info["duration"],
+                    _nearest(frame.getpixel((SIZE // 2, SIZE // 2)), FIRST),
+                    _nearest(frame.getpixel((SIZE + SIZE // 2, SIZE // 2)), SECOND),
+                )
+            )
+    return result
+
+
+def _nearest(pixel, colors):
+    # WebP 默认有损编码，按最接近的颜色判断
+    return min(
+        range(len(colors)),
+        key=lambda i: sum((a - b) ** 2 for a, b in zip(pixel, colors[i])),
+    )
+
+
+EXPECTED = {
+    # 总时长取最长的输入，较短的输入从头循环
+    "loop": [(100, 0, 0), (100, 1, 0), (100, 2, 1), (100, 0, 1)],
+    # 较短的输入停在最后一帧，与上一帧相同的帧由编码器合并
+    "hold": [(100, 0, 0), (100, 1, 0), (200, 2, 1)],
+    # 300 和 400 的最小公倍数为 1200ms，两个输入同时回到起点
+    "lcm": [(100, i % 3, i // 2 % 2) for i in range(12)],
+}
+
+TOTAL = {"loop": 400, "hold": 400, "lcm": 1200}
+
+
+@pytest.mark.parametrize("extension", ["gif", "webp"])
+@pytest.mark.parametrize("policy", ["loop", "hold", "lcm"])
+def test_animation_policies(tmp_path, policy, extension):
+    files = [
+        _animated(tmp_path / "first.gif", FIRST, 100),
+        _animated(tmp_path / "second.gif", SECOND, 200),
+    ]
+    output = tmp_path / f"out.{extension}"
+    merge_images(files, str(output), gap=0, divider=False, animation_policy=policy)
+    frames = _frames(output)
+    assert frames == EXPECTED[policy]
+    assert sum(duration for duration, _, _ in frames) == TOTAL[policy]
+
+
+def test_static_input_is_shown_in_every_frame(tmp_path):
+    still = tmp_path / "still.png"
+    Image.new("RGB", (SIZE, SIZE), SECOND[1]).save(still)
+    files = [_animated(tmp_path / "first.gif", FIRST, 100), str(still)]
+    output = tmp_path / "out.gif"
+    merge_images(files, str(output), gap=0, divider=False)
+    assert _frames(output) == [(100, 0, 1), (100, 1, 1), (100, 2, 1)]
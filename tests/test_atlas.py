@@ -0,0 +1,46 @@
+import json
+import zipfile
+
+from PIL import Image
+
+from image_process.atlas import plan_atlas
+from image_process.merge_images import merge_images
+
+
+def _assert_disjoint(plan, gap):
+    boxes = plan.placements
+    for i, (x, y, w, h) in enumerate(boxes):
+        assert x + w <= plan.canvas_size[0] and y + h <= plan.canvas_size[1]
+        for ox, oy, ow, oh in boxes[:i]:
+            assert (
+                x + w + gap <= ox
+                or ox + ow + gap <= x
+                or y + h + gap <= oy
+                or oy + oh + gap <= y
+            )
+
+
+def test_plan_atlas_keeps_sizes_without_overlap():
+    sizes = [(16 + 7 * i % 50, 12 + 11 * i % 40) for i in range(60)]
+    for kwargs in ({}, {"gap": 2, "margin": 3}, {"power_of_two": True}):
+        plan = plan_atlas(sizes, **kwargs)
+        assert [(w, h) for _, _, w, h in plan.placements] == sizes
+        _assert_disjoint(plan, kwargs.get("gap", 0))
+    w, h = plan_atlas(sizes, power_of_two=True).canvas_size
+    assert w & (w - 1) == 0 and h & (h - 1) == 0
+
+
+def test_archive_members_are_named_in_map(tmp_path):
+    archive = tmp_path / "sprites.zip"
+    with zipfile.ZipFile(archive, "w") as zf:
+        for i, name in enumerate(["icons/play.png", "icons/stop.png"]):
+            path = tmp_path / f"{i}.png"
+            Image.new("RGBA", (10 + i, 8), (255, 0, 0, 128)).save(path)
+            zf.write(path, name)
+
+    output = tmp_path / "atlas.png"
+    merge_images([str(archive)], str(output), atlas=True, gap=0)
+    frames = json.loads((tmp_path / "atlas.json").read_text())["frames"]
+    assert sorted(frames) == ["play.png", "stop.png"]
+    assert frames["stop.png"]["frame"]["w"] == 11
+    assert Image.open(output).mode == "RGBA"
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+from PIL import Image
+
+from image_process.merge_images import merge_images
+from image_process.progress import CancellationToken, MergeCancelled
+from image_process.tiles import plan_tiles, run_worker, stitch_tiles
+
+
+def _inputs(tmp_path, count=2, size=(256, 128)):
+    paths = []
+    for i in range(count):
+        path = tmp_path / f"in{i}.png"
+        Image.new("RGB", size, (60 * i, 100, 200)).save(path)
+        paths.append(str(path))
+    return paths
+
+
+def _cancel_on(stage):
+    """
+    返回 (进度回调, 令牌)：收到 stage 事件时取消
+    """
+    token = CancellationToken()
+
+    def progress(event):
+        if event.stage == stage:
+            token.cancel()
+
+    return progress, token
+
+
+@pytest.mark.parametrize(
+    "name, png_threads",
+    [("out.png", None), ("out.png", 2), ("out.tif", None), ("out.jpg", None)],
+)
+def test_cancel_during_encoding(tmp_path, name, png_threads):
+    inputs = _inputs(tmp_path)
+    output = tmp_path / name
+    progress, token = _cancel_on("encoding")
+    with pytest.raises(MergeCancelled):
+        merge_images(
+            inputs,
+            str(output),
+            png_threads=png_threads,
+            progress=progress,
+            cancel=token,
+        )
+    assert not output.exists()
+    # 临时文件已删除
+    assert sorted(os.listdir(tmp_path)) == ["in0.png", "in1.png"]
+
+
+@pytest.mark.parametrize("name", ["out.tif", "out.dzi", "out.png"])
+def test_cancel_stitch(tmp_path, name):
+    inputs = _inputs(tmp_path, count=4, size=(40, 40))
+    work_dir = str(tmp_path / "work")
+    plan_tiles(inputs, work_dir, cols=2, tile_size=32)
+    run_worker(work_dir)
+    token = CancellationToken()
+    token.cancel()
+    output = tmp_path / name
+    with pytest.raises(MergeCancelled):
+        stitch_tiles(work_dir, str(output), cancel=token)
+    assert not output.exists()
+    assert not any(n.startswith(".out") for n in os.listdir(tmp_path))
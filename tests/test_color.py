@@ -0,0 +1,44 @@
+import time
+
+from PIL import Image
+
+from image_process import color
+from image_process.merge_images import merge_images
+
+
+def test_builtin_srgb_is_stable():
+    first = color.ColorManager("srgb")
+    time.sleep(1.1)
+    second = color.ColorManager("srgb")
+    assert first.profile == second.profile
+    im = Image.new("RGB", (4, 4), (10, 20, 30))
+    # 没有嵌入配置的输入视为 sRGB，与目标相同时不做转换
+    assert second.convert(im) is im
+
+
+def test_merges_share_cached_transform(tmp_path, enabled_metrics, other_profile):
+    color.clear_cache()
+    inputs = []
+    for i in range(2):
+        path = tmp_path / f"in{i}.png"
+        Image.new("RGB", (16, 8), (40 * i, 100, 200)).save(path)
+        inputs.append(str(path))
+
+    for i in range(2):
+        merge_images(inputs, str(tmp_path / f"out{i}.png"), color_profile=other_profile)
+        time.sleep(1.1)
+
+    requests = enabled_metrics.CACHE_REQUESTS
+    assert requests.value(cache="icc", result="miss") == 1
+    assert requests.value(cache="icc", result="hit") == 3
+    assert len(color._TRANSFORMS) == 1
+
+
+def test_transform_cache_is_bounded(monkeypatch, other_profile):
+    color.clear_cache()
+    monkeypatch.setattr(color, "MAX_CACHED_TRANSFORMS", 2)
+    for intent in ("perceptual", "relative", "saturation"):
+        color.ColorManager(other_profile, intent).convert(Image.new("RGB", (2, 2)))
+    assert len(color._TRANSFORMS) == 2
+    # 最久未使用的转换被淘汰
+    assert [key[2] for key in color._TRANSFORMS] == ["relative", "saturation"]
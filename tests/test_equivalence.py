@@ -0,0 +1,88 @@
+import pytest
+
+from image_process import decoding, equivalence
+from image_process import merge_images as merge_module
+
+# 间距、边距和分隔线都启用，覆盖线性/网格布局和统一尺寸缩放
+GRID = [
+    options
+    for options in equivalence.option_grid()
+    if options["gap"] and options["margin"] and options["divider"]
+    if options["align"] == "center"
+]
+
+
+@pytest.fixture(scope="module")
+def file_inputs(tmp_path_factory):
+    return equivalence.file_inputs(str(tmp_path_factory.mktemp("inputs")))
+
+
+@pytest.fixture
+def fast_paths(monkeypatch):
+    """
+    统计尝试内存映射的次数，以及内存映射、降采样解码和 EXIF 缩略图实际生效的次数
+    """
+    used = {"probed": 0, "mapped": 0, "draft": 0, "thumbnail": 0}
+
+    def map_uncompressed(source):
+        used["probed"] += 1
+        mapped = decoding.map_uncompressed(source)
+        used["mapped"] += mapped is not None
+        return mapped
+
+    def draft_for_target(im, target_size):
+        size = im.size
+        original_draft(im, target_size)
+        used["draft"] += im.size != size
+
+    def thumbnail_for_target(im, target_size, tolerance):
+        thumb = original_thumbnail(im, target_size, tolerance)
+        used["thumbnail"] += thumb is not None
+        return thumb
+
+    original_draft = decoding.draft_for_target
+    original_thumbnail = decoding.thumbnail_for_target
+    monkeypatch.setattr(merge_module, "map_uncompressed", map_uncompressed)
+    monkeypatch.setattr(decoding, "draft_for_target", draft_for_target)
+    monkeypatch.setattr(decoding, "thumbnail_for_target", thumbnail_for_target)
+    return used
+
+
+def _assert_passed(results):
+    failed = [r for r in results if not r.passed]
+    assert not failed, equivalence.format_report(failed)
+
+
+@pytest.mark.parametrize("name", ["opaque", "alpha", "gray", "gray_alpha"])
+def test_synthetic_inputs(name):
+    inputs = {name: equivalence.synthetic_inputs()[name]}
+    _assert_passed(equivalence.run_equivalence(None, inputs, GRID))
+
+
+@pytest.mark.parametrize("name", ["bmp", "pgm", "tiff"])
+def test_uncompressed_files_are_mapped(name, file_inputs, fast_paths):
+    inputs = {name: file_inputs[name]}
+    results = equivalence.run_equivalence(None, inputs, GRID)
+    _assert_passed(results)
+    # 未压缩的输入不需要缩放时按条带粘贴，结果与完整解码逐像素一致
+    assert all(r.exact for r in results)
+    assert fast_paths["mapped"] > 0
+
+
+def test_compressed_files_are_not_probed(file_inputs, fast_paths):
+    # 元数据中的格式不可能未压缩时不打开文件检查能否映射
+    inputs = {"jpeg": file_inputs["jpeg"]}
+    _assert_passed(equivalence.run_equivalence(["mode_preserving"], inputs, GRID))
+    assert fast_paths["probed"] == 0
+
+
+def test_jpeg_reduced_decoding(file_inputs, fast_paths):
+    inputs = {"jpeg": file_inputs["jpeg"]}
+    results = equivalence.run_equivalence(
+        ["low_memory", "exif_thumbnail"], inputs, GRID
+    )
+    _assert_passed(results)
+    assert fast_paths["draft"] > 0
+    assert fast_paths["thumbnail"] > 0
+    # 降采样解码和缩略图的结果与完整解码不同，必须由 PSNR 容差约束
+    assert any(not r.exact for r in results)
@@ -0,0 +1,81 @@
+import os
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from image_process import metadata_index
+from image_process.merge_images import merge_images
+
+
+@pytest.fixture
+def hashed(monkeypatch):
+    """
+    统计读取输入文件内容计算哈希的次数
+    """
+    calls = []
+    original = metadata_index.file_hash
+
+    def counting(path):
+        calls.append(path)
+        return original(path)
+
+    monkeypatch.setattr(metadata_index, "file_hash", counting)
+    return calls
+
+
+def _inputs(tmp_path):
+    paths = []
+    for i in range(2):
+        path = tmp_path / f"in{i}.png"
+        Image.new("RGB", (16, 8), (60 * i, 100, 200)).save(path)
+        paths.append(str(path))
+    return paths
+
+
+def _result_cache(metrics):
+    return (
+        metrics.CACHE_REQUESTS.value(cache="result", result="hit"),
+        metrics.CACHE_REQUESTS.value(cache="result", result="miss"),
+    )
+
+
+def test_unchanged_inputs_are_not_hashed(tmp_path, hashed, enabled_metrics):
+    inputs = _inputs(tmp_path)
+    output = str(tmp_path / "out.png")
+    merge_images(inputs, output)
+    merge_images(inputs, output, force=True)
+    merge_images(inputs, output)
+    assert hashed == []
+    assert _result_cache(enabled_metrics) == (1, 1)
+
+
+def test_touched_input_is_verified_by_hash(tmp_path, hashed, enabled_metrics):
+    inputs = _inputs(tmp_path)
+    output = str(tmp_path / "out.png")
+    # 索引中已有哈希时随指纹一起记录
+    for path in inputs:
+        metadata_index.get_index().get(path, with_hash=True)
+    merge_images(inputs, output)
+    hashed.clear()
+
+    st = os.stat(inputs[0])
+    os.utime(inputs[0], ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    merge_images(inputs, output)
+    assert hashed == [os.path.abspath(inputs[0])]
+    assert _result_cache(enabled_metrics) == (1, 1)
+
+
+def test_edited_profile_invalidates_result(tmp_path, enabled_metrics, other_profile):
+    inputs = _inputs(tmp_path)
+    output = str(tmp_path / "out.png")
+    profile = Path(other_profile)
+    merge_images(inputs, output, color_profile=str(profile))
+    merge_images(inputs, output, color_profile=str(profile))
+    assert _result_cache(enabled_metrics) == (1, 1)
+
+    data = bytearray(profile.read_bytes())
+    data[24:26] = bytes([7, 209])
+    profile.write_bytes(bytes(data))
+    merge_images(inputs, output, color_profile=str(profile))
+    assert _result_cache(enabled_metrics) == (1, 2)
@@ -0,0 +1,53 @@
+from image_process.layout import GridChoice, choose_grid, plan_auto_grid, plan_layout
+
+
+def test_choose_grid_prefers_least_waste_near_target_aspect():
+    sizes = [(50, 50)] * 4
+    choice = choose_grid(sizes, gap=10, divider=False, divider_thickness=0, margin=5)
+    assert choice == GridChoice(2, 2, (50, 50), (120, 120), 120 * 120 - 4 * 50 * 50)
+
+    wide = choose_grid(sizes, 0, False, 0, 0, target_aspect=4.0)
+    assert (wide.cols, wide.rows, wide.canvas_size) == (4, 1, (200, 50))
+
+
+def test_choose_grid_searches_the_other_dimension():
+    sizes = [(50, 50)] * 4
+    assert choose_grid(sizes, 0, False, 0, 0, cols=3)[:2] == (3, 2)
+    assert choose_grid(sizes, 0, False, 0, 0, rows=1)[:2] == (4, 1)
+
+
+def test_choose_grid_cell_is_median_area():
+    # 单元格面积取中位数，较大的输入会被缩小
+    sizes = [(100, 100), (100, 100), (400, 400)]
+    choice = choose_grid(sizes, 0, False, 0, 0)
+    assert choice.cell_size == (100, 100)
+
+
+def test_choose_grid_without_inputs():
+    assert choose_grid([], 0, False, 0, 7) == GridChoice(0, 0, (0, 0), (14, 14), 0)
+
+
+def test_plan_auto_grid_fits_and_aligns_images():
+    sizes = [(40, 20), (20, 40)]
+    plan = plan_auto_grid(sizes, 0, False, 0, "center", 0, cols=2)
+    assert plan.grid == choose_grid(sizes, 0, False, 0, 0, cols=2)
+    assert plan.grid.cell_size == (20, 40)
+    assert plan.canvas_size == (40, 40)
+    # 横图缩小后在单元格内垂直居中
+    assert plan.placements == [(0, 15, 20, 10), (20, 0, 20, 40)]
+    assert plan.dividers == []
+
+    start = plan_auto_grid(sizes, 0, False, 0, "start", 0, cols=2)
+    assert start.placements[0] == (0, 0, 20, 10)
+
+
+def test_plan_auto_grid_dividers_sit_in_gaps():
+    sizes = [(20, 40), (20, 40)]
+    plan = plan_auto_grid(sizes, 4, True, 2, "center", 3, cols=2)
+    assert plan.canvas_size == (3 + 20 + 4 + 2 + 20 + 3, 3 + 40 + 3)
+    assert plan.placements == [(3, 3, 20, 40), (29, 3, 20, 40)]
+    assert plan.dividers == [(25, 3, 26, 42)]
+    assert (
+        plan_layout(sizes, gap=4, divider_thickness=2, margin=3, auto_grid=True, cols=2)
+        == plan
+    )
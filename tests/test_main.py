@@ -0,0 +1,124 @@
+import io
+
+from PIL import Image
+from typer.testing import CliRunner
+
+from image_process.main import app
+from image_process.merge_images import merge_images
+
+
+def _encoded(size, color, fmt):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def _saved(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def _pixels(data):
+    with Image.open(io.BytesIO(data)) as im:
+        return im.size, im.convert("RGBA").tobytes()
+
+
+# 首尾相接的 PNG 和 JPEG 数据，中间夹着 shell 拼接时常见的换行
+PNG = _encoded((30, 20), (200, 40, 40), "PNG")
+JPEG = _encoded((16, 24), (40, 40, 200), "JPEG")
+STDIN_IMAGES = PNG + b"\n" + JPEG
+
+
+def test_cli_prints_grid_used_by_merge(tmp_path):
+    files = []
+    for i, size in enumerate([(60, 40), (40, 60), (50, 50)]):
+        path = tmp_path / f"in{i}.png"
+        Image.new("RGB", size, (80 * i, 100, 50)).save(path)
+        files += ["--files", str(path)]
+    output = tmp_path / "out.png"
+    result = CliRunner().invoke(app, [*files, "-o", str(output), "--auto-grid"])
+    assert result.exit_code == 0, result.output
+    lines = [line for line in result.output.splitlines() if "自动网格" in line]
+    assert len(lines) == 1
+    with Image.open(output) as im:
+        assert lines[0].endswith(f"画布 {im.width}x{im.height}")
+
+
+def test_stdin_images_are_split_and_merged(tmp_path):
+    expected = tmp_path / "expected.png"
+    files = [_saved(tmp_path, "a.png", PNG), _saved(tmp_path, "b.jpg", JPEG)]
+    merge_images(files, str(expected))
+
+    output = tmp_path / "out.png"
+    result = CliRunner().invoke(
+        app, ["--stdin-images", "-o", str(output)], input=STDIN_IMAGES
+    )
+    assert result.exit_code == 0, result.output
+    assert _pixels(output.read_bytes()) == _pixels(expected.read_bytes())
+
+
+def test_stdin_images_follow_files(tmp_path):
+    first = _saved(tmp_path, "first.png", _encoded((10, 10), (0, 200, 0), "PNG"))
+    expected = tmp_path / "expected.png"
+    files = [first, _saved(tmp_path, "a.png", PNG), _saved(tmp_path, "b.jpg", JPEG)]
+    merge_images(files, str(expected))
+
+    output = tmp_path / "out.png"
+    result = CliRunner().invoke(
+        app, ["-f", first, "--stdin-images", "-o", str(output)], input=STDIN_IMAGES
+    )
+    assert result.exit_code == 0, result.output
+    assert _pixels(output.read_bytes()) == _pixels(expected.read_bytes())
+
+
+def test_stdin_images_to_stdout(tmp_path):
+    expected = tmp_path / "expected.png"
+    files = [_saved(tmp_path, "a.png", PNG), _saved(tmp_path, "b.jpg", JPEG)]
+    merge_images(files, str(expected))
+
+    result = CliRunner().invoke(
+        app, ["--stdin-images", "-o", "-", "--format", "PNG"], input=STDIN_IMAGES
+    )
+    assert result.exit_code == 0, result.stderr
+    # 标准输出只有图片数据，提示信息写入标准错误
+    assert _pixels(result.stdout_bytes) == _pixels(expected.read_bytes())
+    assert "<标准输出>" in result.stderr
+
+
+def test_files_from_stdin_path_list(tmp_path):
+    files = [_saved(tmp_path, "a.png", PNG), _saved(tmp_path, "b.jpg", JPEG)]
+    expected = tmp_path / "expected.png"
+    merge_images(files, str(expected))
+
+    output = tmp_path / "out.png"
+    result = CliRunner().invoke(
+        app, ["-f", "-", "-o", str(output)], input="\n".join(files) + "\n"
+    )
+    assert result.exit_code == 0, result.output
+    assert output.read_bytes() == expected.read_bytes()
+
+
+def test_stdout_requires_format(tmp_path):
+    result = CliRunner().invoke(app, ["--stdin-images", "-o", "-"], input=PNG)
+    assert result.exit_code == 1
+    assert "--format" in result.stderr
+    assert result.stdout_bytes == b""
+
+
+def test_path_list_and_stdin_images_are_exclusive():
+    result = CliRunner().invoke(
+        app, ["-f", "-", "--stdin-images", "-o", "out.png"], input=STDIN_IMAGES
+    )
+    assert result.exit_code == 1
+    assert "--stdin-images" in result.stderr
+
+
+def test_invalid_stdin_data_is_reported(tmp_path):
+    output = tmp_path / "out.png"
+    result = CliRunner().invoke(
+        app, ["--stdin-images", "-o", str(output)], input=PNG + b"not an image"
+    )
+    assert result.exit_code == 1
+    assert "合并图片时出错" in result.stderr
+    assert not output.exists()
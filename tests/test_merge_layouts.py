@@ -0,0 +1,101 @@
+from collections import Counter
+
+import pytest
+from PIL import Image
+
+from image_process import merge_images as merge_module
+from image_process.merge_images import merge_images, merge_layouts
+
+LAYOUTS = [
+    {"output": "a.png"},
+    {"output": "b.png", "orientation": "vertical", "gap": 4, "divider": False},
+    {"output": "c.png", "cols": 2, "margin": 3},
+    {"output": "d.png", "uniform_height": 20},
+    {"output": "e.jpg", "auto_grid": True, "align": "start"},
+]
+
+
+def _inputs(tmp_path, count=3):
+    paths = []
+    for i in range(count):
+        path = tmp_path / f"in{i}.png"
+        Image.new("RGB", (30 + 10 * i, 24 + 6 * i), (50 * i, 120, 220)).save(path)
+        paths.append(str(path))
+    return paths
+
+
+def _outputs(directory, layouts):
+    directory.mkdir()
+    return [
+        dict(layout, output=str(directory / layout["output"])) for layout in layouts
+    ]
+
+
+def _separately(files, layouts):
+    for layout in layouts:
+        options = dict(layout)
+        merge_images(files, options.pop("output"), **options)
+
+
+@pytest.fixture
+def decodes(monkeypatch):
+    """
+    统计每个输入被打开解码的次数
+    """
+    counts = Counter()
+
+    def counting(opener):
+        def open_counted(source, *args):
+            counts[source] += 1
+            return opener(source, *args)
+
+        return open_counted
+
+    monkeypatch.setattr(merge_module, "open_source", counting(merge_module.open_source))
+    monkeypatch.setattr(
+        merge_module, "open_reduced", counting(merge_module.open_reduced)
+    )
+    return counts
+
+
+def test_layouts_match_separate_merges(tmp_path):
+    files = _inputs(tmp_path)
+    expected = _outputs(tmp_path / "expected", LAYOUTS)
+    actual = _outputs(tmp_path / "actual", LAYOUTS)
+    _separately(files, expected)
+    merge_layouts(files, actual)
+    for want, got in zip(expected, actual):
+        with open(want["output"], "rb") as f1, open(got["output"], "rb") as f2:
+            assert f2.read() == f1.read(), got["output"]
+
+
+@pytest.mark.parametrize("thumbnail_tolerance", [None, 0.5])
+def test_each_input_is_decoded_once(tmp_path, decodes, thumbnail_tolerance):
+    files = _inputs(tmp_path)
+    layouts = [
+        dict(layout, thumbnail_tolerance=thumbnail_tolerance)
+        for layout in _outputs(tmp_path / "out", LAYOUTS)
+    ]
+    merge_layouts(files, layouts)
+    assert decodes == {f: 1 for f in files}
+
+
+def test_mixed_separate_and_shared_layouts(tmp_path, other_profile):
+    files = _inputs(tmp_path)
+    layouts = [
+        {"output": "shared.png"},
+        {"output": "low_memory.png", "low_memory": True},
+        {"output": "atlas.png", "atlas": True},
+        {"output": "srgb.png", "cols": 2, "color_profile": "srgb"},
+        {"output": "other.png", "color_profile": other_profile},
+        {"output": "shared_grid.png", "cols": 2},
+    ]
+    expected = _outputs(tmp_path / "expected", layouts)
+    actual = _outputs(tmp_path / "actual", layouts)
+    _separately(files, expected)
+    results = merge_layouts(files, actual)
+    # 单独完成的布局先于共用解码的布局生成，结果仍按 layouts 的顺序返回
+    assert results == [layout["output"] for layout in actual]
+    for want, got in zip(expected, actual):
+        with open(want["output"], "rb") as f1, open(got["output"], "rb") as f2:
+            assert f2.read() == f1.read(), got["output"]
@@ -0,0 +1,36 @@
+from PIL import Image
+
+from image_process.merge_images import merge_images
+from image_process.metadata_index import MetadataIndex
+
+
+def test_forget_missing_keeps_existing_files(tmp_path):
+    index = MetadataIndex(":memory:")
+    paths = []
+    for name in ("a.png", "b.webp", "c.png"):
+        path = tmp_path / name
+        Image.new("RGB", (4, 4)).save(path)
+        paths.append(str(path))
+    index.get_many(paths)
+
+    # 扫描只列出了 a.png：b.webp 仍然存在，c.png 已被删除
+    (tmp_path / "c.png").unlink()
+    assert index.forget_missing(str(tmp_path), [paths[0]]) == 1
+    assert index.probes == 3
+    index.get_many(paths[:2])
+    assert index.probes == 3
+    index.close()
+
+
+def test_merge_looks_up_each_input_once(tmp_path, enabled_metrics):
+    paths = []
+    for i in range(2):
+        path = tmp_path / f"in{i}.png"
+        Image.new("RGB", (8, 4)).save(path)
+        paths.append(str(path))
+    merge_images(paths, str(tmp_path / "out.png"))
+    requests = enabled_metrics.CACHE_REQUESTS
+    lookups = requests.value(cache="metadata", result="hit") + requests.value(
+        cache="metadata", result="miss"
+    )
+    assert lookups == 2
@@ -0,0 +1,42 @@
+import os
+import threading
+
+import pytest
+from PIL import Image
+
+from image_process.merge_images import merge_images
+
+# 等待事件的超时（秒），避免测试失败时卡住
+TIMEOUT = 10
+
+
+def test_input_bytes_are_decoded_file_sizes(tmp_path, enabled_metrics):
+    files = []
+    for i in range(2):
+        path = tmp_path / f"in{i}.png"
+        Image.new("RGB", (20 + i, 10), (90 * i, 30, 200)).save(path)
+        files.append(str(path))
+    merge_images(files, str(tmp_path / "out.png"))
+
+    sizes = sum(os.path.getsize(f) for f in files)
+    assert enabled_metrics.INPUT_BYTES.value() == sizes
+    text = enabled_metrics.REGISTRY.render()
+    assert f"image_process_input_bytes_total {sizes}" in text
+
+
+@pytest.mark.parametrize(
+    "metric, reader", [("INPUT_BYTES", "value"), ("MERGE_SECONDS", "count")]
+)
+def test_readers_wait_for_writers(enabled_metrics, metric, reader):
+    instance = getattr(enabled_metrics, metric)
+    done = threading.Event()
+
+    def read():
+        getattr(instance, reader)()
+        done.set()
+
+    with instance._lock:
+        threading.Thread(target=read).start()
+        # 持有锁时读取被阻塞
+        assert not done.wait(0.1)
+    assert done.wait(TIMEOUT)
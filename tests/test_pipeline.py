@@ -0,0 +1,163 @@
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+from image_process import pipeline
+from image_process.merge_images import merge_images
+from image_process.pipeline import MergePipeline
+
+# 各阶段等待事件的超时（秒），避免测试失败时卡住
+TIMEOUT = 10
+
+
+def _inputs(directory, count=2, prefix="in"):
+    directory.mkdir(exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = directory / f"{prefix}{i}.png"
+        Image.new("RGB", (24 + 8 * i, 16 + 4 * i), (40 * i, 120, 200)).save(path)
+        paths.append(str(path))
+    return paths
+
+
+def _animated(path):
+    frames = [Image.new("RGB", (12, 12), (60 * i, 0, 0)) for i in range(3)]
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=100)
+    return str(path)
+
+
+JOBS = [
+    ("a.png", {}),
+    ("b.png", {"orientation": "vertical", "gap": 3, "divider": False}),
+    ("c.jpg", {"cols": 2, "margin": 5}),
+    ("d.png", {"auto_grid": True, "align": "start"}),
+    # 以下任务交给 merge_images 完整执行
+    ("e.png", {"low_memory": True, "uniform_height": 10}),
+    ("f.png", {"atlas": True, "gap": 1}),
+]
+
+
+def test_outputs_match_merge_images(tmp_path):
+    files = _inputs(tmp_path / "in", count=3)
+    expected_dir = tmp_path / "expected"
+    expected_dir.mkdir()
+    for name, options in JOBS:
+        merge_images(files, str(expected_dir / name), **options)
+
+    actual_dir = tmp_path / "actual"
+    actual_dir.mkdir()
+    with MergePipeline(queue_size=1) as pipe:
+        futures = [
+            pipe.submit(files, str(actual_dir / name), **options)
+            for name, options in JOBS
+        ]
+    for (name, _), future in zip(JOBS, futures):
+        assert future.result() == str(actual_dir / name)
+        assert (actual_dir / name).read_bytes() == (expected_dir / name).read_bytes()
+
+
+def test_animated_job_is_delegated(tmp_path):
+    files = [_animated(tmp_path / "a.gif"), _inputs(tmp_path / "in", count=1)[0]]
+    merge_images(files, str(tmp_path / "expected.gif"))
+    with MergePipeline() as pipe:
+        future = pipe.submit(files, str(tmp_path / "actual.gif"))
+    future.result()
+    with Image.open(tmp_path / "actual.gif") as im:
+        assert im.n_frames == 3
+    assert (tmp_path / "actual.gif").read_bytes() == (
+        tmp_path / "expected.gif"
+    ).read_bytes()
+
+
+def test_next_job_decodes_while_encoding(tmp_path, monkeypatch):
+    first = _inputs(tmp_path / "first", prefix="first")
+    second = _inputs(tmp_path / "second", prefix="second")
+    second_decoded = threading.Event()
+    overlapped = []
+
+    open_in_mode = pipeline._open_in_mode
+    save_canvas = pipeline._save_canvas
+
+    def opening(source, *args):
+        if source in second:
+            second_decoded.set()
+        return open_in_mode(source, *args)
+
+    def saving(canvas, output, *args):
+        if output.endswith("first.png"):
+            # 编码第一个任务时等待第二个任务开始解码
+            overlapped.append(second_decoded.wait(TIMEOUT))
+        return save_canvas(canvas, output, *args)
+
+    monkeypatch.setattr(pipeline, "_open_in_mode", opening)
+    monkeypatch.setattr(pipeline, "_save_canvas", saving)
+    with MergePipeline() as pipe:
+        pipe.submit(first, str(tmp_path / "first.png"))
+        pipe.submit(second, str(tmp_path / "second.png"))
+    assert overlapped == [True]
+
+
+def test_bounded_queues_apply_backpressure(tmp_path, monkeypatch):
+    files = _inputs(tmp_path / "in")
+    release = threading.Event()
+    decoded = []
+
+    decode_job = MergePipeline._decode_job
+    save_canvas = pipeline._save_canvas
+
+    def decoding(self, job):
+        decoded.append(job.output)
+        return decode_job(self, job)
+
+    def saving(*args):
+        release.wait(TIMEOUT)
+        return save_canvas(*args)
+
+    monkeypatch.setattr(MergePipeline, "_decode_job", decoding)
+    monkeypatch.setattr(pipeline, "_save_canvas", saving)
+    pipe = MergePipeline(queue_size=1)
+    futures = [pipe.submit(files, str(tmp_path / f"out{i}.png")) for i in range(8)]
+    # 编码阻塞时：编码中 1 个、编码队列 1 个、合成中 1 个、合成队列 1 个、
+    # 解码完成等待入队 1 个，其余任务不会被解码
+    deadline = time.monotonic() + TIMEOUT
+    while len(decoded) < 5 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.2)
+    assert len(decoded) == 5
+    assert not any(f.done() for f in futures)
+
+    release.set()
+    # close 等待队列中的全部任务完成
+    pipe.close()
+    assert len(decoded) == 8
+    assert all(f.done() and f.exception() is None for f in futures)
+    assert all((tmp_path / f"out{i}.png").exists() for i in range(8))
+
+
+def test_failed_job_does_not_stop_pipeline(tmp_path):
+    files = _inputs(tmp_path / "in")
+    with MergePipeline() as pipe:
+        failed = pipe.submit([str(tmp_path / "missing.png")], str(tmp_path / "x.png"))
+        ok = pipe.submit(files, str(tmp_path / "ok.png"))
+    with pytest.raises(OSError):
+        failed.result()
+    assert ok.result() == str(tmp_path / "ok.png")
+
+
+def test_base_exception_is_not_swallowed(tmp_path, monkeypatch):
+    files = _inputs(tmp_path / "in")
+    errors = []
+    monkeypatch.setattr(threading, "excepthook", lambda args: errors.append(args))
+
+    def interrupted(self, job):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(MergePipeline, "_decode_job", interrupted)
+    pipe = MergePipeline()
+    future = pipe.submit(files, str(tmp_path / "out.png"))
+    with pytest.raises(KeyboardInterrupt):
+        future.result(TIMEOUT)
+    pipe._stages[0].threads[0].join(TIMEOUT)
+    assert [e.exc_type for e in errors] == [KeyboardInterrupt]
@@ -0,0 +1,65 @@
+import io
+import random
+
+import pytest
+from PIL import Image
+
+from image_process import png_encoder
+from image_process.merge_images import merge_images
+
+WIDTH = 37
+BYTES_PER_PIXEL = {"L": 1, "LA": 2, "RGB": 3, "RGBA": 4, "I;16": 2, "P": 1}
+
+
+def _image(mode, height):
+    """
+    渐变行与噪声行交替，让各块选用不同的过滤方式
+    """
+    rng = random.Random(height)
+    row_bytes = WIDTH * BYTES_PER_PIXEL[mode]
+    data = bytearray()
+    for y in range(height):
+        if y // 3 % 2:
+            data += rng.randbytes(row_bytes)
+        else:
+            data += bytes((x * 5 + y * 3) % 256 for x in range(row_bytes))
+    im = Image.frombytes(mode, (WIDTH, height), bytes(data))
+    if mode == "P":
+        im.putpalette(bytes(range(256)) * 3)
+    return im
+
+
+def _rows_per_chunk(mode):
+    return png_encoder.CHUNK_BYTES // (1 + WIDTH * BYTES_PER_PIXEL[mode])
+
+
+@pytest.mark.parametrize("mode", ["RGB", "L", "RGBA", "I;16", "LA", "P"])
+def test_threaded_output_decodes_to_input(mode, monkeypatch):
+    # 块很小，预设字典跨越前面多块
+    monkeypatch.setattr(png_encoder, "CHUNK_BYTES", 1024)
+    rows = _rows_per_chunk(mode)
+    for height in (1, rows - 1, rows, rows + 1, 3 * rows, 3 * rows + 1):
+        im = _image(mode, height)
+        buffer = io.BytesIO()
+        png_encoder.save_png(im, buffer, threads=3)
+        buffer.seek(0)
+        with Image.open(buffer) as out:
+            out.load()
+            assert out.mode == im.mode
+            assert out.size == im.size
+            assert out.tobytes() == im.tobytes(), (mode, height)
+
+
+def test_merge_with_png_threads_matches_pixels(tmp_path, monkeypatch):
+    monkeypatch.setattr(png_encoder, "CHUNK_BYTES", 4096)
+    paths = []
+    for i, mode in enumerate(["RGB", "RGBA"]):
+        path = tmp_path / f"in{i}.png"
+        _image(mode, 50 + 7 * i).save(path)
+        paths.append(str(path))
+    merge_images(paths, str(tmp_path / "single.png"))
+    merge_images(paths, str(tmp_path / "threaded.png"), png_threads=2)
+    with Image.open(tmp_path / "single.png") as single:
+        with Image.open(tmp_path / "threaded.png") as threaded:
+            assert threaded.mode == single.mode
+            assert threaded.tobytes() == single.tobytes()
@@ -0,0 +1,53 @@
+from PIL import Image
+from rich.color import Color
+from rich.style import Style
+
+from image_process.preview import UPPER_HALF_BLOCK, to_half_blocks
+
+RED = (255, 0, 0)
+GREEN = (0, 255, 0)
+BLUE = (0, 0, 255)
+WHITE = (255, 255, 255)
+
+
+def _image(rows):
+    im = Image.new("RGB", (len(rows[0]), len(rows)))
+    im.putdata([pixel for row in rows for pixel in row])
+    return im
+
+
+def _spans(text):
+    return [(span.start, span.end, span.style) for span in text.spans]
+
+
+def _style(top, bottom):
+    return Style(color=Color.from_rgb(*top), bgcolor=Color.from_rgb(*bottom))
+
+
+def test_half_blocks_pair_rows_and_merge_runs():
+    image = _image(
+        [
+            [RED, GREEN],
+            [BLUE, BLUE],
+            [WHITE, WHITE],
+            [BLUE, BLUE],
+        ]
+    )
+    text = to_half_blocks(image)
+    # 每个字符上半为前景色（上方像素），下半为背景色（下方像素）
+    assert text.plain == f"{UPPER_HALF_BLOCK * 2}\n{UPPER_HALF_BLOCK * 2}"
+    assert _spans(text) == [
+        (0, 1, _style(RED, BLUE)),
+        (1, 2, _style(GREEN, BLUE)),
+        # 颜色相同的相邻字符合并为一段
+        (3, 5, _style(WHITE, BLUE)),
+    ]
+
+
+def test_half_blocks_odd_height_repeats_last_row():
+    text = to_half_blocks(_image([[RED, GREEN], [BLUE, WHITE], [GREEN, RED]]))
+    assert text.plain.split("\n") == [UPPER_HALF_BLOCK * 2] * 2
+    assert _spans(text)[2:] == [
+        (3, 4, _style(GREEN, GREEN)),
+        (4, 5, _style(RED, RED)),
+    ]
@@ -0,0 +1,77 @@
+import io
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+from image_process import remote
+
+
+def _png() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 6), (10, 20, 30)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        queue = self.server.statuses.get(self.path, [])
+        status = queue.pop(0) if queue else 200
+        body = _png() if status == 200 else b""
+        self.send_response(status)
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        # 响应没有声明关闭连接，但服务器随后关闭了连接
+        self.close_connection = self.path.startswith("/stale")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    """
+    每个测试一个的本地服务器，记录收到的请求
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        # 每个路径依次返回的状态码，用完后返回 200
+        self.statuses = {}
+        self.requests = []
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+
+
+@pytest.fixture
+def server():
+    httpd = _Server()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_stale_keep_alive_is_not_a_retry(server):
+    pool = remote.ConnectionPool()
+    for _ in range(3):
+        im = remote.fetch_image(f"{server.url}/stale.png", retries=0, pool=pool)
+        assert im.size == (8, 6)
+    pool.close()
+
+
+def test_retry_after_is_honoured(server, monkeypatch):
+    monkeypatch.setattr(remote, "RETRY_BACKOFF", 0.01)
+    server.statuses["/busy.png"] = [429]
+    start = time.perf_counter()
+    im = remote.fetch_image(f"{server.url}/busy.png", retries=1)
+    assert im.size == (8, 6)
+    assert time.perf_counter() - start >= 0.9
+    assert server.requests.count("/busy.png") == 2
@@ -0,0 +1,114 @@
+import io
+import tarfile
+import zipfile
+
+import pytest
+from PIL import Image
+
+from image_process import sources
+from image_process.merge_images import merge_images
+from image_process.sources import (
+    open_source,
+    resolve_sources,
+    source_modes,
+    source_sizes,
+)
+
+MEMBERS = {
+    "a.png": ((20, 14), "PNG"),
+    "dir/b.jpg": ((32, 24), "JPEG"),
+    "c.png": ((12, 30), "PNG"),
+}
+
+
+def _member_data():
+    data = {}
+    for i, (name, (size, fmt)) in enumerate(MEMBERS.items()):
+        buffer = io.BytesIO()
+        Image.new("RGB", size, (70 * i, 120, 200)).save(buffer, fmt)
+        data[name] = buffer.getvalue()
+    return data
+
+
+def _archive(tmp_path, kind):
+    data = _member_data()
+    data["notes.txt"] = b"not an image"
+    if kind == "zip":
+        path = tmp_path / "bundle.zip"
+        with zipfile.ZipFile(path, "w") as zf:
+            for name, body in data.items():
+                zf.writestr(name, body)
+    else:
+        path = tmp_path / f"bundle.{kind}"
+        with tarfile.open(path, "w:gz" if kind == "tar.gz" else "w") as tf:
+            for name, body in data.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(body)
+                tf.addfile(info, io.BytesIO(body))
+    return str(path)
+
+
+def _extracted(tmp_path):
+    paths = []
+    for name, body in _member_data().items():
+        path = tmp_path / name.replace("/", "_")
+        path.write_bytes(body)
+        paths.append(str(path))
+    return paths
+
+
+@pytest.mark.parametrize("kind", ["zip", "tar", "tar.gz"])
+def test_archive_merge_matches_extracted_files(tmp_path, kind):
+    archive = _archive(tmp_path, kind)
+    merge_images([archive], str(tmp_path / "archive.png"))
+    merge_images(_extracted(tmp_path), str(tmp_path / "files.png"))
+    with Image.open(tmp_path / "archive.png") as a, Image.open(
+        tmp_path / "files.png"
+    ) as b:
+        assert a.size == b.size
+        assert a.tobytes() == b.tobytes()
+
+    # 单个成员按 archive::member 引用
+    member = resolve_sources([f"{archive}::dir/b.jpg"])[0]
+    assert member.source_name == f"{archive}::dir/b.jpg"
+    assert source_sizes([member]) == [(32, 24)]
+
+
+@pytest.mark.parametrize("kind", ["zip", "tar"])
+def test_members_are_read_when_opened(tmp_path, kind, monkeypatch):
+    archive = _archive(tmp_path, kind)
+    reads = []
+    if kind == "zip":
+        read = zipfile.ZipFile.read
+        monkeypatch.setattr(
+            zipfile.ZipFile,
+            "read",
+            lambda self, info: reads.append(info.filename) or read(self, info),
+        )
+    else:
+        read_range = sources._read_range
+        monkeypatch.setattr(
+            sources,
+            "_read_range",
+            lambda *args: reads.append(args[1]) or read_range(*args),
+        )
+
+    members = resolve_sources([archive])
+    # 展开压缩包只读取图片头
+    assert reads == []
+    assert source_sizes(members) == [size for size, _ in MEMBERS.values()]
+    assert source_modes(members) == [("RGB", False)] * len(MEMBERS)
+
+    with open_source(members[1]) as im:
+        assert im.format == "JPEG"
+        im.load()
+    assert len(reads) == 1
+    # 每次打开都重新读取，关闭后不保留成员数据
+    open_source(members[1]).close()
+    assert len(reads) == 2
+
+
+def test_missing_member_is_reported(tmp_path):
+    archive = _archive(tmp_path, "zip")
+    with pytest.raises(FileNotFoundError, match="missing.png"):
+        resolve_sources([f"{archive}::missing.png"])
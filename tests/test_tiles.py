@@ -0,0 +1,51 @@
+import os
+
+from PIL import Image
+
+from image_process import tiles
+
+
+def _work_dir(tmp_path):
+    paths = []
+    for i in range(2):
+        path = tmp_path / f"in{i}.png"
+        Image.new("RGB", (40, 40), (60 * i, 100, 200)).save(path)
+        paths.append(str(path))
+    work_dir = str(tmp_path / "work")
+    tiles.plan_tiles(paths, work_dir, tile_size=32)
+    return work_dir
+
+
+def test_stale_lock_is_taken_over(tmp_path):
+    work_dir = _work_dir(tmp_path)
+    path = tiles._lock_path(work_dir, 0)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("{}")
+    os.utime(path, (0, 0))
+    lock = tiles.claim_tile(work_dir, 0, stale_after=60)
+    assert lock is not None
+    assert tiles._read_lock(path)["token"] == lock.token
+    lock.release()
+    assert not os.path.exists(path)
+
+
+def test_live_lock_is_not_stolen(tmp_path, monkeypatch):
+    work_dir = _work_dir(tmp_path)
+    holder = tiles.claim_tile(work_dir, 0, stale_after=60)
+    assert holder is not None
+
+    # 模拟判断失效之后、改名之前锁已被其他进程接管：第一次判断认为失效
+    checks = []
+    is_stale = tiles._is_stale
+
+    def racing(path, stale_after):
+        checks.append(path)
+        return len(checks) == 1 or is_stale(path, stale_after)
+
+    monkeypatch.setattr(tiles, "_is_stale", racing)
+    assert tiles.claim_tile(work_dir, 0, stale_after=60) is None
+    assert len(checks) == 2
+    # 新锁放回原处，没有留下改名后的文件
+    assert tiles._read_lock(holder.path)["token"] == holder.token
+    assert os.listdir(os.path.dirname(holder.path)) == [os.path.basename(holder.path)]
+    holder.release()